@@ -0,0 +1,297 @@
+"""Нагрузочный тест сервера ВМ.
+
+Запускает сервер в отдельном процессе (или подключается к уже запущенному),
+моделирует N виртуальных машин, каждая со своим соединением, и выполняет
+выбранный профиль нагрузки. Печатает пропускную способность и задержки
+p50/p95/p99 по командам, сохраняет результат в JSON и сравнивает его
+с предыдущим прогоном.
+
+    python -m bench.run --workload auth-storm --vms 500 --duration 10 --out auth.json
+    python -m bench.run --workload mixed --storage memory --compare auth.json
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import multiprocessing
+import random
+import sys
+import time
+
+BUSY_REPLY = "Сервер перегружен, повторите позже"
+ERROR_PREFIXES = ("Ошибка", "Неверн", "Неизвестная", BUSY_REPLY)
+# Команда выполнена, но не изменила данные: такие ответы считаются отдельно от ошибок
+REJECTED_MARKERS = ("не найден", "уже существует")
+
+
+class VMState:
+    """Состояние одной моделируемой ВМ: добавленные ею диски.
+
+    REMOVE_DISK удаляет последний добавленный диск, а не угаданный ID.
+    """
+
+    def __init__(self, vm_id):
+        self.vm_id = vm_id
+        self.counter = itertools.count(1)
+        self.disks = []
+
+    def add_disk(self) -> str:
+        disk_id = f"{self.vm_id}-d{next(self.counter)}"
+        self.disks.append(disk_id)
+        return disk_id
+
+    def remove_disk(self):
+        """ID диска для удаления или None, если у ВМ нет дисков."""
+        return self.disks.pop() if self.disks else None
+
+
+def remove_disk(vm):
+    disk_id = vm.remove_disk()
+    return f"REMOVE_DISK {disk_id}" if disk_id else None
+
+
+# Профили нагрузки: команда -> (вес, построитель строки команды по состоянию ВМ;
+# None — команду сейчас выполнить нельзя, выбирается другая)
+WORKLOADS = {
+    "auth-storm": {
+        "AUTH": (90, lambda vm: f"AUTH {vm.vm_id} 2048 2"),
+        "LOGOUT_VM": (10, lambda vm: f"LOGOUT_VM {vm.vm_id}"),
+    },
+    "disk-burst": {
+        "ADD_DISK": (70, lambda vm: f"ADD_DISK {vm.add_disk()} {vm.vm_id} 10"),
+        "REMOVE_DISK": (30, remove_disk),
+    },
+    "list-scan": {
+        "LIST_VMS": (40, lambda vm: "LIST_VMS LIMIT 100"),
+        "LIST_AUTH_VMS": (30, lambda vm: "LIST_AUTH_VMS LIMIT 100"),
+        "LIST_DISKS": (20, lambda vm: "LIST_DISKS LIMIT 100"),
+        "CHECK_ALL_VMS": (10, lambda vm: "CHECK_ALL_VMS LIMIT 100"),
+    },
+    "mixed": {
+        "AUTH": (50, lambda vm: f"AUTH {vm.vm_id} 2048 2"),
+        "UPDATE_VM": (10, lambda vm: f"UPDATE_VM {vm.vm_id} 2048 2"),
+        "ADD_DISK": (15, lambda vm: f"ADD_DISK {vm.add_disk()} {vm.vm_id} 10"),
+        "REMOVE_DISK": (10, remove_disk),
+        "LIST_VMS": (10, lambda vm: "LIST_VMS LIMIT 100"),
+        "STATS": (5, lambda vm: "STATS"),
+    },
+}
+
+
+async def read_reply(reader):
+    """Читает один ответ сервера: строки до пустой строки."""
+    lines = []
+    while True:
+        line = await reader.readline()
+        if not line:
+            raise ConnectionError("сервер закрыл соединение")
+        line = line.decode().rstrip("\n")
+        if not line:
+            return "\n".join(lines)
+        lines.append(line)
+
+
+async def provision(host, port, vm_ids, batch=5000):
+    """Регистрирует все ВМ пакетными командами до начала замера."""
+    reader, writer = await asyncio.open_connection(host, port)
+    for start in range(0, len(vm_ids), batch):
+        chunk = vm_ids[start:start + batch]
+        writer.write(("BULK_AUTH " + " ".join(f"{vm} 2048 2" for vm in chunk) + "\n").encode())
+        await writer.drain()
+        await read_reply(reader)
+    writer.close()
+
+
+async def simulate_vm(host, port, vm_id, workload, deadline, depth, samples, errors, rejected):
+    """Одна ВМ: свое соединение, команды по профилю, до depth команд в полете."""
+    names = list(workload)
+    weights = [workload[name][0] for name in names]
+    reader, writer = await asyncio.open_connection(host, port)
+    vm = VMState(vm_id)
+    in_flight = asyncio.Queue(depth)
+
+    async def send():
+        while time.perf_counter() < deadline:
+            name = random.choices(names, weights)[0]
+            command = workload[name][1](vm)
+            if command is None:
+                continue
+            await in_flight.put((name, time.perf_counter()))
+            writer.write((command + "\n").encode())
+            await writer.drain()
+        await in_flight.put(None)
+
+    async def receive():
+        while (item := await in_flight.get()) is not None:
+            name, sent = item
+            reply = await read_reply(reader)
+            samples[name].append(time.perf_counter() - sent)
+            if reply.startswith(ERROR_PREFIXES):
+                errors[name] += 1
+            elif any(marker in reply for marker in REJECTED_MARKERS):
+                rejected[name] += 1
+
+    try:
+        await asyncio.gather(send(), receive())
+    finally:
+        writer.close()
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def summarize(samples, errors, rejected, elapsed):
+    """Итоги по командам и TOTAL. errors — ошибки и отказы сервера, rejected — ответы
+    «не найден» / «уже существует»: команда выполнена, но данные не изменила."""
+    results = {}
+    for name, values in sorted(samples.items()):
+        values.sort()
+        results[name] = {
+            "count": len(values),
+            "errors": errors[name],
+            "rejected": rejected[name],
+            "throughput": len(values) / elapsed,
+            "p50_ms": percentile(values, 0.50) * 1000,
+            "p95_ms": percentile(values, 0.95) * 1000,
+            "p99_ms": percentile(values, 0.99) * 1000,
+        }
+    total = sorted(itertools.chain.from_iterable(samples.values()))
+    results["TOTAL"] = {
+        "count": len(total),
+        "errors": sum(errors.values()),
+        "rejected": sum(rejected.values()),
+        "throughput": len(total) / elapsed,
+        "p50_ms": percentile(total, 0.50) * 1000,
+        "p95_ms": percentile(total, 0.95) * 1000,
+        "p99_ms": percentile(total, 0.99) * 1000,
+    }
+    return results
+
+
+async def run_benchmark(args):
+    workload = WORKLOADS[args.workload]
+    vm_ids = [f"bench-vm{i}" for i in range(args.vms)]
+    await provision(args.host, args.port, vm_ids)
+
+    samples = {name: [] for name in workload}
+    errors = {name: 0 for name in workload}
+    rejected = {name: 0 for name in workload}
+    started = time.perf_counter()
+    deadline = started + args.duration
+    await asyncio.gather(*[
+        simulate_vm(args.host, args.port, vm_id, workload, deadline, args.depth, samples, errors,
+                    rejected)
+        for vm_id in vm_ids
+    ])
+    return summarize(samples, errors, rejected, time.perf_counter() - started)
+
+
+def serve(port, storage, storage_dir):
+    """Точка входа процесса с сервером для локального прогона."""
+    from server.server import VMServer
+    db_manager = None
+    if storage == "memory":
+        from server.memory_storage import MemoryStorage
+        db_manager = MemoryStorage(storage_dir)
+    asyncio.run(VMServer(db_manager).start("127.0.0.1", port))
+
+
+async def wait_for_port(host, port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection(host, port)
+            writer.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.2)
+
+
+def print_table(results):
+    print(f"{'command':<16}{'count':>10}{'errors':>8}{'rejected':>10}{'ops/s':>12}{'p50 ms':>10}"
+          f"{'p95 ms':>10}{'p99 ms':>10}")
+    for name, r in results.items():
+        print(f"{name:<16}{r['count']:>10}{r['errors']:>8}{r.get('rejected', 0):>10}"
+              f"{r['throughput']:>12.1f}"
+              f"{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}{r['p99_ms']:>10.2f}")
+
+
+def compare(results, baseline, threshold):
+    """Сравнивает с прошлым прогоном. Возвращает список найденных регрессий."""
+    regressions = []
+    for name, base in baseline["results"].items():
+        current = results.get(name)
+        if current is None:
+            continue
+        if current["throughput"] < base["throughput"] * (1 - threshold):
+            regressions.append(f"{name}: пропускная способность {base['throughput']:.1f} -> "
+                               f"{current['throughput']:.1f} ops/s")
+        if current["p99_ms"] > base["p99_ms"] * (1 + threshold):
+            regressions.append(f"{name}: p99 {base['p99_ms']:.2f} -> {current['p99_ms']:.2f} мс")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест сервера ВМ")
+    parser.add_argument("--workload", choices=sorted(WORKLOADS), default="mixed")
+    parser.add_argument("--vms", type=int, default=100, help="число ВМ (соединений)")
+    parser.add_argument("--duration", type=float, default=10, help="длительность замера, с")
+    parser.add_argument("--depth", type=int, default=1, help="команд в полете на соединение")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18888)
+    parser.add_argument("--storage", choices=("postgres", "memory"), default="postgres",
+                        help="хранилище локально запущенного сервера")
+    parser.add_argument("--storage-dir", default="",
+                        help="каталог журнала и снимков хранилища memory (пусто — без диска)")
+    parser.add_argument("--external", action="store_true",
+                        help="не запускать сервер, подключиться к --host:--port")
+    parser.add_argument("--out", help="куда сохранить результаты в JSON")
+    parser.add_argument("--compare", help="JSON прошлого прогона для поиска регрессий")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="допустимое ухудшение при сравнении (доля)")
+    args = parser.parse_args()
+
+    server = None
+    if not args.external:
+        server = multiprocessing.get_context("spawn").Process(
+            target=serve, args=(args.port, args.storage, args.storage_dir), daemon=True
+        )
+        server.start()
+    try:
+        asyncio.run(wait_for_port(args.host, args.port))
+        results = asyncio.run(run_benchmark(args))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.join()
+
+    print_table(results)
+    report = {
+        "workload": args.workload,
+        "vms": args.vms,
+        "duration": args.duration,
+        "depth": args.depth,
+        "storage": "external" if args.external else args.storage,
+        "timestamp": time.time(),
+        "results": results,
+    }
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for regression in regressions:
+            print(f"РЕГРЕССИЯ {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
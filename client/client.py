@@ -1,11 +1,37 @@
+"""Клиент сервера ВМ для командной строки.
+
+Без параметров работает интерактивно. С --script (или - для stdin) выполняет
+команды из файла без ожидания ответов на предыдущие и печатает ответы
+в stdout в формате протокола: строки ответа и пустая строка.
+
+    python -m client.client
+    python -m client.client --script commands.txt
+    generate_commands | python -m client.client --script - > replies.txt
+"""
+import argparse
 import asyncio
+import sys
+
 from loguru import logger as log
 
+async def read_reply(reader):
+    """Читает один ответ сервера: строки до пустой строки. None, если соединение закрыто."""
+    lines = []
+    while True:
+        line = await reader.readline()
+        if not line:
+            return None
+        line = line.decode().rstrip("\n")
+        if not line:
+            return "\n".join(lines)
+        lines.append(line)
+
 async def handle_input(reader, writer):
     """Обрабатывает ввод пользователя и отправляет команды на сервер, ожидая ответа."""
     try:
         while True:
-            user_input = input("Введите команду: ")
+            # input() блокирует поток, поэтому читается в отдельном потоке, не останавливая цикл событий
+            user_input = await asyncio.to_thread(input, "Введите команду: ")
 
             if user_input.lower() in ("exit", "quit"):
                 log.info("Закрытие соединения с клиентом...")
@@ -16,15 +42,14 @@ async def handle_input(reader, writer):
             writer.write((user_input + "\n").encode())
             await writer.drain()
 
-            data = await reader.read(4096)
-            if not data:
+            response = await read_reply(reader)
+            if response is None:
                 log.info("Сервер закрыл соединение.")
                 break
 
-            response = data.decode().strip()
             log.info(f"Ответ от сервера: {response}")
 
-    except KeyboardInterrupt:
+    except (KeyboardInterrupt, EOFError):
         log.error("Прерывание клиента.")
     except Exception as e:
         log.error(f"Ошибка при обработке команды: {e}")
@@ -32,15 +57,84 @@ async def handle_input(reader, writer):
         writer.close()
         await writer.wait_closed()
 
-async def main(host='localhost', port=8888):
-    """Основная функция для подключения к серверу и обработки ввода пользователя."""
+async def script_commands(source):
+    """Команды сценария: непустые строки, кроме комментариев (#), до exit/quit.
+
+    Файл читается блоками в отдельном потоке, чтобы чтение не останавливало прием ответов.
+    """
+    while True:
+        lines = await asyncio.to_thread(source.readlines, 65536)
+        if not lines:
+            return
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if line.lower() in ("exit", "quit"):
+                return
+            yield line
+
+async def run_script(reader, writer, source, window=1000):
+    """Выполняет команды сценария конвейером: не больше window команд без ответа.
+
+    Ответы печатаются в stdout в порядке команд. Возвращает 0, если получены
+    ответы на все команды, иначе 1.
+    """
+    inflight = asyncio.Queue(window)
+
+    async def send():
+        try:
+            async for command in script_commands(source):
+                await inflight.put(command)
+                writer.write((command + "\n").encode())
+                await writer.drain()
+        finally:
+            await inflight.put(None)
+
+    sender = asyncio.create_task(send())
+    try:
+        while await inflight.get() is not None:
+            response = await read_reply(reader)
+            if response is None:
+                log.error("Сервер закрыл соединение.")
+                return 1
+            sys.stdout.write((response + "\n" if response else "") + "\n")
+        await sender
+        return 0
+    except Exception as e:
+        log.error(f"Ошибка при выполнении сценария: {e}")
+        return 1
+    finally:
+        sender.cancel()
+        await asyncio.gather(sender, return_exceptions=True)
+        sys.stdout.flush()
+        writer.close()
+
+async def main(host='localhost', port=8888, script=None):
+    """Основная функция для подключения к серверу и обработки ввода пользователя или сценария."""
     log.info(f"Подключение к серверу {host}:{port}...")
     try:
         reader, writer = await asyncio.open_connection(host, port)
         log.info("Соединение с сервером установлено.")
-        await handle_input(reader, writer)
     except Exception as e:
         log.error(f"Не удалось подключиться к серверу: {e}")
+        return 1
+    if script is None:
+        await handle_input(reader, writer)
+        return 0
+    if script == "-":
+        return await run_script(reader, writer, sys.stdin)
+    with open(script, encoding="utf-8") as source:
+        return await run_script(reader, writer, source)
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description="Клиент сервера ВМ")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8888)
+    parser.add_argument("--script", help="файл с командами, по одной в строке (- — stdin)")
+    args = parser.parse_args()
+    if args.script is not None:
+        # В режиме сценария stdout занят ответами, журнал клиента — только ошибки в stderr
+        log.remove()
+        log.add(sys.stderr, level="ERROR")
+    sys.exit(asyncio.run(main(args.host, args.port, args.script)))
@@ -0,0 +1,401 @@
+"""Асинхронная клиентская библиотека сервера ВМ.
+
+Работает по двоичному протоколу (server/binary.py): у каждой команды свой
+типизированный метод, ошибки сервера превращаются в исключения VMError,
+строки LIST_* приходят кортежами VM / Disk.
+
+    async with VMClient("localhost", 8888, pool_size=4) as client:
+        await client.auth("vm1", 2048, 2)
+        async for vm in client.iter_vms(prefix="rack1-"):
+            print(vm.id, vm.ram, vm.cpu)
+        replies = await client.bulk_add_disks([("d1", "vm1", 10), ("d2", "vm1", 20)])
+
+Запросы распределяются по пулу соединений и отправляются без ожидания
+ответов на предыдущие (конвейер), поэтому параллельные вызовы через
+asyncio.gather выполняются за время, близкое к одному обходу сети. Порядок
+выполнения гарантируется только между последовательными await: команды,
+зависящие друг от друга, нужно дожидаться по очереди.
+
+Оборванное соединение открывается заново при следующем запросе. Запросы,
+которые были в полете, завершаются ConnectionError; запросы на чтение
+(LIST_*, CAPACITY, STATS) и еще не отправленные запросы при этом повторяются
+автоматически.
+"""
+import asyncio
+import itertools
+from collections import deque
+from typing import NamedTuple, Optional
+
+from server import binary
+from server.storage import ListFilter
+
+# Команды без изменений: их можно повторить на новом соединении
+READ_ONLY = {"LIST_VMS", "LIST_AUTH_VMS", "LIST_DISKS", "CHECK_ALL_VMS", "CAPACITY", "STATS"}
+
+
+class VM(NamedTuple):
+    id: str
+    ram: int
+    cpu: int
+
+
+class Disk(NamedTuple):
+    id: str
+    vm_id: str
+    size: int
+
+
+class Page(NamedTuple):
+    """Страница LIST_*: строки и курсор следующей страницы (None — страниц больше нет)."""
+    rows: list
+    next: Optional[str]
+
+
+class Reply(NamedTuple):
+    """Результат одной записи пакетной команды."""
+    status: int
+    text: str
+
+    @property
+    def ok(self) -> bool:
+        return self.status == binary.OK
+
+
+class VMError(Exception):
+    """Сервер отклонил команду. text — текст ответа сервера."""
+
+    status = binary.ERROR
+
+    def __init__(self, text: str):
+        super().__init__(text)
+        self.text = text
+
+
+class NotFound(VMError):
+    status = binary.NOT_FOUND
+
+
+class AlreadyExists(VMError):
+    status = binary.ALREADY_EXISTS
+
+
+class InvalidRequest(VMError):
+    status = binary.INVALID
+
+
+class AuthFailed(VMError):
+    status = binary.AUTH_FAILED
+
+
+class NotAuthenticated(VMError):
+    status = binary.NOT_AUTHENTICATED
+
+
+class Overloaded(VMError):
+    status = binary.OVERLOADED
+
+
+class UnknownCommand(VMError):
+    status = binary.UNKNOWN_COMMAND
+
+
+ERRORS = {cls.status: cls for cls in (NotFound, AlreadyExists, InvalidRequest, AuthFailed,
+                                      NotAuthenticated, Overloaded, UnknownCommand)}
+
+
+class Response:
+    """Ответ на одну команду: накопленные строки и курсор, затем итоговый кадр."""
+
+    __slots__ = ("future", "rows", "cursor", "events")
+
+    def __init__(self, events: asyncio.Queue = None):
+        self.future = asyncio.get_running_loop().create_future()
+        self.rows = []
+        self.cursor = None
+        self.events = events
+
+
+class Connection:
+    """Соединение с сервером по двоичному протоколу с конвейером запросов.
+
+    Ответы приходят в порядке запросов, поэтому ожидающие ответы хранятся в очереди.
+    """
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.pending = deque()
+        self.closed = False
+        self.receiver = asyncio.create_task(self.receive())
+
+    @classmethod
+    async def open(cls, host: str, port: int, timeout: float):
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+        try:
+            await asyncio.wait_for(binary.handshake(reader, writer), timeout)
+        except BaseException:
+            writer.close()
+            raise
+        return cls(reader, writer)
+
+    def send(self, name: str, *args, events: asyncio.Queue = None) -> Response:
+        """Отправляет команду, не дожидаясь ответа."""
+        if self.closed:
+            raise ConnectionError("Соединение с сервером закрыто")
+        response = Response(events)
+        self.pending.append(response)
+        self.writer.write(binary.encode_request(name, *args))
+        return response
+
+    async def receive(self):
+        error = ConnectionError("Сервер закрыл соединение")
+        try:
+            while True:
+                status, data = await binary.read_frame(self.reader)
+                response = self.pending[0]
+                if status == binary.ROWS:
+                    response.rows += binary.decode_rows(data)
+                elif status == binary.NEXT:
+                    response.cursor = binary.decode_text(data)
+                elif status == binary.TEXT:
+                    if response.events is not None:
+                        response.events.put_nowait(binary.decode_text(data))
+                else:
+                    self.pending.popleft()
+                    if not response.future.done():
+                        response.future.set_result((status, data))
+                    if response.events is not None:
+                        response.events.put_nowait(None)
+        except asyncio.IncompleteReadError:
+            pass
+        except (ConnectionError, OSError) as e:
+            error = ConnectionError(f"Соединение с сервером потеряно: {e}")
+        finally:
+            self.closed = True
+            while self.pending:
+                response = self.pending.popleft()
+                if not response.future.done():
+                    response.future.set_exception(error)
+                    # Ответа могут уже не ждать (таймаут, закрытая подписка): ошибка не логируется
+                    response.future.exception()
+                if response.events is not None:
+                    response.events.put_nowait(None)
+            self.writer.close()
+
+    async def close(self):
+        self.closed = True
+        self.writer.close()
+        self.receiver.cancel()
+        await asyncio.gather(self.receiver, return_exceptions=True)
+
+
+class VMClient:
+    """Асинхронный клиент сервера ВМ с пулом соединений.
+
+    pool_size — число соединений, между которыми по кругу распределяются запросы;
+    соединения открываются при первом использовании. При ошибке подключения
+    делается до reconnect_attempts повторов с удваивающейся паузой от reconnect_delay с.
+    batch_size — сколько записей отправляется в одной пакетной команде.
+    """
+
+    def __init__(self, host: str = "localhost", port: int = 8888, pool_size: int = 4,
+                 connect_timeout: float = 5, request_timeout: float = 30,
+                 reconnect_attempts: int = 3, reconnect_delay: float = 0.1, batch_size: int = 1000):
+        self.host = host
+        self.port = port
+        self.connect_timeout = connect_timeout
+        self.request_timeout = request_timeout
+        self.reconnect_attempts = reconnect_attempts
+        self.reconnect_delay = reconnect_delay
+        self.batch_size = batch_size
+        self.connections = [None] * pool_size
+        self.locks = [asyncio.Lock() for _ in range(pool_size)]
+        self.counter = itertools.count()
+        self.watchers = set()
+
+    async def __aenter__(self):
+        await self.connection(0)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        """Закрывает все соединения пула и подписки WATCH."""
+        connections = [c for c in self.connections if c is not None] + list(self.watchers)
+        self.connections = [None] * len(self.connections)
+        await asyncio.gather(*[c.close() for c in connections], return_exceptions=True)
+
+    async def connect(self) -> Connection:
+        delay = self.reconnect_delay
+        for attempt in range(self.reconnect_attempts + 1):
+            try:
+                return await Connection.open(self.host, self.port, self.connect_timeout)
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+                if attempt == self.reconnect_attempts:
+                    raise ConnectionError(
+                        f"Не удалось подключиться к {self.host}:{self.port}: {e}") from e
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 5)
+
+    async def connection(self, index: int) -> Connection:
+        """Живое соединение пула; оборванное открывается заново."""
+        conn = self.connections[index]
+        if conn is not None and not conn.closed:
+            return conn
+        async with self.locks[index]:
+            conn = self.connections[index]
+            if conn is None or conn.closed:
+                conn = self.connections[index] = await self.connect()
+        return conn
+
+    async def request(self, name: str, *args):
+        """Выполняет команду. Возвращает статус, данные итогового кадра и ответ целиком."""
+        for attempt in range(2):
+            conn = await self.connection(next(self.counter) % len(self.connections))
+            response = None
+            try:
+                response = conn.send(name, *args)
+                await conn.writer.drain()
+                status, data = await asyncio.wait_for(response.future, self.request_timeout)
+                return status, data, response
+            except ConnectionError:
+                # Неотправленную команду или команду на чтение можно повторить на новом соединении
+                if attempt or (response is not None and name not in READ_ONLY):
+                    raise
+
+    async def call(self, name: str, *args) -> str:
+        """Команда с текстовым ответом. VMError, если сервер ее отклонил."""
+        status, data, _ = await self.request(name, *args)
+        text = binary.decode_text(data)
+        if status != binary.OK:
+            raise ERRORS.get(status, VMError)(text)
+        return text
+
+    async def auth(self, vm_id: str, ram: int, cpu: int) -> str:
+        return await self.call("AUTH", vm_id, ram, cpu)
+
+    async def heartbeat(self, vm_id: str) -> str:
+        return await self.call("HEARTBEAT", vm_id)
+
+    async def add_vm(self, vm_id: str, ram: int, cpu: int) -> str:
+        return await self.call("ADD_VM", vm_id, ram, cpu)
+
+    async def update_vm(self, vm_id: str, ram: int, cpu: int) -> str:
+        return await self.call("UPDATE_VM", vm_id, ram, cpu)
+
+    async def logout_vm(self, vm_id: str) -> str:
+        return await self.call("LOGOUT_VM", vm_id)
+
+    async def remove_vm(self, vm_id: str) -> str:
+        return await self.call("REMOVE_VM", vm_id)
+
+    async def add_disk(self, disk_id: str, vm_id: str, size: int) -> str:
+        return await self.call("ADD_DISK", disk_id, vm_id, size)
+
+    async def remove_disk(self, disk_id: str) -> str:
+        return await self.call("REMOVE_DISK", disk_id)
+
+    async def capacity(self, vm_id: str = None) -> str:
+        return await self.call("CAPACITY", vm_id)
+
+    async def stats(self) -> str:
+        return await self.call("STATS")
+
+    async def list_page(self, name: str, limit=None, after=None, prefix=None,
+                        with_disks=False) -> Page:
+        """Одна страница LIST_*."""
+        status, data, response = await self.request(
+            name, ListFilter(limit, after, prefix, with_disks)
+        )
+        if status != binary.OK:
+            raise ERRORS.get(status, VMError)(binary.decode_text(data))
+        row = Disk if name == "LIST_DISKS" else VM
+        return Page([row(*r) for r in response.rows], response.cursor)
+
+    async def list_vms(self, limit=None, after=None, prefix=None, with_disks=False) -> Page:
+        return await self.list_page("LIST_VMS", limit, after, prefix, with_disks)
+
+    async def list_auth_vms(self, limit=None, after=None, prefix=None, with_disks=False) -> Page:
+        return await self.list_page("LIST_AUTH_VMS", limit, after, prefix, with_disks)
+
+    async def list_disks(self, limit=None, after=None, prefix=None) -> Page:
+        return await self.list_page("LIST_DISKS", limit, after, prefix)
+
+    async def check_all_vms(self, limit=None, after=None, prefix=None, with_disks=False) -> Page:
+        return await self.list_page("CHECK_ALL_VMS", limit, after, prefix, with_disks)
+
+    async def iter_pages(self, name: str, prefix=None, with_disks=False, page_size=1000):
+        """Все строки LIST_* постранично: в памяти не больше одной страницы."""
+        after = None
+        while True:
+            page = await self.list_page(name, page_size, after, prefix, with_disks)
+            for row in page.rows:
+                yield row
+            if page.next is None:
+                return
+            after = page.next
+
+    def iter_vms(self, prefix=None, with_disks=False, page_size=1000):
+        return self.iter_pages("LIST_VMS", prefix, with_disks, page_size)
+
+    def iter_auth_vms(self, prefix=None, with_disks=False, page_size=1000):
+        return self.iter_pages("LIST_AUTH_VMS", prefix, with_disks, page_size)
+
+    def iter_disks(self, prefix=None, page_size=1000):
+        return self.iter_pages("LIST_DISKS", prefix, False, page_size)
+
+    async def bulk(self, name: str, records) -> list:
+        """Пакетная команда: записи делятся на пачки по batch_size, пачки выполняются
+        параллельно по соединениям пула. Возвращает Reply на каждую запись в исходном порядке."""
+        records = list(records)
+        chunks = [records[i:i + self.batch_size] for i in range(0, len(records), self.batch_size)]
+        results = await asyncio.gather(*[self.bulk_chunk(name, chunk) for chunk in chunks])
+        return [reply for chunk in results for reply in chunk]
+
+    async def bulk_chunk(self, name: str, records) -> list:
+        status, data, _ = await self.request(name, *[field for record in records for field in record])
+        if status != binary.OK:
+            raise ERRORS.get(status, VMError)(binary.decode_text(data))
+        return [Reply(*record) for record in binary.decode_records(data)]
+
+    async def bulk_auth(self, vms) -> list:
+        """Аутентификация ВМ, заданных тройками (vm_id, ram, cpu)."""
+        return await self.bulk("BULK_AUTH", vms)
+
+    async def bulk_add_vms(self, vms) -> list:
+        """Добавление ВМ, заданных тройками (vm_id, ram, cpu)."""
+        return await self.bulk("BULK_ADD_VM", vms)
+
+    async def bulk_add_disks(self, disks) -> list:
+        """Добавление дисков, заданных тройками (disk_id, vm_id, size)."""
+        return await self.bulk("BULK_ADD_DISK", disks)
+
+    async def watch(self, prefix: str = None):
+        """События изменений (строки вида «VM_ADDED vm1 2048 2») на отдельном соединении.
+
+        Итератор завершается, когда сервер закрывает подписку при остановке;
+        при обрыве соединения выбрасывается ConnectionError.
+        """
+        conn = await self.connect()
+        self.watchers.add(conn)
+        try:
+            events = asyncio.Queue()
+            response = conn.send("WATCH", prefix, events=events)
+            await conn.writer.drain()
+            confirmed = False
+            while True:
+                text = await events.get()
+                if text is None:
+                    status, data = await response.future
+                    if status == binary.OK:
+                        return
+                    raise ERRORS.get(status, VMError)(binary.decode_text(data))
+                if not confirmed:
+                    confirmed = True
+                    continue
+                for event in text.splitlines():
+                    yield event
+        finally:
+            self.watchers.discard(conn)
+            await conn.close()
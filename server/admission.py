@@ -0,0 +1,112 @@
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+
+# Приоритеты команд: меньше — важнее
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+
+class Overloaded(Exception):
+    """Команда отклонена: сервер перегружен."""
+
+
+def granted(future) -> bool:
+    """Место было передано ожидающему до того, как он перестал ждать."""
+    return future.done() and not future.cancelled() and future.exception() is None
+
+
+class AdmissionController:
+    """Допуск команд к выполнению.
+
+    Одновременно выполняется не более max_concurrent команд по всему процессу
+    и не более per_client команд (выполняемых и ожидающих) от одного клиента —
+    адреса, который сервер передает ключом client; соединения с одного адреса
+    делят лимит между собой.
+    Остальные ждут в очереди длиной до queue_size не дольше queue_timeout секунд
+    и допускаются по приоритету. Если очередь заполнена, место нового запроса
+    занимает вытесненный запрос с меньшим приоритетом; если такого нет,
+    отклоняется сам новый запрос.
+    """
+
+    def __init__(self, max_concurrent: int, per_client: int, queue_size: int, queue_timeout: float):
+        self.max_concurrent = max_concurrent
+        self.per_client = per_client
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.running = 0
+        self.queued = 0
+        self.queues = [deque() for _ in (PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW)]
+        self.clients = {}
+        self.rejected = 0
+
+    @asynccontextmanager
+    async def admit(self, client, priority=PRIORITY_NORMAL):
+        """Контекст выполнения команды. Выбрасывает Overloaded, если команда не допущена."""
+        if self.clients.get(client, 0) >= self.per_client:
+            self.rejected += 1
+            raise Overloaded()
+        self.clients[client] = self.clients.get(client, 0) + 1
+        try:
+            await self.acquire(priority)
+            try:
+                yield
+            finally:
+                self.release()
+        finally:
+            self.clients[client] -= 1
+            if not self.clients[client]:
+                del self.clients[client]
+
+    async def acquire(self, priority):
+        if self.running < self.max_concurrent and not self.queued:
+            self.running += 1
+            return
+        if self.queued >= self.queue_size and not self.evict(priority):
+            self.rejected += 1
+            raise Overloaded()
+
+        future = asyncio.get_running_loop().create_future()
+        self.queues[priority].append(future)
+        self.queued += 1
+        try:
+            await asyncio.wait_for(future, self.queue_timeout)
+        except asyncio.TimeoutError:
+            if granted(future):
+                return
+            self.queued -= 1
+            self.rejected += 1
+            raise Overloaded()
+        except asyncio.CancelledError:
+            if granted(future):
+                self.release()
+            elif future.cancelled():
+                self.queued -= 1
+            raise
+
+    def evict(self, priority) -> bool:
+        """Вытесняет самый новый ожидающий запрос с приоритетом ниже priority."""
+        for level in range(len(self.queues) - 1, priority, -1):
+            queue = self.queues[level]
+            while queue:
+                victim = queue.pop()
+                if victim.done():
+                    continue
+                self.queued -= 1
+                self.rejected += 1
+                victim.set_exception(Overloaded())
+                return True
+        return False
+
+    def release(self):
+        """Передает освободившееся место первому ожидающему с наивысшим приоритетом."""
+        for queue in self.queues:
+            while queue:
+                future = queue.popleft()
+                if future.done():
+                    continue
+                self.queued -= 1
+                future.set_result(None)
+                return
+        self.running -= 1
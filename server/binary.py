@@ -0,0 +1,358 @@
+"""Двоичный протокол для машинных клиентов.
+
+Протокол согласуется при подключении: клиент первым делом отправляет MAGIC и
+максимальную поддерживаемую версию (1 байт), сервер отвечает MAGIC и выбранной
+версией (0 — общей версии нет, соединение закрывается). Текстовая команда не
+начинается с нулевого байта, поэтому обычные клиенты работают как прежде.
+
+Дальше стороны обмениваются кадрами: длина тела (u32) и тело; все числа — big-endian.
+Тело команды — код операции (u8, см. OPCODES) и поля по схеме операции:
+  s — идентификатор: длина (u16) и UTF-8, непустой, без пробельных и управляющих
+      символов (иначе команда отклоняется как неверная);
+  o — то же, пустая строка означает «не задано»;
+  t — текст: длина (u32) и UTF-8;
+  q — целое со знаком (i64);
+  L — параметры LIST_*: limit (u32, 0 — без ограничения), after (o), prefix (o),
+      флаги (u8, бит 0 — WITH_DISKS);
+  * — дальше идут записи пакетной команды: их число (u32) и поля каждой записи.
+Тело ответа — статус (u8) и данные. Статусы меньше 0x80 (см. модуль replies)
+завершают ответ, данные — текст ответа (t). Ответ пакетной команды со статусом OK
+вместо текста содержит число записей (u32) и по записи на каждую запись команды:
+статус (u8) и текст (t). Статус берется из ответа команды, текст не разбирается.
+Статусы от 0x80 — части потокового ответа:
+  ROWS — вид строк (u8), их число (u32) и строки: ВМ — id (s), ram (q), cpu (q);
+         диск — id (s), vm_id (s), size (q);
+  NEXT — курсор следующей страницы (t); TEXT — текстовая часть (события WATCH, t).
+Потоковый ответ завершается кадром OK с пустым текстом либо кадром ошибки.
+"""
+import asyncio
+import struct
+from collections import deque
+
+from .protocol import CommandTooLong, MalformedRequest
+# Статусы ответов импортируются и для клиентов двоичного протокола (binary.OK и т. д.)
+from .replies import (ALREADY_EXISTS, AUTH_FAILED, ERROR, INVALID, NOT_AUTHENTICATED, NOT_FOUND,
+                      OK, OVERLOADED, UNKNOWN_COMMAND, status_of)
+from .storage import ListFilter, format_disk
+
+MAGIC = b"\x00VMB"
+VERSION = 1
+
+FRAME_HEADER = struct.Struct(">I")
+STRING_LENGTH = struct.Struct(">H")
+TEXT_LENGTH = struct.Struct(">I")
+INTEGER = struct.Struct(">q")
+VM_FIELDS = struct.Struct(">qq")
+LIST_LIMIT = struct.Struct(">I")
+
+# Коды операций и схемы полей
+OPCODES = {
+    0x01: ("AUTH", "sqq"),
+    0x02: ("ADD_VM", "sqq"),
+    0x03: ("UPDATE_VM", "sqq"),
+    0x04: ("LOGOUT_VM", "s"),
+    0x05: ("REMOVE_VM", "s"),
+    0x06: ("HEARTBEAT", "s"),
+    0x07: ("ADD_DISK", "ssq"),
+    0x08: ("REMOVE_DISK", "s"),
+    0x10: ("LIST_VMS", "L"),
+    0x11: ("LIST_AUTH_VMS", "L"),
+    0x12: ("LIST_DISKS", "L"),
+    0x13: ("CHECK_ALL_VMS", "L"),
+    0x20: ("BULK_AUTH", "*sqq"),
+    0x21: ("BULK_ADD_VM", "*sqq"),
+    0x22: ("BULK_ADD_DISK", "*ssq"),
+    0x30: ("CAPACITY", "o"),
+    0x31: ("STATS", ""),
+    0x32: ("WATCH", "o"),
+}
+OPCODE_BY_NAME = {name: (opcode, schema) for opcode, (name, schema) in OPCODES.items()}
+
+# Статусы частей потокового ответа (статусы завершения — в модуле replies)
+ROWS = 0x80
+NEXT = 0x81
+TEXT = 0x82
+
+# Виды строк в кадре ROWS
+ROW_VM = 1
+ROW_DISK = 2
+
+def pack_string(out: bytearray, value: str):
+    data = value.encode()
+    out += STRING_LENGTH.pack(len(data))
+    out += data
+
+
+def pack_text(out: bytearray, value: str):
+    data = value.encode()
+    out += TEXT_LENGTH.pack(len(data))
+    out += data
+
+
+def frame(status: int, text: str = "") -> bytes:
+    """Кадр ответа со статусом и текстом."""
+    out = bytearray(FRAME_HEADER.size)
+    out.append(status)
+    pack_text(out, text)
+    FRAME_HEADER.pack_into(out, 0, len(out) - FRAME_HEADER.size)
+    return bytes(out)
+
+
+def encode_rows(render, batch) -> bytearray:
+    """Кадр ROWS: строки пачки из хранилища упаковываются сразу в буфер кадра.
+
+    render — функция текстового вывода строк (format_vm или format_disk), по ней
+    выбирается вид строк.
+    """
+    out = bytearray(FRAME_HEADER.size)
+    out.append(ROWS)
+    if render is format_disk:
+        out.append(ROW_DISK)
+        out += FRAME_HEADER.pack(len(batch))
+        for r in batch:
+            pack_string(out, r['id'])
+            pack_string(out, r['vm_id'])
+            out += INTEGER.pack(r['size'])
+    else:
+        out.append(ROW_VM)
+        out += FRAME_HEADER.pack(len(batch))
+        for r in batch:
+            pack_string(out, r['id'])
+            out += VM_FIELDS.pack(r['ram'], r['cpu'])
+    FRAME_HEADER.pack_into(out, 0, len(out) - FRAME_HEADER.size)
+    return out
+
+
+def encode_cursor(cursor: str) -> bytes:
+    return frame(NEXT, cursor)
+
+
+class Decoder:
+    """Последовательное чтение полей из тела кадра."""
+
+    __slots__ = ("data", "offset")
+
+    def __init__(self, data: bytes, offset: int = 0):
+        self.data = data
+        self.offset = offset
+
+    def unpack(self, fmt: struct.Struct):
+        values = fmt.unpack_from(self.data, self.offset)
+        self.offset += fmt.size
+        return values
+
+    def byte(self) -> int:
+        value = self.data[self.offset]
+        self.offset += 1
+        return value
+
+    def string(self, length_format: struct.Struct = STRING_LENGTH) -> str:
+        (length,) = self.unpack(length_format)
+        end = self.offset + length
+        if end > len(self.data):
+            raise ValueError("string")
+        value = self.data[self.offset:end].decode()
+        self.offset = end
+        return value
+
+    def text(self) -> str:
+        return self.string(TEXT_LENGTH)
+
+    def identifier(self, optional: bool = False) -> str:
+        """Идентификатор: в текстовом протоколе он — одно слово, здесь требования те же."""
+        value = self.string()
+        if optional and not value:
+            return value
+        if not value.isprintable() or value.split() != [value]:
+            raise ValueError("identifier")
+        return value
+
+    def fields(self, schema: str) -> list:
+        values = []
+        for kind in schema:
+            if kind == "s":
+                values.append(self.identifier())
+            elif kind == "o":
+                value = self.identifier(optional=True)
+                if value:
+                    values.append(value)
+            elif kind == "q":
+                values.append(self.unpack(INTEGER)[0])
+            elif kind == "L":
+                values.append(self.list_filter())
+        return values
+
+    def list_filter(self) -> ListFilter:
+        (limit,) = self.unpack(LIST_LIMIT)
+        after, prefix = self.string(), self.string()
+        flags = self.byte()
+        return ListFilter(limit or None, after or None, prefix or None, bool(flags & 1),
+                          codec=BinaryProtocol)
+
+
+def decode_request(body: bytes):
+    """Имя команды и аргументы из тела кадра команды."""
+    try:
+        decoder = Decoder(body, 1)
+        opcode = body[0]
+        if opcode not in OPCODES:
+            return f"0x{opcode:02x}", ()
+        name, schema = OPCODES[opcode]
+        if schema.startswith("*"):
+            (count,) = decoder.unpack(FRAME_HEADER)
+            args = []
+            for _ in range(count):
+                args += decoder.fields(schema[1:])
+        else:
+            args = decoder.fields(schema)
+        if decoder.offset != len(body):
+            raise ValueError("trailing data")
+    except (IndexError, ValueError, struct.error) as e:
+        raise MalformedRequest() from e
+    return name, args
+
+
+class BinaryProtocol:
+    """Двоичный протокол соединения.
+
+    Ответы отправляются в порядке команд, поэтому для каждой прочитанной
+    команды запоминается, сколько записей ждет ее пакетный ответ (None — не пакетная).
+    """
+
+    def __init__(self, version: int, max_length: int):
+        self.version = version
+        self.max_length = max_length
+        self.expected = deque()
+
+    @classmethod
+    async def accept(cls, reader: asyncio.StreamReader, writer, max_length: int):
+        """Согласование после прочитанного первого байта MAGIC. None — согласовать не удалось.
+
+        max_length — максимальная длина тела кадра команды.
+        """
+        hello = await reader.readexactly(len(MAGIC))
+        if hello[:-1] != MAGIC[1:]:
+            return None
+        version = min(hello[-1], VERSION)
+        writer.write(MAGIC + bytes([version]))
+        return cls(version, max_length) if version else None
+
+    async def read_request(self, reader: asyncio.StreamReader):
+        """Читает кадр команды. Возвращает (имя, аргументы) и размер либо (None, 0) при закрытии."""
+        try:
+            header = await reader.readexactly(FRAME_HEADER.size)
+        except asyncio.IncompleteReadError:
+            return None, 0
+        (length,) = FRAME_HEADER.unpack(header)
+        if length > self.max_length:
+            self.expected.append(None)
+            while length:
+                length -= len(await reader.readexactly(min(length, 65536)))
+            raise CommandTooLong()
+        try:
+            body = await reader.readexactly(length)
+        except asyncio.IncompleteReadError:
+            return None, 0
+        try:
+            name, args = decode_request(body)
+        except MalformedRequest:
+            self.expected.append(None)
+            raise
+        self.expected.append(len(args) // 3 if name.startswith("BULK_") else None)
+        return (name, args), FRAME_HEADER.size + length
+
+    def encode_reply(self, text: str) -> bytes:
+        records = self.expected.popleft()
+        statuses = getattr(text, "statuses", None)
+        if records is not None and statuses is not None and len(statuses) == records:
+            out = bytearray(FRAME_HEADER.size)
+            out.append(OK)
+            out += FRAME_HEADER.pack(records)
+            for status, line in zip(statuses, text.texts):
+                out.append(status)
+                pack_text(out, line)
+            FRAME_HEADER.pack_into(out, 0, len(out) - FRAME_HEADER.size)
+            return bytes(out)
+        return frame(status_of(text), text)
+
+    def encode_chunk(self, chunk) -> bytes:
+        if isinstance(chunk, str):
+            return frame(TEXT, chunk)
+        return chunk
+
+    def stream_end(self) -> bytes:
+        self.expected.popleft()
+        return frame(OK)
+
+    def encode_error(self, text: str) -> bytes:
+        self.expected.popleft()
+        return frame(ERROR, text)
+
+    # Для ListFilter.codec: строки LIST_* кодируются без промежуточного текста
+    encode_rows = staticmethod(encode_rows)
+    encode_cursor = staticmethod(encode_cursor)
+
+
+# Клиентская часть
+
+def encode_request(name: str, *args) -> bytes:
+    """Кадр команды. Аргументы LIST_* — один ListFilter (или ни одного),
+    аргументы пакетных команд — плоский список полей всех записей."""
+    opcode, schema = OPCODE_BY_NAME[name]
+    out = bytearray(FRAME_HEADER.size)
+    out.append(opcode)
+    if schema.startswith("*"):
+        width = len(schema) - 1
+        out += FRAME_HEADER.pack(len(args) // width)
+        schema = schema[1:] * (len(args) // width)
+    values = iter(args)
+    for kind in schema:
+        if kind in "so":
+            pack_string(out, str(next(values, None) or ""))
+        elif kind == "q":
+            out += INTEGER.pack(int(next(values)))
+        elif kind == "L":
+            list_filter = next(values, None) or ListFilter()
+            out += LIST_LIMIT.pack(list_filter.limit or 0)
+            pack_string(out, list_filter.after or "")
+            pack_string(out, list_filter.prefix or "")
+            out.append(1 if list_filter.with_disks else 0)
+    FRAME_HEADER.pack_into(out, 0, len(out) - FRAME_HEADER.size)
+    return bytes(out)
+
+
+async def handshake(reader: asyncio.StreamReader, writer, version: int = VERSION) -> int:
+    """Согласование двоичного протокола на стороне клиента. Возвращает выбранную версию."""
+    writer.write(MAGIC + bytes([version]))
+    await writer.drain()
+    reply = await reader.readexactly(len(MAGIC) + 1)
+    if reply[:-1] != MAGIC or not reply[-1]:
+        raise ConnectionError("Сервер не поддерживает двоичный протокол")
+    return reply[-1]
+
+
+async def read_frame(reader: asyncio.StreamReader):
+    """Читает кадр ответа: статус и данные."""
+    (length,) = FRAME_HEADER.unpack(await reader.readexactly(FRAME_HEADER.size))
+    body = await reader.readexactly(length)
+    return body[0], body[1:]
+
+
+def decode_text(data: bytes) -> str:
+    return Decoder(data).text()
+
+
+def decode_records(data: bytes) -> list:
+    """Записи ответа пакетной команды: пары (статус, текст)."""
+    decoder = Decoder(data)
+    (count,) = decoder.unpack(FRAME_HEADER)
+    return [(decoder.byte(), decoder.text()) for _ in range(count)]
+
+
+def decode_rows(data: bytes) -> list:
+    """Строки кадра ROWS: кортежи (id, ram, cpu) для ВМ или (id, vm_id, size) для дисков."""
+    decoder = Decoder(data)
+    kind = decoder.byte()
+    (count,) = decoder.unpack(FRAME_HEADER)
+    schema = "ssq" if kind == ROW_DISK else "sqq"
+    return [tuple(decoder.fields(schema)) for _ in range(count)]
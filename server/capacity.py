@@ -0,0 +1,109 @@
+class Capacity:
+    """Суммарные ресурсы для команды CAPACITY, поддерживаемые инкрементально.
+
+    Хранилище сообщает о каждом изменении строки ВМ (vm_changed) и диска
+    (disk_added / disk_removed), так что ответ строится без обхода таблиц.
+    Строка ВМ — кортеж (ram, cpu, is_active, is_auth) или None, если ВМ нет.
+    """
+
+    # Итоговые счетчики (без разбивки дисков по ВМ)
+    TOTALS = ("active_vms", "active_ram", "active_cpu", "auth_vms", "auth_ram", "auth_cpu",
+              "disks", "disk_gb")
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.active_vms = 0
+        self.active_ram = 0
+        self.active_cpu = 0
+        self.auth_vms = 0
+        self.auth_ram = 0
+        self.auth_cpu = 0
+        self.disks = 0
+        self.disk_gb = 0
+        self.vm_disks = {}
+
+    def vm_changed(self, old, new):
+        for row, sign in ((old, -1), (new, 1)):
+            if row is None:
+                continue
+            ram, cpu, is_active, is_auth = row
+            if is_active:
+                self.active_vms += sign
+                self.active_ram += sign * ram
+                self.active_cpu += sign * cpu
+                if is_auth:
+                    self.auth_vms += sign
+                    self.auth_ram += sign * ram
+                    self.auth_cpu += sign * cpu
+
+    def disk_added(self, vm_id, size):
+        self.disks += 1
+        self.disk_gb += size
+        count, total = self.vm_disks.get(vm_id, (0, 0))
+        self.vm_disks[vm_id] = (count + 1, total + size)
+
+    def disk_removed(self, vm_id, size):
+        self.disks -= 1
+        self.disk_gb -= size
+        count, total = self.vm_disks.get(vm_id, (1, size))
+        if count > 1:
+            self.vm_disks[vm_id] = (count - 1, total - size)
+        else:
+            self.vm_disks.pop(vm_id, None)
+
+    def totals(self) -> list:
+        """Значения итоговых счетчиков в порядке TOTALS."""
+        return [getattr(self, name) for name in self.TOTALS]
+
+    def apply(self, vm_id, delta):
+        """Прибавляет изменение итогов delta (разность totals), сделанное с ВМ vm_id."""
+        changes = dict(zip(self.TOTALS, delta))
+        for name, value in changes.items():
+            setattr(self, name, getattr(self, name) + value)
+        if changes["disks"] or changes["disk_gb"]:
+            count, total = self.vm_disks.get(vm_id, (0, 0))
+            count += changes["disks"]
+            total += changes["disk_gb"]
+            if count > 0:
+                self.vm_disks[vm_id] = (count, total)
+            else:
+                self.vm_disks.pop(vm_id, None)
+
+    def snapshot(self) -> "Capacity":
+        """Копия текущих итогов."""
+        copy = Capacity()
+        for name in self.TOTALS:
+            setattr(copy, name, getattr(self, name))
+        copy.vm_disks = dict(self.vm_disks)
+        return copy
+
+    def rebase(self, fresh: "Capacity", base: "Capacity"):
+        """Заменяет итоги пересчитанными fresh, сохраняя изменения после снимка base.
+
+        Пересчет идет с ожиданием запросов; изменения, внесенные за это время
+        (разница между текущими итогами и base), прибавляются к fresh.
+        """
+        for name in self.TOTALS:
+            setattr(self, name, getattr(fresh, name) + getattr(self, name) - getattr(base, name))
+        vm_disks = {}
+        for vm_id in fresh.vm_disks.keys() | self.vm_disks.keys() | base.vm_disks.keys():
+            count, total = fresh.vm_disks.get(vm_id, (0, 0))
+            current, base_row = self.vm_disks.get(vm_id, (0, 0)), base.vm_disks.get(vm_id, (0, 0))
+            count += current[0] - base_row[0]
+            total += current[1] - base_row[1]
+            if count > 0:
+                vm_disks[vm_id] = (count, total)
+        self.vm_disks = vm_disks
+
+    def render(self, vm_id=None) -> str:
+        """Ответ CAPACITY: итоги по всем ВМ или объем дисков одной ВМ."""
+        if vm_id is not None:
+            count, total = self.vm_disks.get(vm_id, (0, 0))
+            return f"ВМ {vm_id}: дисков {count}, {total}GB"
+        return "\n".join([
+            f"Активные ВМ: {self.active_vms}, {self.active_ram}MB RAM, {self.active_cpu}CPU",
+            f"Авторизованные ВМ: {self.auth_vms}, {self.auth_ram}MB RAM, {self.auth_cpu}CPU",
+            f"Диски: {self.disks}, {self.disk_gb}GB",
+        ])
@@ -1,21 +1,143 @@
 from abc import ABC, abstractmethod
 
-from server.db_manager import DatabaseManager
+from server.admission import PRIORITY_HIGH, PRIORITY_LOW, PRIORITY_NORMAL
+from server.storage import ListFilter, Storage
+from server.metrics import Metrics
+from server.replies import INVALID, Reply
 
 
 class Command(ABC):
     """Абстрактный класс для всех команд, которые должны быть выполнены."""
 
+    # Приоритет при перегрузке: команды с меньшим значением допускаются первыми
+    priority = PRIORITY_NORMAL
+
+    # Проходит ли команда допуск; команды-подписки не занимают место выполнения
+    admitted = True
+
+    # Команда только читает данные; после остальных команд чтения сессии идут
+    # туда, где видны ее изменения (см. Session)
+    readonly = False
+
+    # Команда отвечает потоком; у соединения открыт не более чем один поток
+    streaming = False
+
+    # Позиции ID сущностей в записи аргументов: по ним упорядочиваются команды соединения.
+    # record_width — ширина записи пакетной команды (None — все аргументы одна запись)
+    key_fields = (0,)
+    record_width = None
+
     @abstractmethod
     async def execute(self, *args) -> str:
-        """Метод для выполнения команды."""
+        """Метод для выполнения команды.
+
+        Возвращает строку ответа либо, для потоковых команд, асинхронный
+        итератор частей ответа.
+        """
+        pass
+
+    def keys(self, *args) -> tuple:
+        """Ключи, по которым упорядочиваются команды одного соединения.
+
+        Это ID ВМ и дисков из аргументов (key_fields каждой записи): команды
+        с одинаковыми ram, cpu или size не ждут друг друга. Пустой кортеж
+        означает, что команда зависит от всех предыдущих команд соединения.
+        """
+        if not args:
+            return ()
+        width = self.record_width or len(args)
+        return tuple(
+            args[start + field]
+            for start in range(0, len(args), width)
+            for field in self.key_fields
+            if start + field < len(args)
+        )
+
+
+def split_records(args, width):
+    """Разбивает плоский список аргументов пакетной команды на записи по width полей.
+
+    Возвращает None, если аргументов нет или их число не кратно width.
+    """
+    if not args or len(args) % width:
+        return None
+    return [args[i:i + width] for i in range(0, len(args), width)]
+
+
+def parse_list_filter(args, allow_with_disks=True):
+    """Разбирает параметры LIST_*: [LIMIT <n>] [AFTER <курсор>] [PREFIX <префикс>] [WITH_DISKS].
+
+    Выбрасывает ValueError при неверных параметрах.
+    """
+    list_filter = ListFilter()
+    options = iter(args)
+    for option in options:
+        option = option.upper()
+        if option == "WITH_DISKS" and allow_with_disks:
+            list_filter.with_disks = True
+            continue
+        value = next(options, None)
+        if value is None:
+            raise ValueError(option)
+        if option == "LIMIT":
+            list_filter.limit = int(value)
+            if list_filter.limit < 1:
+                raise ValueError(option)
+        elif option == "AFTER":
+            list_filter.after = value
+        elif option == "PREFIX":
+            list_filter.prefix = value
+        else:
+            raise ValueError(option)
+    return list_filter
+
+
+class ListCommand(Command):
+    """Базовый класс потоковых команд LIST_* с постраничной выборкой."""
+
+    priority = PRIORITY_LOW
+
+    readonly = True
+
+    streaming = True
+
+    allow_with_disks = True
+
+    def __init__(self, db_manager: Storage):
+        self.db_manager = db_manager
+
+    def keys(self, *args) -> tuple:
+        """Выборка зависит от всех предыдущих команд соединения."""
+        return ()
+
+    async def execute(self, *args):
+        """Разбирает параметры выборки и возвращает потоковый ответ.
+
+        Двоичный протокол передает уже разобранные параметры одним аргументом ListFilter.
+        """
+        if len(args) == 1 and isinstance(args[0], ListFilter):
+            list_filter = args[0]
+            if list_filter.with_disks and not self.allow_with_disks:
+                return Reply("Неверные параметры выборки", INVALID)
+            return self.fetch(list_filter)
+        try:
+            list_filter = parse_list_filter(args, self.allow_with_disks)
+        except ValueError:
+            return Reply("Неверные параметры выборки", INVALID)
+        return self.fetch(list_filter)
+
+    @abstractmethod
+    def fetch(self, list_filter: ListFilter):
+        """Возвращает асинхронный итератор частей ответа."""
         pass
 
 
 class AuthenticateVMCommand(Command):
     """Команда для аутентификации виртуальной машины."""
 
-    def __init__(self, db_manager: DatabaseManager):
+    priority = PRIORITY_HIGH
+
+    def __init__(self, db_manager: Storage):
         self.db_manager = db_manager
 
     async def execute(self, vm_id: str, ram: str, cpu: str) -> str:
@@ -23,13 +145,13 @@ class AuthenticateVMCommand(Command):
         try:
             return await self.db_manager.authenticate_vm(vm_id, int(ram), int(cpu))
         except ValueError:
-            return "Неверные значения RAM или CPU"
+            return Reply("Неверные значения RAM или CPU", INVALID)
 
 
 class AddVMCommand(Command):
     """Команда для добавления виртуальной машины."""
 
-    def __init__(self, db_manager: DatabaseManager):
+    def __init__(self, db_manager: Storage):
         self.db_manager = db_manager
 
     async def execute(self, vm_id: str, ram: str, cpu: str) -> str:
@@ -37,35 +159,73 @@ class AddVMCommand(Command):
         try:
             return await self.db_manager.add_vm(vm_id, int(ram), int(cpu))
         except ValueError:
-            return "Неверные значения RAM или CPU"
+            return Reply("Неверные значения RAM или CPU", INVALID)
 
 
-class ListVMsCommand(Command):
-    """Команда для получения списка всех виртуальных машин."""
+class BulkAuthenticateVMCommand(Command):
+    """Команда для пакетной аутентификации виртуальных машин."""
+
+    priority = PRIORITY_LOW
 
-    def __init__(self, db_manager: DatabaseManager):
+    record_width = 3
+
+    def __init__(self, db_manager: Storage):
         self.db_manager = db_manager
 
-    async def execute(self) -> str:
-        """Возвращает список всех виртуальных машин."""
-        return await self.db_manager.list_vms()
+    async def execute(self, *args) -> str:
+        """Аутентифицирует ВМ, заданные тройками <vm_id> <ram> <cpu>."""
+        records = split_records(args, 3)
+        if records is None:
+            return Reply("Неверное количество аргументов", INVALID)
+        try:
+            vms = [(vm_id, int(ram), int(cpu)) for vm_id, ram, cpu in records]
+        except ValueError:
+            return Reply("Неверные значения RAM или CPU", INVALID)
+        return await self.db_manager.bulk_authenticate_vms(vms)
 
 
-class ListAuthenticatedVMsCommand(Command):
-    """Команда для получения списка авторизованных виртуальных машин."""
+class BulkAddVMCommand(Command):
+    """Команда для пакетного добавления виртуальных машин."""
+
+    priority = PRIORITY_LOW
 
-    def __init__(self, db_manager: DatabaseManager):
+    record_width = 3
+
+    def __init__(self, db_manager: Storage):
         self.db_manager = db_manager
 
-    async def execute(self) -> str:
+    async def execute(self, *args) -> str:
+        """Добавляет ВМ, заданные тройками <vm_id> <ram> <cpu>."""
+        records = split_records(args, 3)
+        if records is None:
+            return Reply("Неверное количество аргументов", INVALID)
+        try:
+            vms = [(vm_id, int(ram), int(cpu)) for vm_id, ram, cpu in records]
+        except ValueError:
+            return Reply("Неверные значения RAM или CPU", INVALID)
+        return await self.db_manager.bulk_add_vms(vms)
+
+
+class ListVMsCommand(ListCommand):
+    """Команда для получения списка всех виртуальных машин."""
+
+    def fetch(self, list_filter: ListFilter):
+        """Возвращает список всех виртуальных машин."""
+        return self.db_manager.list_vms(list_filter)
+
+
+class ListAuthenticatedVMsCommand(ListCommand):
+    """Команда для получения списка авторизованных виртуальных машин."""
+
+    def fetch(self, list_filter: ListFilter):
         """Возвращает список авторизованных виртуальных машин."""
-        return await self.db_manager.list_authenticated_vms()
+        return self.db_manager.list_authenticated_vms(list_filter)
 
 
 class UpdateVMCommand(Command):
     """Команда для обновления параметров виртуальной машины."""
 
-    def __init__(self, db_manager: DatabaseManager):
+    def __init__(self, db_manager: Storage):
         self.db_manager = db_manager
 
     async def execute(self, vm_id: str, ram: str, cpu: str) -> str:
@@ -73,13 +233,15 @@ class UpdateVMCommand(Command):
         try:
             return await self.db_manager.update_vm(vm_id, int(ram), int(cpu))
         except ValueError:
-            return "Неверные значения RAM или CPU"
+            return Reply("Неверные значения RAM или CPU", INVALID)
 
 
 class LogoutVMCommand(Command):
     """Команда для выхода виртуальной машины."""
 
-    def __init__(self, db_manager: DatabaseManager):
+    priority = PRIORITY_HIGH
+
+    def __init__(self, db_manager: Storage):
         self.db_manager = db_manager
 
     async def execute(self, vm_id: str) -> str:
@@ -87,10 +249,23 @@ class LogoutVMCommand(Command):
         return await self.db_manager.logout_vm(vm_id)
 
 
+class HeartbeatCommand(Command):
+    """Команда для продления аренды аутентификации виртуальной машины."""
+
+    priority = PRIORITY_HIGH
+
+    def __init__(self, db_manager: Storage):
+        self.db_manager = db_manager
+
+    async def execute(self, vm_id: str) -> str:
+        """Продлевает аренду аутентифицированной виртуальной машины."""
+        return await self.db_manager.heartbeat_vm(vm_id)
+
+
 class RemoveVMCommand(Command):
     """Команда для удаления виртуальной машины."""
 
-    def __init__(self, db_manager: DatabaseManager):
+    def __init__(self, db_manager: Storage):
         self.db_manager = db_manager
 
     async def execute(self, vm_id: str) -> str:
@@ -98,21 +273,22 @@ class RemoveVMCommand(Command):
         return await self.db_manager.remove_vm(vm_id)
 
 
-class ListDisksCommand(Command):
+class ListDisksCommand(ListCommand):
     """Команда для получения списка дисков."""
 
-    def __init__(self, db_manager: DatabaseManager):
-        self.db_manager = db_manager
+    allow_with_disks = False
 
-    async def execute(self) -> str:
+    def fetch(self, list_filter: ListFilter):
         """Возвращает список всех дисков."""
-        return await self.db_manager.list_disks()
+        return self.db_manager.list_disks(list_filter)
 
 
 class AddDiskCommand(Command):
     """Команда для добавления диска виртуальной машине."""
 
-    def __init__(self, db_manager: DatabaseManager):
+    key_fields = (0, 1)
+
+    def __init__(self, db_manager: Storage):
         self.db_manager = db_manager
 
     async def execute(self, disk_id: str, vm_id: str, size: str) -> str:
@@ -120,13 +296,36 @@ class AddDiskCommand(Command):
         try:
             return await self.db_manager.add_disk(disk_id, vm_id, int(size))
         except ValueError:
-            return "Неверный размер диска"
+            return Reply("Неверный размер диска", INVALID)
+
+
+class BulkAddDiskCommand(Command):
+    """Команда для пакетного добавления дисков."""
+
+    priority = PRIORITY_LOW
+
+    key_fields = (0, 1)
+    record_width = 3
+
+    def __init__(self, db_manager: Storage):
+        self.db_manager = db_manager
+
+    async def execute(self, *args) -> str:
+        """Добавляет диски, заданные тройками <disk_id> <vm_id> <size>."""
+        records = split_records(args, 3)
+        if records is None:
+            return Reply("Неверное количество аргументов", INVALID)
+        try:
+            disks = [(disk_id, vm_id, int(size)) for disk_id, vm_id, size in records]
+        except ValueError:
+            return Reply("Неверный размер диска", INVALID)
+        return await self.db_manager.bulk_add_disks(disks)
 
 
 class RemoveDiskCommand(Command):
     """Команда для удаления диска из виртуальной машины."""
 
-    def __init__(self, db_manager: DatabaseManager):
+    def __init__(self, db_manager: Storage):
         self.db_manager = db_manager
 
     async def execute(self, disk_id: str) -> str:
@@ -134,13 +333,56 @@ class RemoveDiskCommand(Command):
         return await self.db_manager.remove_disk(disk_id)
 
 
-class CheckAllVMsCommand(Command):
+class CheckAllVMsCommand(ListCommand):
     """Команда для проверки всех виртуальных машин."""
 
-    def __init__(self, db_manager: DatabaseManager):
+    def fetch(self, list_filter: ListFilter):
+        """Проверяет все виртуальные машины."""
+        return self.db_manager.check_all_vms(list_filter)
+
+
+class CapacityCommand(Command):
+    """Команда для получения суммарных ресурсов ВМ и дисков."""
+
+    readonly = True
+
+    def __init__(self, db_manager: Storage):
         self.db_manager = db_manager
 
-    async def execute(self) -> str:
-        """Проверяет все виртуальные машины."""
-        return await self.db_manager.check_all_vms()
+    async def execute(self, vm_id: str = None) -> str:
+        """Возвращает итоги по всем ВМ либо число и объем дисков одной ВМ."""
+        return await self.db_manager.get_capacity(vm_id)
+
+
+class WatchCommand(Command):
+    """Команда подписки соединения на события изменения ВМ и дисков."""
+
+    admitted = False
+
+    readonly = True
 
+    streaming = True
+
+    def __init__(self, db_manager: Storage):
+        self.db_manager = db_manager
+
+    def keys(self, *args) -> tuple:
+        """Подписка начинается после всех предыдущих команд соединения."""
+        return ()
+
+    async def execute(self, prefix: str = None):
+        """Возвращает бесконечный поток событий (для ВМ с ID, начинающимся с prefix)."""
+        return self.db_manager.watch(prefix)
+
+
+class StatsCommand(Command):
+    """Команда для получения метрик процесса сервера."""
+
+    readonly = True
+
+    def __init__(self, metrics: Metrics):
+        self.metrics = metrics
+
+    async def execute(self) -> str:
+        """Возвращает счетчики и гистограммы задержек команд и запросов к БД."""
+        return self.metrics.render_text()
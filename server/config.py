@@ -1,4 +1,5 @@
 import os
+import sys
 from dotenv import load_dotenv
 from loguru import logger
 
@@ -9,5 +10,112 @@ DB_PORT = os.getenv("DB_PORT")
 DB_USER = os.getenv("DB_USER")
 DB_PASSWORD = os.getenv("DB_PASSWORD")
 DB_NAME = os.getenv("DB_NAME")
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", 10))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", 10))
+DB_ACQUIRE_TIMEOUT = float(os.getenv("DB_ACQUIRE_TIMEOUT", 5))
+DB_COMMAND_TIMEOUT = float(os.getenv("DB_COMMAND_TIMEOUT", 30))
+# Подготовка частых запросов на каждом новом соединении пула до приема команд
+DB_POOL_WARM_UP = os.getenv("DB_POOL_WARM_UP", "true").lower() in ("1", "true", "yes")
+# Реплики для чтения LIST_*: DSN через запятую (пусто — все запросы к основному серверу).
+# Реплика, отставшая больше чем на REPLICA_MAX_LAG байт WAL или недоступная, исключается
+# до следующей проверки (раз в REPLICA_CHECK_INTERVAL с); пулы реплик — того же размера.
+DB_REPLICAS = [dsn.strip() for dsn in os.getenv("DB_REPLICAS", "").split(",") if dsn.strip()]
+REPLICA_MAX_LAG = int(os.getenv("REPLICA_MAX_LAG", 16 * 1024 * 1024))
+REPLICA_CHECK_INTERVAL = float(os.getenv("REPLICA_CHECK_INTERVAL", 1))
 
-logger.add("server.log", rotation="10 MB", compression="zip", level="INFO")
+# Хранилище: postgres или memory (встроенное, в памяти процесса; только при WORKERS=1).
+# memory сохраняет изменения в журнал и снимки в STORAGE_DIR (пусто — без сохранения на диск);
+# STORAGE_FSYNC: always — fsync после каждого изменения, everysec — раз в секунду, no — силами ОС.
+# Снимок делается раз в SNAPSHOT_INTERVAL с или когда журнал вырос до SNAPSHOT_LOG_SIZE байт.
+STORAGE_ENGINE = os.getenv("STORAGE_ENGINE", "postgres").lower()
+STORAGE_DIR = os.getenv("STORAGE_DIR", "data")
+STORAGE_FSYNC = os.getenv("STORAGE_FSYNC", "everysec").lower()
+SNAPSHOT_INTERVAL = float(os.getenv("SNAPSHOT_INTERVAL", 300))
+SNAPSHOT_LOG_SIZE = int(os.getenv("SNAPSHOT_LOG_SIZE", 64 * 1024 * 1024))
+
+# Адрес сервера и число процессов-обработчиков (больше 1 — режим SO_REUSEPORT)
+SERVER_HOST = os.getenv("SERVER_HOST", "0.0.0.0")
+SERVER_PORT = int(os.getenv("SERVER_PORT", 8888))
+WORKERS = int(os.getenv("WORKERS", 1))
+WORKER_RESTART_DELAY = float(os.getenv("WORKER_RESTART_DELAY", 1))
+SHUTDOWN_TIMEOUT = float(os.getenv("SHUTDOWN_TIMEOUT", 30))
+# Остановка по SIGTERM: /ready отвечает 503 в течение DRAIN_DELAY с, затем прием соединений
+# прекращается, а открытые соединения до DRAIN_TIMEOUT с получают ответы на принятые команды
+DRAIN_DELAY = float(os.getenv("DRAIN_DELAY", 0))
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", 20))
+# Порт HTTP-эндпоинта метрик Prometheus (0 — отключен); обработчик N слушает METRICS_PORT + N
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+
+# WATCH: буфер событий на подписчика (при переполнении старые события вытесняются).
+# EVENTS_NOTIFY рассылает события другим процессам через NOTIFY в канал EVENTS_CHANNEL;
+# по умолчанию включено, если обработчиков несколько.
+WATCH_BUFFER_SIZE = int(os.getenv("WATCH_BUFFER_SIZE", 1000))
+EVENTS_CHANNEL = os.getenv("EVENTS_CHANNEL", "vm_events")
+EVENTS_NOTIFY = os.getenv("EVENTS_NOTIFY", str(WORKERS > 1)).lower() in ("1", "true", "yes")
+
+# Протокол: максимальная длина одной команды и конвейер соединения
+MAX_LINE_LENGTH = int(os.getenv("MAX_LINE_LENGTH", 1024 * 1024))
+PIPELINE_CONCURRENCY = int(os.getenv("PIPELINE_CONCURRENCY", 32))
+PIPELINE_DEPTH = int(os.getenv("PIPELINE_DEPTH", 1024))
+# Сколько строк читается из курсора и отправляется клиенту за раз в ответах LIST_*
+LIST_CHUNK_SIZE = int(os.getenv("LIST_CHUNK_SIZE", 500))
+# Сколько ответов LIST_* одновременно читают курсором из БД: меньше пула, чтобы медленные
+# читатели не заняли все соединения. Часть ответа, которую клиент не принял за
+# STREAM_SEND_TIMEOUT секунд, прерывает ответ и закрывает соединение (0 — не ограничено)
+LIST_MAX_CURSORS = int(os.getenv("LIST_MAX_CURSORS", max(1, DB_POOL_MAX_SIZE - 2)))
+STREAM_SEND_TIMEOUT = float(os.getenv("STREAM_SEND_TIMEOUT", 30))
+# Кэш готовых ответов LIST_* до следующего изменения данных: лимит памяти в байтах (0 — отключен).
+# Работает только при WORKERS=1: об изменениях других процессов кэш не узнает.
+LIST_CACHE_MAX_BYTES = int(os.getenv("LIST_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+# Сколько секунд одинаковый запрос ждет ответа первого, прежде чем выполниться самому
+LIST_CACHE_WAIT_TIMEOUT = float(os.getenv("LIST_CACHE_WAIT_TIMEOUT", 0.5))
+
+# Допуск команд: общий лимит и лимит на адрес клиента (меньше общего, чтобы один клиент
+# не занял все места), очередь ожидания и ее таймаут (с)
+MAX_CONCURRENT_COMMANDS = int(os.getenv("MAX_CONCURRENT_COMMANDS", 64))
+MAX_CLIENT_COMMANDS = int(os.getenv("MAX_CLIENT_COMMANDS", 32))
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", 1024))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", 1))
+
+# Реестр ВМ в памяти процесса: максимум записей (0 — реестр отключен)
+REGISTRY_MAX_ENTRIES = int(os.getenv("REGISTRY_MAX_ENTRIES", 100_000))
+
+# Пересчет итогов CAPACITY по БД раз в столько секунд (0 — только при запуске). Итоги ведутся
+# инкрементально в каждом процессе; изменения других процессов приходят с событиями NOTIFY
+# (EVENTS_NOTIFY), пересчет исправляет расхождения из-за потерянных уведомлений.
+CAPACITY_RESYNC_INTERVAL = float(os.getenv("CAPACITY_RESYNC_INTERVAL", 60))
+
+# Аренда аутентификации: AUTH выдает аренду на AUTH_LEASE_TTL с (0 — бессрочно), HEARTBEAT продлевает.
+# Истекшие аренды снимаются фоновой задачей раз в LEASE_SWEEP_INTERVAL с пачками по LEASE_SWEEP_BATCH ВМ.
+AUTH_LEASE_TTL = float(os.getenv("AUTH_LEASE_TTL", 300))
+LEASE_SWEEP_INTERVAL = float(os.getenv("LEASE_SWEEP_INTERVAL", 1))
+LEASE_SWEEP_BATCH = int(os.getenv("LEASE_SWEEP_BATCH", 10000))
+
+# Групповая фиксация смены флагов (AUTH / LOGOUT_VM / REMOVE_VM): окно в мс (0 — отключена)
+GROUP_COMMIT_WINDOW_MS = float(os.getenv("GROUP_COMMIT_WINDOW_MS", 0))
+GROUP_COMMIT_MAX_BATCH = int(os.getenv("GROUP_COMMIT_MAX_BATCH", 1000))
+
+# Логирование. LOG_ENQUEUE переносит запись и ротацию файлов в фоновый поток
+# (общий для всех процессов-обработчиков), LOG_JSON пишет записи в JSON вместе
+# со структурированными полями (command, vm_id, duration_ms).
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+# Файл лога с ротацией по 10 МБ (пусто — только stderr)
+LOG_FILE = os.getenv("LOG_FILE", "server.log")
+LOG_ENQUEUE = os.getenv("LOG_ENQUEUE", "true").lower() in ("1", "true", "yes")
+LOG_JSON = os.getenv("LOG_JSON", "false").lower() in ("1", "true", "yes")
+# Доля записываемых сообщений об успешных командах: общая и по командам ("AUTH=0.01,ADD_VM=1")
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", 1))
+LOG_SAMPLE_RATES = {
+    name.strip().upper(): float(rate)
+    for name, _, rate in (
+        item.partition("=") for item in os.getenv("LOG_SAMPLE_RATES", "").split(",") if item.strip()
+    )
+}
+# Не более LOG_RATE_LIMIT сообщений об успехе в секунду на команду (0 — без ограничения)
+LOG_RATE_LIMIT = float(os.getenv("LOG_RATE_LIMIT", 1000))
+
+logger.remove()
+logger.add(sys.stderr, level=LOG_LEVEL, enqueue=LOG_ENQUEUE, serialize=LOG_JSON)
+if LOG_FILE:
+    logger.add(LOG_FILE, rotation="10 MB", compression="zip", level=LOG_LEVEL,
+               enqueue=LOG_ENQUEUE, serialize=LOG_JSON)
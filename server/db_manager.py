@@ -1,190 +1,848 @@
+import asyncio
+import time
+import uuid
+from contextlib import asynccontextmanager
+from functools import partial
+
 from loguru import logger as log
 import asyncpg
-from .config import DB_HOST, DB_PORT, DB_USER, DB_PASSWORD, DB_NAME
+from .capacity import Capacity
+from .config import (DB_HOST, DB_PORT, DB_USER, DB_PASSWORD, DB_NAME, REGISTRY_MAX_ENTRIES,
+                     AUTH_LEASE_TTL, LEASE_SWEEP_BATCH, LEASE_SWEEP_INTERVAL,
+                     CAPACITY_RESYNC_INTERVAL, EVENTS_CHANNEL, EVENTS_NOTIFY, WATCH_BUFFER_SIZE,
+                     LIST_CHUNK_SIZE, LIST_MAX_CURSORS, GROUP_COMMIT_WINDOW_MS, GROUP_COMMIT_MAX_BATCH,
+                     DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_ACQUIRE_TIMEOUT, DB_COMMAND_TIMEOUT,
+                     DB_POOL_WARM_UP, DB_REPLICAS, REPLICA_MAX_LAG, REPLICA_CHECK_INTERVAL,
+                     LIST_CACHE_MAX_BYTES, LIST_CACHE_WAIT_TIMEOUT, WORKERS)
+from .events import EventBus, Notifier
+from .group_commit import GroupCommit
+from .logs import success_log
+from .metrics import metrics, timed
+from .protocol import encode_lines
+from .migrations import LATEST_VERSION, migrate
+from .registry import VMRegistry
+from .replies import (ALREADY_EXISTS, AUTH_FAILED, NOT_AUTHENTICATED, NOT_FOUND, Reply,
+                      bulk_reply)
+from .replicas import PRIMARY_LSN, ReplicaSet, parse_lsn
+from .response_cache import ResponseCache
+from .storage import ListFilter, Storage, current_session, format_disk, format_vm
+
+# Срок окончания аренды, выдаваемой AUTH и продлеваемой HEARTBEAT
+LEASE_EXPIRES_AT = f"now() + interval '{AUTH_LEASE_TTL} seconds'" if AUTH_LEASE_TTL > 0 else "NULL"
+
+
+def lease_deadline():
+    """Срок только что выданной аренды по часам процесса (для реестра); None — бессрочно."""
+    return time.monotonic() + AUTH_LEASE_TTL if AUTH_LEASE_TTL > 0 else None
+
+# Частые запросы одиночных команд. Вынесены в константы, чтобы warm_up готовил
+# на новых соединениях пула ровно те же тексты, что выполняют команды.
+SELECT_VM = "SELECT ram, cpu, is_active, is_auth FROM vms WHERE id = $1"
+SELECT_VM_ID = "SELECT id FROM vms WHERE id = $1"
+INSERT_VM = "INSERT INTO vms (id, ram, cpu, is_active) VALUES ($1, $2, $3, TRUE)"
+INSERT_AUTH_VM = (
+    "INSERT INTO vms (id, ram, cpu, is_active, is_auth, lease_expires_at) "
+    f"VALUES ($1, $2, $3, TRUE, TRUE, {LEASE_EXPIRES_AT})"
+)
+UPDATE_VM = (
+    "UPDATE vms SET ram = $2, cpu = $3 "
+    "FROM (SELECT id, ram, cpu FROM vms WHERE id = $1 FOR UPDATE) AS old "
+    "WHERE vms.id = old.id "
+    "RETURNING vms.is_active, vms.is_auth, old.ram AS old_ram, old.cpu AS old_cpu"
+)
+INSERT_DISK = "INSERT INTO disks (id, vm_id, size) VALUES ($1, $2, $3)"
+DELETE_DISK = "DELETE FROM disks WHERE id = $1 RETURNING vm_id, size"
+
+# Смена флагов ВМ для набора ID. Строки блокируются в порядке ID, чтобы
+# параллельные групповые транзакции не взаимоблокировались; прежние флаги
+# возвращаются для итогов CAPACITY. heartbeat продлевает аренду только
+# аутентифицированным ВМ.
+FLAG_UPDATES = {
+    kind: (
+        f"UPDATE vms SET {assignments} "
+        "FROM (SELECT id, is_active AS was_active, is_auth AS was_auth FROM vms "
+        f"WHERE id = ANY($1::text[]){condition} ORDER BY id FOR UPDATE) AS locked "
+        "WHERE vms.id = locked.id "
+        "RETURNING vms.id, vms.ram, vms.cpu, vms.is_active, vms.is_auth, "
+        "locked.was_active, locked.was_auth"
+    )
+    for kind, (assignments, condition) in {
+        "auth": (f"is_active = TRUE, is_auth = TRUE, lease_expires_at = {LEASE_EXPIRES_AT}", ""),
+        "heartbeat": (f"lease_expires_at = {LEASE_EXPIRES_AT}", " AND is_active AND is_auth"),
+        "logout": ("is_auth = FALSE, lease_expires_at = NULL", ""),
+        "remove": ("is_active = FALSE, is_auth = FALSE, lease_expires_at = NULL", ""),
+    }.items()
+}
+
+# Блокировка строк ВМ группы изменений в порядке ID: транзакции групповой фиксации
+# с пересекающимися наборами ВМ ждут друг друга, а не блокируют взаимно
+LOCK_VMS = "SELECT id FROM vms WHERE id = ANY($1::text[]) ORDER BY id FOR UPDATE"
 
-class DatabaseManager:
+# Снятие истекших аренд пачкой. Строки, заблокированные другими транзакциями
+# (или другим процессом, выполняющим ту же очистку), пропускаются до следующего прохода.
+EXPIRE_LEASES = (
+    "UPDATE vms SET is_auth = FALSE, lease_expires_at = NULL "
+    "FROM (SELECT id FROM vms WHERE is_auth AND lease_expires_at < now() "
+    "ORDER BY lease_expires_at LIMIT $1 FOR UPDATE SKIP LOCKED) AS expired "
+    "WHERE vms.id = expired.id "
+    "RETURNING vms.id, vms.ram, vms.cpu, vms.is_active"
+)
+
+
+class DatabaseManager(Storage):
     """Класс для управления соединением с базой данных и инициализацией таблиц."""
 
-    def __init__(self):
+    def __init__(self, registry_size=REGISTRY_MAX_ENTRIES):
         """Инициализация объекта DatabaseManager. На старте не создается соединение с БД."""
         self.db_pool = None
+        self.registry = VMRegistry(registry_size)
+        self.capacity = Capacity()
+        self.cursors = asyncio.Semaphore(LIST_MAX_CURSORS)
+        self.tasks = []
+        self.events = EventBus(WATCH_BUFFER_SIZE)
+        self.events.on_remote = self.remote_changed
+        self.notifier = None
+        self.list_cache = None
+        if LIST_CACHE_MAX_BYTES > 0 and WORKERS == 1:
+            self.list_cache = ResponseCache(LIST_CACHE_MAX_BYTES, LIST_CACHE_WAIT_TIMEOUT)
+            for name in ("hits", "misses", "evictions", "size"):
+                metrics.gauges[f"list_cache_{name}"] = partial(getattr, self.list_cache, name)
+            metrics.gauges["list_cache_entries"] = lambda: len(self.list_cache.entries)
+        self.replicas = None
+        if DB_REPLICAS:
+            self.replicas = ReplicaSet(DB_REPLICAS, self.create_replica_pool, REPLICA_MAX_LAG,
+                                       REPLICA_CHECK_INTERVAL, DB_ACQUIRE_TIMEOUT)
+            metrics.gauges["db_replicas_healthy"] = lambda: sum(
+                replica.healthy for replica in self.replicas.replicas
+            )
+        self.group_commit = None
+        if GROUP_COMMIT_WINDOW_MS > 0:
+            self.group_commit = GroupCommit(
+                self.apply_flag_changes, GROUP_COMMIT_WINDOW_MS / 1000, GROUP_COMMIT_MAX_BATCH
+            )
+
+    async def initialize(self, create_schema=True):
+        """Инициализация пула соединений с базой данных и применение миграций схемы.
 
-    async def initialize(self):
-        """Инициализация пула соединений с базой данных и создание таблиц."""
+        create_schema=False пропускает миграции: так запускаются процессы-обработчики,
+        схему для которых заранее готовит процесс-супервизор. Миграции выполняются
+        до создания пула, чтобы соединения пула сразу готовили запросы к актуальной схеме.
+        """
         try:
+            if create_schema:
+                conn = await self.connect()
+                try:
+                    await self.create_schema(conn)
+                finally:
+                    await conn.close()
+
+            started = time.perf_counter()
             self.db_pool = await asyncpg.create_pool(
                 user=DB_USER,
                 password=DB_PASSWORD,
                 database=DB_NAME,
                 host=DB_HOST,
-                port=DB_PORT
+                port=DB_PORT,
+                min_size=DB_POOL_MIN_SIZE,
+                max_size=DB_POOL_MAX_SIZE,
+                command_timeout=DB_COMMAND_TIMEOUT,
+                init=self.warm_up if DB_POOL_WARM_UP else None
             )
-            log.info("✅ Успешно подключено к базе данных")
-
-            async with self.db_pool.acquire() as conn:
-                await conn.execute('''CREATE TABLE IF NOT EXISTS vms (
-                        id TEXT PRIMARY KEY,
-                        ram INT NOT NULL,
-                        cpu INT NOT NULL,
-                        is_active BOOLEAN DEFAULT FALSE,
-                        is_auth BOOLEAN DEFAULT FALSE
-                    )
-                ''')
-                await conn.execute('''CREATE TABLE IF NOT EXISTS disks (
-                        id TEXT PRIMARY KEY,
-                        vm_id TEXT REFERENCES vms(id) ON DELETE CASCADE,
-                        size INT NOT NULL
-                    )
-                ''')
-                log.info("✅ Таблицы базы данных созданы")
+            log.info(f"✅ Успешно подключено к базе данных: соединений {DB_POOL_MIN_SIZE}, "
+                     f"{(time.perf_counter() - started) * 1000:.0f} мс")
+
+            async with self.acquire() as conn:
+                await self.load_registry(conn)
+                await self.load_capacity(conn)
+            if self.replicas is not None:
+                await self.replicas.start(self.primary_lsn)
+            if CAPACITY_RESYNC_INTERVAL > 0:
+                self.tasks.append(asyncio.create_task(self.resync_capacity()))
+            if AUTH_LEASE_TTL > 0:
+                self.tasks.append(asyncio.create_task(self.sweep_leases()))
+            if EVENTS_NOTIFY:
+                self.notifier = Notifier(self.events, EVENTS_CHANNEL, self.connect, self.acquire)
+                self.notifier.start()
         except Exception as e:
             log.critical(f"Ошибка подключения к базе данных: {e}")
             raise
 
-    async def authenticate_vm(self, vm_id, ram, cpu):
-        """Аутентификация виртуальной машины по ID, RAM и CPU."""
-        async with self.db_pool.acquire() as conn:
-            existing = await conn.fetchrow(
-                "SELECT ram, cpu FROM vms WHERE id = $1",
-                vm_id
+    async def connect(self):
+        """Отдельное соединение вне пула (для LISTEN)."""
+        return await asyncpg.connect(user=DB_USER, password=DB_PASSWORD, database=DB_NAME,
+                                     host=DB_HOST, port=DB_PORT)
+
+    async def create_replica_pool(self, dsn):
+        """Пул соединений реплики (только для чтения)."""
+        return await asyncpg.create_pool(
+            dsn,
+            min_size=DB_POOL_MIN_SIZE,
+            max_size=DB_POOL_MAX_SIZE,
+            command_timeout=DB_COMMAND_TIMEOUT,
+            init=self.warm_up_replica if DB_POOL_WARM_UP else None
+        )
+
+    async def primary_lsn(self):
+        """Текущая позиция WAL основного сервера."""
+        async with self.acquire() as conn:
+            return parse_lsn(await conn.fetchval(PRIMARY_LSN))
+
+    async def session_lsn(self):
+        """Позиция WAL, которую должна применить реплика, чтобы текущая сессия
+        увидела на ней свои изменения (0 — сессия ничего не меняла)."""
+        session = current_session.get()
+        if session is None:
+            return 0
+        if session.wrote:
+            # Чтение выполняется после всех предыдущих команд соединения, поэтому
+            # позиция, полученная сейчас, покрывает все изменения сессии
+            session.wrote = False
+            session.lsn = await self.primary_lsn()
+        return session.lsn
+
+    @asynccontextmanager
+    async def acquire_read(self):
+        """Соединение для чтения: реплика, уже видящая изменения сессии, иначе основной сервер."""
+        if self.replicas is not None:
+            async with self.replicas.acquire(await self.session_lsn()) as conn:
+                if conn is not None:
+                    yield conn
+                    return
+        async with self.acquire() as conn:
+            yield conn
+
+    @asynccontextmanager
+    async def acquire(self):
+        """Соединение из пула; ожидание свободного соединения ограничено DB_ACQUIRE_TIMEOUT.
+
+        Время ожидания и время удержания соединения записываются в метрики.
+        """
+        started = time.perf_counter()
+        async with self.db_pool.acquire(timeout=DB_ACQUIRE_TIMEOUT) as conn:
+            acquired = time.perf_counter()
+            metrics.pool_wait.observe(acquired - started)
+            try:
+                yield conn
+            finally:
+                metrics.pool_hold.observe(time.perf_counter() - acquired)
+
+    async def close(self):
+        """Закрытие пулов соединений."""
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        if self.replicas is not None:
+            await self.replicas.close()
+        if self.notifier is not None:
+            await self.notifier.stop()
+            self.notifier = None
+        if self.db_pool is not None:
+            await self.db_pool.close()
+            self.db_pool = None
+
+    async def create_schema(self, conn):
+        """Применение миграций схемы (см. migrations.py)."""
+        applied = await migrate(conn)
+        if AUTH_LEASE_TTL > 0:
+            # ВМ, аутентифицированные без аренды (до ее введения или при AUTH_LEASE_TTL=0),
+            # получают полный срок
+            await conn.execute(
+                f"UPDATE vms SET lease_expires_at = {LEASE_EXPIRES_AT} "
+                "WHERE is_auth AND lease_expires_at IS NULL"
             )
-            if existing:
-                if existing['ram'] == ram and existing['cpu'] == cpu:
-                    await conn.execute(
-                        "UPDATE vms SET is_active = TRUE, is_auth = TRUE WHERE id = $1",
-                        vm_id
-                    )
-                    log.info(f"ВМ {vm_id} аутентифицирована")
-                    return f"ВМ {vm_id} аутентифицирована"
-                return "Ошибка аутентификации: неверные характеристики"
+        if applied:
+            log.info(f"✅ Схема базы данных обновлена до версии {LATEST_VERSION}")
+        else:
+            log.info(f"✅ Схема базы данных актуальна (версия {LATEST_VERSION})")
+
+    async def warm_up(self, conn):
+        """Подготовка частых запросов на новом соединении пула.
+
+        Запросы выполняются для несуществующих ID в транзакции, которая откатывается:
+        соединение заранее разбирает их и загружает типы, и первые команды после
+        запуска не платят за это. Запросы списков готовятся без фильтров.
+        """
+        vm_id = disk_id = f"warmup-{uuid.uuid4().hex}"
+        transaction = conn.transaction()
+        await transaction.start()
+        try:
+            await conn.fetchrow(SELECT_VM, vm_id)
+            await conn.fetchrow(SELECT_VM_ID, vm_id)
+            await conn.execute(INSERT_AUTH_VM, vm_id, 0, 0)
+            await conn.fetchrow(UPDATE_VM, vm_id, 0, 0)
+            await conn.execute(INSERT_DISK, disk_id, vm_id, 0)
+            await conn.fetchrow(DELETE_DISK, disk_id)
+            await conn.fetch(LOCK_VMS, [vm_id])
+            for query in FLAG_UPDATES.values():
+                await conn.fetch(query, [vm_id])
+            await conn.fetch(EXPIRE_LEASES, 0)
+            await conn.execute(INSERT_VM, f"{vm_id}-vm", 0, 0)
+            await self.warm_up_lists(conn)
+        finally:
+            await transaction.rollback()
+
+    async def warm_up_replica(self, conn):
+        """Подготовка запросов списков на новом соединении пула реплики."""
+        transaction = conn.transaction(readonly=True)
+        await transaction.start()
+        try:
+            await self.warm_up_lists(conn)
+        finally:
+            await transaction.rollback()
+
+    async def warm_up_lists(self, conn):
+        """Запросы LIST_* без фильтров (внутри транзакции: курсору она нужна)."""
+        for condition in ("is_active = TRUE", "is_auth = TRUE AND is_active = TRUE", None):
+            query, args = self.vm_query(condition, ListFilter())
+            await (await conn.cursor(query, *args)).fetch(1)
+        query, args = self.disk_query(ListFilter())
+        await (await conn.cursor(query, *args)).fetch(1)
+
+    async def load_registry(self, conn):
+        """Загрузка характеристик ВМ в реестр при старте."""
+        if not self.registry.max_entries:
+            return
+        records = await conn.fetch(
+            "SELECT id, ram, cpu, is_active, is_auth FROM vms LIMIT $1",
+            self.registry.max_entries
+        )
+        for r in records:
+            self.registry.put(r['id'], r['ram'], r['cpu'], r['is_active'], r['is_auth'])
+        log.info(f"✅ В реестр загружено ВМ: {len(records)}")
+
+    async def load_capacity(self, conn):
+        """Подсчет итогов CAPACITY по частичным индексам.
 
+        Запросы выполняются в одном снимке данных. Изменения этого процесса,
+        внесенные, пока шли запросы, не теряются: итоги заменяются пересчитанными
+        вместе с ними (Capacity.rebase).
+        """
+        capacity = Capacity()
+        base = self.capacity.snapshot()
+        async with conn.transaction(isolation="repeatable_read", readonly=True):
+            capacity.active_vms, capacity.active_ram, capacity.active_cpu = await conn.fetchrow(
+                "SELECT count(*), coalesce(sum(ram), 0), coalesce(sum(cpu), 0) FROM vms "
+                "WHERE is_active"
+            )
+            capacity.auth_vms, capacity.auth_ram, capacity.auth_cpu = await conn.fetchrow(
+                "SELECT count(*), coalesce(sum(ram), 0), coalesce(sum(cpu), 0) FROM vms "
+                "WHERE is_active AND is_auth"
+            )
+            for vm_id, count, total in await conn.fetch(
+                "SELECT vm_id, count(*), sum(size) FROM disks GROUP BY vm_id"
+            ):
+                capacity.vm_disks[vm_id] = (count, total)
+                capacity.disks += count
+                capacity.disk_gb += total
+        self.capacity.rebase(capacity, base)
+
+    async def resync_capacity(self):
+        """Периодический пересчет итогов CAPACITY.
+
+        Изменения других процессов приходят через NOTIFY вместе с изменением
+        итогов (remote_changed); пересчет раз в CAPACITY_RESYNC_INTERVAL с
+        исправляет расхождения, если уведомления были потеряны (например, пока
+        соединение LISTEN переподключалось).
+        """
+        while True:
+            await asyncio.sleep(CAPACITY_RESYNC_INTERVAL)
             try:
-                await conn.execute(
-                    "INSERT INTO vms (id, ram, cpu, is_active, is_auth) "
-                    "VALUES ($1, $2, $3, TRUE, TRUE)",
-                    vm_id, ram, cpu
-                )
-                log.info(f"ВМ {vm_id} зарегистрирована и аутентифицирована")
-                return f"ВМ {vm_id} зарегистрирована и аутентифицирована"
-            except asyncpg.UniqueViolationError:
-                log.warning(f"ВМ {vm_id} уже существует")
-                return f"ВМ {vm_id} уже существует"
+                async with self.acquire() as conn:
+                    await self.load_capacity(conn)
+            except Exception as e:
+                log.error(f"Ошибка пересчета итогов CAPACITY: {e}")
+
+    async def sweep_leases(self):
+        """Фоновое снятие истекших аренд раз в LEASE_SWEEP_INTERVAL с."""
+        while True:
+            await asyncio.sleep(LEASE_SWEEP_INTERVAL)
+            try:
+                await self.expire_leases()
+            except Exception as e:
+                log.error(f"Ошибка снятия истекших аренд: {e}")
+
+    @timed
+    async def expire_leases(self):
+        """Деавторизация ВМ с истекшей арендой пачками по LEASE_SWEEP_BATCH.
+
+        Возвращает число деавторизованных ВМ.
+        """
+        expired = 0
+        while True:
+            async with self.acquire() as conn:
+                rows = await conn.fetch(EXPIRE_LEASES, LEASE_SWEEP_BATCH)
+            for r in rows:
+                self.registry.evict(r['id'])
+                self.vm_changed(r['id'], (r['ram'], r['cpu'], r['is_active'], True),
+                                (r['ram'], r['cpu'], r['is_active'], False))
+            expired += len(rows)
+            if len(rows) < LEASE_SWEEP_BATCH:
+                break
+        if expired:
+            success_log.info("LEASE_SWEEP", "Истекла аренда ВМ: {}", expired)
+        return expired
+
+    @timed
+    async def authenticate_vm(self, vm_id, ram, cpu):
+        """Аутентификация виртуальной машины по ID, RAM и CPU. Выдает или продлевает аренду.
+
+        Повторная аутентификация ВМ из реестра не обращается к БД, пока до конца
+        аренды остается больше половины срока; после этого аренда продлевается.
+        """
+        cached = self.registry.get(vm_id)
+        if cached is not None:
+            if cached.ram != ram or cached.cpu != cpu:
+                return Reply("Ошибка аутентификации: неверные характеристики", AUTH_FAILED)
+            if cached.is_auth and cached.is_active and (
+                    AUTH_LEASE_TTL <= 0
+                    or (cached.lease_expires or 0) - time.monotonic() > AUTH_LEASE_TTL / 2
+                    or await self.renew_lease(vm_id, cached)):
+                success_log.info("AUTH", "ВМ {} аутентифицирована", vm_id, vm_id=vm_id)
+                return f"ВМ {vm_id} аутентифицирована"
+
+        token = self.registry.invalidate(vm_id)
+        async with self.acquire() as conn:
+            existing = await conn.fetchrow(SELECT_VM, vm_id)
+            if not existing:
+                try:
+                    await conn.execute(INSERT_AUTH_VM, vm_id, ram, cpu)
+                    self.registry.store(vm_id, token, ram, cpu, True, True, lease_deadline())
+                    self.vm_changed(vm_id, None, (ram, cpu, True, True))
+                    success_log.info("AUTH", "ВМ {} зарегистрирована и аутентифицирована",
+                                     vm_id, vm_id=vm_id)
+                    return f"ВМ {vm_id} зарегистрирована и аутентифицирована"
+                except asyncpg.UniqueViolationError:
+                    log.warning(f"ВМ {vm_id} уже существует")
+                    return Reply(f"ВМ {vm_id} уже существует", ALREADY_EXISTS)
+
+        if existing['ram'] != ram or existing['cpu'] != cpu:
+            self.registry.store(vm_id, token, existing['ram'], existing['cpu'],
+                                existing['is_active'], existing['is_auth'])
+            return Reply("Ошибка аутентификации: неверные характеристики", AUTH_FAILED)
+
+        row = await self.change_flags("auth", vm_id)
+        if row is None:
+            log.warning(f"ВМ {vm_id} не найдена для аутентификации")
+            return Reply("ВМ не найдена", NOT_FOUND)
+        self.registry.store(vm_id, token, row['ram'], row['cpu'], True, True, lease_deadline())
+        success_log.info("AUTH", "ВМ {} аутентифицирована", vm_id, vm_id=vm_id)
+        return f"ВМ {vm_id} аутентифицирована"
+
+    async def renew_lease(self, vm_id, cached) -> bool:
+        """Продление аренды ВМ из реестра. False — ВМ уже не аутентифицирована в БД."""
+        deadline = lease_deadline()
+        if await self.change_flags("heartbeat", vm_id) is None:
+            return False
+        cached.lease_expires = deadline
+        return True
+
+    @timed
+    async def change_flags(self, kind, vm_id):
+        """Смена флагов ВМ (kind — ключ FLAG_UPDATES).
 
+        При включенной групповой фиксации изменение применяется вместе с другими
+        за окно GROUP_COMMIT_WINDOW_MS. Возвращает строку ВМ после изменения
+        или None, если ВМ не найдена.
+        """
+        if self.group_commit is not None:
+            row = await self.group_commit.submit((kind, vm_id))
+        else:
+            async with self.acquire() as conn:
+                row = await conn.fetchrow(FLAG_UPDATES[kind], [vm_id])
+        if row is not None:
+            self.vm_changed(
+                vm_id,
+                (row['ram'], row['cpu'], row['was_active'], row['was_auth']),
+                (row['ram'], row['cpu'], row['is_active'], row['is_auth'])
+            )
+        return row
+
+    @timed
+    async def apply_flag_changes(self, changes):
+        """Применение группы смен флагов одной транзакцией.
+
+        changes — список пар (kind, vm_id). Изменения одной ВМ применяются по порядку:
+        группа делится на отрезки без повторов ВМ, и в каждом отрезке выполняется
+        по одному UPDATE ... WHERE id = ANY($1) на вид изменения. Все ВМ группы
+        блокируются заранее одним запросом в порядке ID (LOCK_VMS): иначе отрезки
+        и виды изменений захватывали бы строки в разном порядке, и две группы
+        могли бы заблокировать друг друга.
+        """
+        results = [None] * len(changes)
+        segments, current, seen = [], [], set()
+        for index, (_, vm_id) in enumerate(changes):
+            if vm_id in seen:
+                segments.append(current)
+                current, seen = [], set()
+            current.append(index)
+            seen.add(vm_id)
+        segments.append(current)
+
+        async with self.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute(LOCK_VMS, list({vm_id for _, vm_id in changes}))
+                for segment in segments:
+                    by_kind = {}
+                    for index in segment:
+                        by_kind.setdefault(changes[index][0], []).append(index)
+                    for kind, indexes in by_kind.items():
+                        rows = await conn.fetch(
+                            FLAG_UPDATES[kind], [changes[i][1] for i in indexes]
+                        )
+                        found = {r['id']: r for r in rows}
+                        for i in indexes:
+                            results[i] = found.get(changes[i][1])
+        success_log.info("GROUP_COMMIT", "Групповая фиксация: применено изменений флагов: {}",
+                         len(changes))
+        return results
+
+    @timed
     async def add_vm(self, vm_id, ram, cpu):
         """Добавление новой виртуальной машины."""
-        async with self.db_pool.acquire() as conn:
+        token = self.registry.invalidate(vm_id)
+        async with self.acquire() as conn:
             try:
-                await conn.execute(
-                    "INSERT INTO vms (id, ram, cpu, is_active) "
-                    "VALUES ($1, $2, $3, TRUE)",
-                    vm_id, ram, cpu
-                )
-                log.info(f"ВМ {vm_id} добавлена")
+                await conn.execute(INSERT_VM, vm_id, ram, cpu)
+                self.registry.store(vm_id, token, ram, cpu, True, False)
+                self.vm_changed(vm_id, None, (ram, cpu, True, False))
+                success_log.info("ADD_VM", "ВМ {} добавлена", vm_id, vm_id=vm_id)
                 return f"ВМ {vm_id} добавлена"
             except asyncpg.UniqueViolationError:
                 log.warning(f"ВМ {vm_id} уже существует")
-                return f"ВМ {vm_id} уже существует"
-
-    async def list_vms(self):
-        """Список активных виртуальных машин."""
-        async with self.db_pool.acquire() as conn:
-            records = await conn.fetch("SELECT * FROM vms WHERE is_active = TRUE")
-            if not records:
-                log.info("Виртуальные машины не найдены")
-                return "Виртуальные машины не найдены"
-            return "\n".join([f"{r['id']}: {r['ram']}MB RAM, {r['cpu']}CPU" for r in records])
-
-    async def list_authenticated_vms(self):
-        """Список авторизованных виртуальных машин."""
-        async with self.db_pool.acquire() as conn:
-            records = await conn.fetch(
-                "SELECT * FROM vms WHERE is_auth = TRUE AND is_active = TRUE"
+                return Reply(f"ВМ {vm_id} уже существует", ALREADY_EXISTS)
+
+    @timed
+    async def bulk_add_vms(self, vms):
+        """Пакетное добавление виртуальных машин одним запросом в одной транзакции.
+
+        vms — список кортежей (vm_id, ram, cpu). Возвращает результат по каждой ВМ.
+        """
+        ids = [vm_id for vm_id, _, _ in vms]
+        tokens = {vm_id: self.registry.invalidate(vm_id) for vm_id in ids}
+        async with self.acquire() as conn:
+            rows = await conn.fetch(
+                "INSERT INTO vms (id, ram, cpu, is_active) "
+                "SELECT id, ram, cpu, TRUE "
+                "FROM unnest($1::text[], $2::int[], $3::int[]) AS t(id, ram, cpu) "
+                "ON CONFLICT (id) DO NOTHING RETURNING id",
+                ids, [ram for _, ram, _ in vms], [cpu for _, _, cpu in vms]
             )
-            if not records:
-                log.info("Авторизованные ВМ не найдены")
-                return "Авторизованные ВМ не найдены"
-            return "\n".join([f"{r['id']}: {r['ram']}MB RAM, {r['cpu']}CPU" for r in records])
+        added = {r['id'] for r in rows}
+        counted = set()
+        for vm_id, ram, cpu in vms:
+            if vm_id in added and vm_id not in counted:
+                counted.add(vm_id)
+                self.registry.store(vm_id, tokens[vm_id], ram, cpu, True, False)
+                self.vm_changed(vm_id, None, (ram, cpu, True, False))
+        success_log.info("BULK_ADD_VM", "Пакетно добавлено ВМ: {} из {}", len(added), len(vms))
+        results = []
+        for vm_id in ids:
+            if vm_id in added:
+                added.discard(vm_id)
+                results.append(f"ВМ {vm_id} добавлена")
+            else:
+                results.append(Reply(f"ВМ {vm_id} уже существует", ALREADY_EXISTS))
+        return bulk_reply(results)
+
+    @timed
+    async def bulk_authenticate_vms(self, vms):
+        """Пакетная аутентификация виртуальных машин в одной транзакции.
+
+        vms — список кортежей (vm_id, ram, cpu). Возвращает результат по каждой ВМ.
+        """
+        ids = sorted({vm_id for vm_id, _, _ in vms})
+        tokens = {vm_id: self.registry.invalidate(vm_id) for vm_id in ids}
+        async with self.acquire() as conn:
+            async with conn.transaction():
+                # Строки блокируются в порядке ID: пересекающиеся пакеты ждут друг друга
+                existing = await conn.fetch(
+                    "SELECT id, ram, cpu, is_active, is_auth FROM vms "
+                    "WHERE id = ANY($1::text[]) ORDER BY id FOR UPDATE",
+                    ids
+                )
+                known = {r['id']: (r['ram'], r['cpu']) for r in existing}
+                flags = {r['id']: (r['is_active'], r['is_auth']) for r in existing}
+                to_auth, to_insert = set(), {}
+                for vm_id, ram, cpu in vms:
+                    if vm_id in known:
+                        if known[vm_id] == (ram, cpu) and vm_id not in to_insert:
+                            to_auth.add(vm_id)
+                    else:
+                        known[vm_id] = (ram, cpu)
+                        to_insert[vm_id] = (ram, cpu)
+
+                if to_auth:
+                    await conn.execute(
+                        "UPDATE vms SET is_active = TRUE, is_auth = TRUE, "
+                        f"lease_expires_at = {LEASE_EXPIRES_AT} "
+                        "WHERE id = ANY($1::text[])",
+                        sorted(to_auth)
+                    )
+                inserted = set()
+                if to_insert:
+                    rows = await conn.fetch(
+                        "INSERT INTO vms (id, ram, cpu, is_active, is_auth, lease_expires_at) "
+                        f"SELECT id, ram, cpu, TRUE, TRUE, {LEASE_EXPIRES_AT} "
+                        "FROM unnest($1::text[], $2::int[], $3::int[]) AS t(id, ram, cpu) "
+                        "ON CONFLICT (id) DO NOTHING RETURNING id",
+                        list(to_insert),
+                        [ram for ram, _ in to_insert.values()],
+                        [cpu for _, cpu in to_insert.values()]
+                    )
+                    inserted = {r['id'] for r in rows}
 
+        for vm_id in to_auth | inserted:
+            ram, cpu = known[vm_id]
+            self.registry.store(vm_id, tokens[vm_id], ram, cpu, True, True, lease_deadline())
+            old = (ram, cpu, *flags[vm_id]) if vm_id in flags else None
+            self.vm_changed(vm_id, old, (ram, cpu, True, True))
+        success_log.info("BULK_AUTH", "Пакетно аутентифицировано ВМ: {} из {}",
+                         len(to_auth) + len(inserted), len(vms))
+        results, registered = [], set()
+        for vm_id, ram, cpu in vms:
+            if vm_id in to_insert and vm_id not in inserted:
+                results.append(Reply(f"ВМ {vm_id} уже существует", ALREADY_EXISTS))
+            elif known[vm_id] != (ram, cpu):
+                results.append(Reply("Ошибка аутентификации: неверные характеристики", AUTH_FAILED))
+            elif vm_id in inserted and vm_id not in registered:
+                registered.add(vm_id)
+                results.append(f"ВМ {vm_id} зарегистрирована и аутентифицирована")
+            else:
+                results.append(f"ВМ {vm_id} аутентифицирована")
+        return bulk_reply(results)
+
+    async def fetch_batches(self, query, *args):
+        """Чтение результата запроса через серверный курсор пачками по LIST_CHUNK_SIZE записей.
+
+        Запрос выполняется на реплике, если они заданы (см. acquire_read). Курсор держит
+        соединение, пока клиент читает ответ, поэтому одновременно открыто не больше
+        LIST_MAX_CURSORS курсоров; ожидание места ограничено DB_ACQUIRE_TIMEOUT.
+        """
+        await asyncio.wait_for(self.cursors.acquire(), DB_ACQUIRE_TIMEOUT)
+        try:
+            async with self.acquire_read() as conn:
+                async with conn.transaction(readonly=True):
+                    batch = []
+                    async for record in conn.cursor(query, *args, prefetch=LIST_CHUNK_SIZE):
+                        batch.append(record)
+                        if len(batch) >= LIST_CHUNK_SIZE:
+                            yield batch
+                            batch = []
+                    if batch:
+                        yield batch
+        finally:
+            self.cursors.release()
+
+    def vm_query(self, condition, list_filter):
+        """Запрос выборки ВМ с условием condition и параметрами list_filter."""
+        clauses, args = [condition] if condition else [], []
+        if list_filter.after is not None:
+            args.append(list_filter.after)
+            clauses.append(f"id > ${len(args)}")
+        if list_filter.prefix:
+            args.append(list_filter.prefix)
+            clauses.append(f"starts_with(id, ${len(args)})")
+        if list_filter.with_disks:
+            clauses.append("EXISTS (SELECT 1 FROM disks d WHERE d.vm_id = vms.id)")
+        query = "SELECT id, ram, cpu FROM vms"
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " ORDER BY id"
+        if list_filter.limit is not None:
+            args.append(list_filter.limit + 1)
+            query += f" LIMIT ${len(args)}"
+        return query, args
+
+    def stream_rows(self, name, query, args, list_filter, render, empty_message):
+        """Потоковый ответ LIST_* на запрос query, через кэш ответов, если он включен.
+
+        Пока есть пригодные реплики, кэш не используется: ответ с отстающей реплики
+        мог бы попасть к сессии, которая должна видеть свои изменения.
+        """
+        def produce():
+            return self.stream_list(self.fetch_batches(query, *args), list_filter, render,
+                                    empty_message)
+
+        if self.list_cache is None or (self.replicas is not None and self.replicas.available()):
+            return produce()
+        key = (name, list_filter.limit, list_filter.after, list_filter.prefix,
+               list_filter.with_disks, list_filter.codec)
+        encode = encode_lines if list_filter.codec is None else bytes
+        return self.list_cache.stream(key, produce, encode)
+
+    def remote_changed(self, vm_id, delta=None):
+        """Изменение, сделанное другим процессом (событие через NOTIFY).
+
+        delta — изменение итогов CAPACITY, сделанное тем процессом (см. Capacity.totals).
+        """
+        self.registry.evict(vm_id)
+        if delta:
+            self.capacity.apply(vm_id, delta)
+        if self.list_cache is not None:
+            self.list_cache.bump()
+
+    def list_vms(self, list_filter=None):
+        """Список активных виртуальных машин (потоковый ответ)."""
+        list_filter = list_filter or ListFilter()
+        query, args = self.vm_query("is_active = TRUE", list_filter)
+        return self.stream_rows("LIST_VMS", query, args, list_filter, format_vm,
+                                "Виртуальные машины не найдены")
+
+    def list_authenticated_vms(self, list_filter=None):
+        """Список авторизованных виртуальных машин (потоковый ответ)."""
+        list_filter = list_filter or ListFilter()
+        query, args = self.vm_query("is_auth = TRUE AND is_active = TRUE", list_filter)
+        return self.stream_rows("LIST_AUTH_VMS", query, args, list_filter, format_vm,
+                                "Авторизованные ВМ не найдены")
+
+    @timed
     async def update_vm(self, vm_id, ram, cpu):
         """Обновление характеристик виртуальной машины."""
-        async with self.db_pool.acquire() as conn:
-            result = await conn.execute(
-                "UPDATE vms SET ram = $2, cpu = $3 WHERE id = $1",
-                vm_id, ram, cpu
-            )
-            if result == "UPDATE 0":
+        token = self.registry.invalidate(vm_id)
+        async with self.acquire() as conn:
+            row = await conn.fetchrow(UPDATE_VM, vm_id, ram, cpu)
+            if row is None:
                 log.warning(f"ВМ {vm_id} не найдена для обновления")
-                return "ВМ не найдена"
-            log.info(f"ВМ {vm_id} обновлена")
+                return Reply("ВМ не найдена", NOT_FOUND)
+            self.registry.store(vm_id, token, ram, cpu, row['is_active'], row['is_auth'])
+            self.vm_changed(
+                vm_id,
+                (row['old_ram'], row['old_cpu'], row['is_active'], row['is_auth']),
+                (ram, cpu, row['is_active'], row['is_auth'])
+            )
+            success_log.info("UPDATE_VM", "ВМ {} обновлена", vm_id, vm_id=vm_id)
             return f"ВМ {vm_id} обновлена"
 
+    @timed
+    async def heartbeat_vm(self, vm_id):
+        """Продление аренды аутентифицированной виртуальной машины."""
+        row = await self.change_flags("heartbeat", vm_id)
+        if row is None:
+            log.warning(f"ВМ {vm_id} не аутентифицирована для продления аренды")
+            return Reply(f"ВМ {vm_id} не аутентифицирована", NOT_AUTHENTICATED)
+        success_log.info("HEARTBEAT", "Аренда ВМ {} продлена", vm_id, vm_id=vm_id)
+        return f"Аренда ВМ {vm_id} продлена"
+
+    @timed
     async def logout_vm(self, vm_id):
         """Деавторизация виртуальной машины."""
-        async with self.db_pool.acquire() as conn:
-            result = await conn.execute(
-                "UPDATE vms SET is_auth = FALSE WHERE id = $1",
-                vm_id
-            )
-            if result == "UPDATE 0":
-                log.warning(f"ВМ {vm_id} не найдена для деавторизации")
-                return "ВМ не найдена"
-            log.info(f"ВМ {vm_id} деавторизована")
-            return f"ВМ {vm_id} деавторизована"
+        token = self.registry.invalidate(vm_id)
+        row = await self.change_flags("logout", vm_id)
+        if row is None:
+            log.warning(f"ВМ {vm_id} не найдена для деавторизации")
+            return Reply("ВМ не найдена", NOT_FOUND)
+        self.registry.store(vm_id, token, row['ram'], row['cpu'], row['is_active'], False)
+        success_log.info("LOGOUT_VM", "ВМ {} деавторизована", vm_id, vm_id=vm_id)
+        return f"ВМ {vm_id} деавторизована"
 
+    @timed
     async def remove_vm(self, vm_id):
         """Удаление виртуальной машины."""
-        async with self.db_pool.acquire() as conn:
-            result = await conn.execute(
-                "UPDATE vms SET is_active = FALSE, is_auth = FALSE WHERE id = $1", vm_id
-            )
-            if result == "UPDATE 0":
-                log.warning(f"ВМ {vm_id} не найдена для удаления")
-                return f"ВМ {vm_id} не найдена"
-            log.info(f"ВМ {vm_id} удалена")
-            return f"ВМ {vm_id} удалена"
-
-    async def list_disks(self):
-        """Список дисков."""
-        async with self.db_pool.acquire() as conn:
-            records = await conn.fetch(
-                "SELECT d.id, d.size, v.id as vm_id "
-                "FROM disks d LEFT JOIN vms v ON d.vm_id = v.id"
-            )
-            if not records:
-                log.info("Диски не найдены")
-                return "Диски не найдены"
-            return "\n".join([f"Disk {r['id']} (VM {r['vm_id']}): {r['size']}GB" for r in records])
+        token = self.registry.invalidate(vm_id)
+        row = await self.change_flags("remove", vm_id)
+        if row is None:
+            log.warning(f"ВМ {vm_id} не найдена для удаления")
+            return Reply(f"ВМ {vm_id} не найдена", NOT_FOUND)
+        self.registry.store(vm_id, token, row['ram'], row['cpu'], False, False)
+        success_log.info("REMOVE_VM", "ВМ {} удалена", vm_id, vm_id=vm_id)
+        return f"ВМ {vm_id} удалена"
 
+    def disk_query(self, list_filter):
+        """Запрос выборки дисков с параметрами list_filter. Префикс фильтрует по ID ВМ."""
+        clauses, args = [], []
+        if list_filter.after is not None:
+            args.append(list_filter.after)
+            clauses.append(f"d.id > ${len(args)}")
+        if list_filter.prefix:
+            args.append(list_filter.prefix)
+            clauses.append(f"starts_with(d.vm_id, ${len(args)})")
+        query = "SELECT d.id, d.size, v.id as vm_id FROM disks d LEFT JOIN vms v ON d.vm_id = v.id"
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " ORDER BY d.id"
+        if list_filter.limit is not None:
+            args.append(list_filter.limit + 1)
+            query += f" LIMIT ${len(args)}"
+        return query, args
+
+    def list_disks(self, list_filter=None):
+        """Список дисков (потоковый ответ). Префикс фильтрует по ID ВМ."""
+        list_filter = list_filter or ListFilter()
+        query, args = self.disk_query(list_filter)
+        return self.stream_rows("LIST_DISKS", query, args, list_filter, format_disk,
+                                "Диски не найдены")
+
+    @timed
     async def add_disk(self, disk_id, vm_id, size):
         """Добавление диска к виртуальной машине."""
-        async with self.db_pool.acquire() as conn:
-            vm_exists = await conn.fetchrow("SELECT id FROM vms WHERE id = $1", vm_id)
+        async with self.acquire() as conn:
+            vm_exists = await conn.fetchrow(SELECT_VM_ID, vm_id)
             if not vm_exists:
                 log.warning(f"ВМ {vm_id} не найдена для добавления диска")
-                return f"ВМ {vm_id} не найдена"
+                return Reply(f"ВМ {vm_id} не найдена", NOT_FOUND)
 
-            await conn.execute(
-                "INSERT INTO disks (id, vm_id, size) VALUES ($1, $2, $3)",
-                disk_id, vm_id, size
-            )
-            log.info(f"Диск {disk_id} добавлен к ВМ {vm_id}")
+            await conn.execute(INSERT_DISK, disk_id, vm_id, size)
+            self.disk_added(disk_id, vm_id, size)
+            success_log.info("ADD_DISK", "Диск {} добавлен к ВМ {}", disk_id, vm_id, vm_id=vm_id)
             return f"Диск {disk_id} добавлен к ВМ {vm_id}"
 
+    @timed
+    async def bulk_add_disks(self, disks):
+        """Пакетное добавление дисков в одной транзакции.
+
+        disks — список кортежей (disk_id, vm_id, size). Возвращает результат по каждому диску.
+        """
+        vm_ids = list({vm_id for _, vm_id, _ in disks})
+        async with self.acquire() as conn:
+            async with conn.transaction():
+                rows = await conn.fetch(
+                    "SELECT id FROM vms WHERE id = ANY($1::text[])", vm_ids
+                )
+                existing_vms = {r['id'] for r in rows}
+                valid = [d for d in disks if d[1] in existing_vms]
+                added = set()
+                if valid:
+                    rows = await conn.fetch(
+                        "INSERT INTO disks (id, vm_id, size) "
+                        "SELECT * FROM unnest($1::text[], $2::text[], $3::int[]) "
+                        "ON CONFLICT (id) DO NOTHING RETURNING id",
+                        [d[0] for d in valid], [d[1] for d in valid], [d[2] for d in valid]
+                    )
+                    added = {r['id'] for r in rows}
+
+        counted = set()
+        for disk_id, vm_id, size in valid:
+            if disk_id in added and disk_id not in counted:
+                counted.add(disk_id)
+                self.disk_added(disk_id, vm_id, size)
+        success_log.info("BULK_ADD_DISK", "Пакетно добавлено дисков: {} из {}", len(added), len(disks))
+        results = []
+        for disk_id, vm_id, _ in disks:
+            if vm_id not in existing_vms:
+                results.append(Reply(f"ВМ {vm_id} не найдена", NOT_FOUND))
+            elif disk_id in added:
+                added.discard(disk_id)
+                results.append(f"Диск {disk_id} добавлен к ВМ {vm_id}")
+            else:
+                results.append(Reply(f"Диск {disk_id} уже существует", ALREADY_EXISTS))
+        return bulk_reply(results)
+
+    @timed
     async def remove_disk(self, disk_id):
         """Удаление диска."""
-        async with self.db_pool.acquire() as conn:
-            result = await conn.execute("DELETE FROM disks WHERE id = $1", disk_id)
-            if result == "DELETE 0":
+        async with self.acquire() as conn:
+            row = await conn.fetchrow(DELETE_DISK, disk_id)
+            if row is None:
                 log.warning(f"Диск {disk_id} не найден")
-                return f"Диск {disk_id} не найден"
-            log.info(f"Диск {disk_id} удален")
+                return Reply(f"Диск {disk_id} не найден", NOT_FOUND)
+            self.disk_removed(disk_id, row['vm_id'], row['size'])
+            success_log.info("REMOVE_DISK", "Диск {} удален", disk_id)
             return f"Диск {disk_id} удален"
 
-    async def check_all_vms(self):
-        """Проверка всех виртуальных машин."""
-        async with self.db_pool.acquire() as conn:
-            records = await conn.fetch("SELECT * FROM vms")
-            if not records:
-                log.info("Виртуальные машины не найдены")
-                return "Виртуальные машины не найдены"
-            return "\n".join([f"{r['id']}: {r['ram']}MB RAM, {r['cpu']}CPU" for r in records])
+    def check_all_vms(self, list_filter=None):
+        """Проверка всех виртуальных машин (потоковый ответ)."""
+        list_filter = list_filter or ListFilter()
+        query, args = self.vm_query(None, list_filter)
+        return self.stream_rows("CHECK_ALL_VMS", query, args, list_filter, format_vm,
+                                "Виртуальные машины не найдены")
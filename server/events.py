@@ -0,0 +1,227 @@
+import asyncio
+import uuid
+from collections import deque
+
+from loguru import logger as log
+
+
+def vm_event(vm_id, old, new):
+    """Событие изменения строки ВМ или None, если видимое состояние не изменилось.
+
+    old и new — кортежи (ram, cpu, is_active, is_auth); old — None для новой ВМ.
+    """
+    ram, cpu, is_active, is_auth = new
+    if old is None:
+        kind = "VM_AUTHENTICATED" if is_auth else "VM_ADDED"
+        return f"{kind} {vm_id} {ram} {cpu}"
+    if old[2] and not is_active:
+        return f"VM_REMOVED {vm_id}"
+    if is_active and is_auth and not (old[2] and old[3]):
+        return f"VM_AUTHENTICATED {vm_id} {ram} {cpu}"
+    if old[3] and not is_auth:
+        return f"VM_LOGGED_OUT {vm_id}"
+    if (old[0], old[1]) != (ram, cpu):
+        return f"VM_UPDATED {vm_id} {ram} {cpu}"
+    return None
+
+
+class Subscription:
+    """Подписка одного соединения на события с буфером ограниченного размера.
+
+    Если подписчик не успевает читать, старые события вытесняются, а при
+    следующем чтении он получает строку LOST <число пропущенных событий>.
+    """
+
+    def __init__(self, bus, prefix, buffer_size):
+        self.bus = bus
+        self.prefix = prefix
+        self.events = deque(maxlen=buffer_size)
+        self.lost = 0
+        self.finished = False
+        self.ready = asyncio.Event()
+
+    def push(self, vm_id, event):
+        if self.prefix and not vm_id.startswith(self.prefix):
+            return
+        if len(self.events) == self.events.maxlen:
+            self.lost += 1
+        self.events.append(event)
+        self.ready.set()
+
+    async def next_batch(self):
+        """Ждет и забирает все накопленные события. None — подписка завершена сервером."""
+        await self.ready.wait()
+        if self.finished:
+            if not self.events and not self.lost:
+                return None
+        else:
+            self.ready.clear()
+        batch = list(self.events)
+        self.events.clear()
+        if self.lost:
+            batch.insert(0, f"LOST {self.lost}")
+            self.lost = 0
+        return batch
+
+    def finish(self):
+        """Завершает поток подписки после отправки накопленных событий."""
+        self.finished = True
+        self.ready.set()
+
+    def close(self):
+        self.bus.subscribers.discard(self)
+
+
+class EventBus:
+    """Рассылка событий изменения ВМ и дисков подписчикам процесса.
+
+    publish вызывается хранилищем после каждого изменения; если задан
+    notify, событие также передается ему для рассылки другим процессам
+    вместе с изменением итогов CAPACITY (delta, см. Capacity.totals).
+    События других процессов доставляются через deliver.
+    """
+
+    def __init__(self, buffer_size: int):
+        self.buffer_size = buffer_size
+        self.subscribers = set()
+        self.notify = None
+        self.on_remote = None
+
+    def subscribe(self, prefix=None) -> Subscription:
+        subscription = Subscription(self, prefix, self.buffer_size)
+        self.subscribers.add(subscription)
+        return subscription
+
+    def publish(self, vm_id, event, delta=None):
+        """Рассылает событие (None — видимого события нет, только изменение итогов)."""
+        if event is not None:
+            for subscription in self.subscribers:
+                subscription.push(vm_id, event)
+        if self.notify is not None:
+            self.notify(vm_id, event, delta)
+
+    def close(self):
+        """Завершает потоки всех подписок (при остановке сервера)."""
+        for subscription in self.subscribers:
+            subscription.finish()
+
+    def deliver(self, body):
+        """Доставка событий другого процесса.
+
+        В строке — «<vm_id> <изменение итогов через запятую> <событие>»; события может не быть.
+        """
+        for line in body.splitlines():
+            vm_id, delta, event = (line.split(" ", 2) + [""])[:3]
+            delta = [int(value) for value in delta.split(",")] if delta else None
+            if self.on_remote is not None:
+                self.on_remote(vm_id, delta)
+            if event:
+                for subscription in self.subscribers:
+                    subscription.push(vm_id, event)
+
+    async def stream(self, prefix=None):
+        """Потоковый ответ WATCH: подтверждение подписки, затем события по мере появления."""
+        subscription = self.subscribe(prefix)
+        try:
+            yield "Подписка на события оформлена"
+            while True:
+                batch = await subscription.next_batch()
+                if batch is None:
+                    return
+                yield "\n".join(batch)
+        finally:
+            subscription.close()
+
+
+class Notifier:
+    """Рассылка событий другим процессам через PostgreSQL NOTIFY/LISTEN.
+
+    События копятся и отправляются одним pg_notify на итерацию цикла событий
+    (до NOTIFY_PAYLOAD_LIMIT байт в уведомлении). Для LISTEN используется
+    отдельное соединение, которое переподключается при обрыве.
+
+    Первая строка уведомления — идентификатор отправителя: свои события
+    приходят и через NOTIFY, их нужно отличать от событий других процессов.
+    Идентификатор создается в start, то есть в каждом процессе после fork.
+    """
+
+    NOTIFY_PAYLOAD_LIMIT = 7900
+
+    def __init__(self, bus: EventBus, channel: str, connect, acquire):
+        self.bus = bus
+        self.channel = channel
+        self.connect = connect
+        self.acquire = acquire
+        self.outbox = []
+        self.flusher = None
+        self.listener = None
+        self.instance_id = None
+
+    def start(self):
+        self.instance_id = uuid.uuid4().hex[:12]
+        self.bus.notify = self.enqueue
+        self.listener = asyncio.create_task(self.listen_loop())
+
+    async def stop(self):
+        self.bus.notify = None
+        for task in (self.listener, self.flusher):
+            if task is not None:
+                task.cancel()
+        await asyncio.gather(*[t for t in (self.listener, self.flusher) if t], return_exceptions=True)
+
+    def enqueue(self, vm_id, event, delta=None):
+        delta = ",".join(map(str, delta)) if delta else ""
+        self.outbox.append(f"{vm_id} {delta} {event or ''}".rstrip())
+        if self.flusher is None:
+            self.flusher = asyncio.create_task(self.flush())
+
+    async def flush(self):
+        try:
+            while self.outbox:
+                await asyncio.sleep(0)
+                lines, self.outbox = self.outbox, []
+                payloads, current, size = [], [], 0
+                for line in lines:
+                    if current and size + len(line.encode()) + 1 > self.NOTIFY_PAYLOAD_LIMIT:
+                        payloads.append(current)
+                        current, size = [], 0
+                    current.append(line)
+                    size += len(line.encode()) + 1
+                payloads.append(current)
+                try:
+                    async with self.acquire() as conn:
+                        for payload in payloads:
+                            await conn.execute("SELECT pg_notify($1, $2)", self.channel,
+                                               "\n".join([self.instance_id] + payload))
+                except Exception as e:
+                    log.error(f"Ошибка отправки событий другим процессам: {e}")
+        finally:
+            self.flusher = None
+
+    async def listen_loop(self):
+        while True:
+            conn = None
+            try:
+                conn = await self.connect()
+                closed = asyncio.get_running_loop().create_future()
+                conn.add_termination_listener(lambda _: closed.done() or closed.set_result(None))
+                await conn.add_listener(self.channel, self.on_notification)
+                log.info(f"✅ Подписка на события других процессов (канал {self.channel})")
+                await closed
+                log.warning("Соединение LISTEN закрыто, переподключение")
+            except asyncio.CancelledError:
+                if conn is not None and not conn.is_closed():
+                    await conn.close()
+                raise
+            except Exception as e:
+                log.error(f"Ошибка подписки на события других процессов: {e}")
+            await asyncio.sleep(1)
+
+    def on_notification(self, conn, pid, channel, payload):
+        sender, _, body = payload.partition("\n")
+        if sender == self.instance_id:
+            return
+        try:
+            self.bus.deliver(body)
+        except ValueError:
+            log.warning(f"Некорректное уведомление в канале {channel}")
@@ -0,0 +1,48 @@
+import asyncio
+
+
+class GroupCommit:
+    """Групповая фиксация: собирает изменения за окно и применяет их одной транзакцией.
+
+    apply получает список элементов и возвращает список результатов в том же
+    порядке; каждый вызывающий получает свой результат. Пока применяется одна
+    группа, копится следующая, так что одновременно выполняется не больше
+    одной транзакции.
+    """
+
+    def __init__(self, apply, window: float, max_batch: int):
+        self.apply = apply
+        self.window = window
+        self.max_batch = max_batch
+        self.items = []
+        self.futures = []
+        self.flusher = None
+
+    async def submit(self, item):
+        """Добавляет изменение в текущую группу и ждет его результата."""
+        future = asyncio.get_running_loop().create_future()
+        self.items.append(item)
+        self.futures.append(future)
+        if self.flusher is None:
+            self.flusher = asyncio.create_task(self.flush_loop())
+        return await future
+
+    async def flush_loop(self):
+        try:
+            while self.items:
+                if len(self.items) < self.max_batch:
+                    await asyncio.sleep(self.window)
+                items, self.items = self.items[:self.max_batch], self.items[self.max_batch:]
+                futures, self.futures = self.futures[:self.max_batch], self.futures[self.max_batch:]
+                try:
+                    results = await self.apply(items)
+                except Exception as e:
+                    for future in futures:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+                for future, result in zip(futures, results):
+                    if not future.done():
+                        future.set_result(result)
+        finally:
+            self.flusher = None
@@ -0,0 +1,107 @@
+import asyncio
+import multiprocessing
+import multiprocessing.connection
+import signal
+import time
+
+from loguru import logger as log
+
+from .config import (METRICS_PORT, SERVER_HOST, SERVER_PORT, SHUTDOWN_TIMEOUT,
+                     WORKER_RESTART_DELAY)
+from .db_manager import DatabaseManager
+from .server import VMServer
+
+
+def run_worker(index, host, port):
+    """Точка входа процесса-обработчика.
+
+    Реестр ВМ в обработчиках отключен: состояние меняют все процессы,
+    и кэш одного процесса не видит изменений, сделанных другими.
+
+    Обработчики сигналов супервизора, унаследованные при fork, сбрасываются.
+    Остановкой управляет супервизор: обработчик начинает завершение соединений
+    по его SIGTERM, а SIGINT от Ctrl-C, который терминал отправляет всей группе
+    процессов, игнорирует. Иначе SIGTERM супервизора стал бы для обработчика
+    повторным сигналом и закрыл соединения, не дожидаясь ответов.
+    """
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    log.info(f"⏳ Обработчик {index} запускается")
+    server = VMServer(DatabaseManager(registry_size=0))
+    metrics_port = METRICS_PORT + index if METRICS_PORT else 0
+    asyncio.run(server.start(host, port, reuse_port=True, create_schema=False,
+                             metrics_port=metrics_port, signals=(signal.SIGTERM,)))
+
+
+async def prepare_schema():
+    """Однократное применение миграций схемы БД до запуска обработчиков (без пула)."""
+    db_manager = DatabaseManager(registry_size=0)
+    conn = await db_manager.connect()
+    try:
+        await db_manager.create_schema(conn)
+    finally:
+        await conn.close()
+
+
+class Supervisor:
+    """Процесс-супервизор: запускает обработчики на одном порту (SO_REUSEPORT).
+
+    Каждый обработчик — отдельный процесс со своим циклом событий и пулом
+    соединений с БД. Упавшие обработчики перезапускаются, по SIGTERM/SIGINT
+    всем обработчикам отправляется SIGTERM, и супервизор ждет их завершения.
+    """
+
+    def __init__(self, workers: int, host=SERVER_HOST, port=SERVER_PORT):
+        self.workers = workers
+        self.host = host
+        self.port = port
+        self.context = multiprocessing.get_context("fork")
+        self.processes = {}
+        self.stopping = False
+
+    def run(self):
+        asyncio.run(prepare_schema())
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        for index in range(self.workers):
+            self.spawn(index)
+        log.info(f"🚀 Запущено обработчиков: {self.workers} на {self.host}:{self.port}")
+
+        while not self.stopping:
+            sentinels = [process.sentinel for process in self.processes.values()]
+            multiprocessing.connection.wait(sentinels, timeout=1)
+            for index, process in list(self.processes.items()):
+                if process.exitcode is None or self.stopping:
+                    continue
+                log.error(f"Обработчик {index} (pid {process.pid}) завершился "
+                          f"с кодом {process.exitcode}, перезапуск")
+                time.sleep(WORKER_RESTART_DELAY)
+                self.spawn(index)
+
+        self.shutdown()
+
+    def spawn(self, index):
+        process = self.context.Process(
+            target=run_worker, args=(index, self.host, self.port), name=f"vm-worker-{index}"
+        )
+        process.start()
+        self.processes[index] = process
+
+    def stop(self, signum=None, frame=None):
+        """Обработчик сигнала: начинает согласованную остановку."""
+        self.stopping = True
+
+    def shutdown(self):
+        log.info("🛑 Остановка обработчиков...")
+        for process in self.processes.values():
+            if process.is_alive():
+                process.terminate()
+        deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+        for index, process in self.processes.items():
+            process.join(max(0, deadline - time.monotonic()))
+            if process.is_alive():
+                log.warning(f"Обработчик {index} не завершился за {SHUTDOWN_TIMEOUT} с, принудительная остановка")
+                process.kill()
+                process.join()
+        log.info("🛑 Все обработчики остановлены")
@@ -0,0 +1,57 @@
+import random
+import time
+
+from loguru import logger as log
+
+from .config import LOG_LEVEL, LOG_RATE_LIMIT, LOG_SAMPLE_RATE, LOG_SAMPLE_RATES
+
+
+class SampledLogger:
+    """Выборочное логирование частых сообщений об успешных командах.
+
+    Сообщение команды пишется с вероятностью из rates (или default_rate)
+    и не чаще rate_limit раз в секунду на команду и уровень: записи разных
+    уровней не расходуют лимит друг друга. Сообщения уровня ниже min_level
+    отбрасываются до выборки. Текст форматируется loguru только для
+    записанных сообщений, а поля передаются в extra.
+    """
+
+    def __init__(self, default_rate: float, rates: dict, rate_limit: float,
+                 min_level: str = "INFO"):
+        self.default_rate = default_rate
+        self.rates = rates
+        self.rate_limit = rate_limit
+        self.min_level = log.level(min_level).no
+        self.buckets = {}
+
+    def enabled(self, command, level="INFO") -> bool:
+        if log.level(level).no < self.min_level:
+            return False
+        rate = self.rates.get(command, self.default_rate)
+        if rate <= 0 or (rate < 1 and random.random() >= rate):
+            return False
+        if not self.rate_limit:
+            return True
+        now = time.monotonic()
+        bucket = (command, level)
+        # Дробный лимит (реже раза в секунду) не должен давать корзину меньше одной записи
+        capacity = max(1.0, self.rate_limit)
+        tokens, updated = self.buckets.get(bucket, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated) * self.rate_limit)
+        if tokens < 1:
+            self.buckets[bucket] = (tokens, now)
+            return False
+        self.buckets[bucket] = (tokens - 1, now)
+        return True
+
+    def log(self, level, command, message, *args, **fields):
+        """Пишет сообщение команды command, если оно попало в выборку."""
+        if self.enabled(command, level):
+            log.opt(depth=1).bind(command=command, **fields).log(level, message, *args)
+
+    def info(self, command, message, *args, **fields):
+        if self.enabled(command):
+            log.opt(depth=1).bind(command=command, **fields).info(message, *args)
+
+
+success_log = SampledLogger(LOG_SAMPLE_RATE, LOG_SAMPLE_RATES, LOG_RATE_LIMIT, LOG_LEVEL)
@@ -0,0 +1,613 @@
+import asyncio
+import heapq
+import json
+import os
+import re
+import time
+from bisect import bisect_left, bisect_right
+
+from loguru import logger as log
+
+from .config import (AUTH_LEASE_TTL, LEASE_SWEEP_BATCH, LEASE_SWEEP_INTERVAL, LIST_CHUNK_SIZE,
+                     SNAPSHOT_INTERVAL, SNAPSHOT_LOG_SIZE, STORAGE_DIR, STORAGE_FSYNC,
+                     WATCH_BUFFER_SIZE)
+from .events import EventBus
+from .capacity import Capacity
+from .logs import success_log
+from .metrics import timed
+from .replies import (ALREADY_EXISTS, AUTH_FAILED, NOT_AUTHENTICATED, NOT_FOUND, Reply,
+                      bulk_reply)
+from .storage import ListFilter, Storage, format_disk, format_vm
+
+SNAPSHOT_FILE = "snapshot.json"
+JOURNAL_FILE = re.compile(r"appendonly\.(\d+)\.log$")
+
+
+class UniqueViolation(Exception):
+    """Нарушение уникальности ID (аналог ошибки первичного ключа PostgreSQL)."""
+
+
+class SortedIndex:
+    """Упорядоченный список ключей для постраничных выборок по курсору."""
+
+    __slots__ = ("keys",)
+
+    def __init__(self, keys=()):
+        self.keys = sorted(keys)
+
+    def add(self, key):
+        position = bisect_left(self.keys, key)
+        if position == len(self.keys) or self.keys[position] != key:
+            self.keys.insert(position, key)
+
+    def discard(self, key):
+        position = bisect_left(self.keys, key)
+        if position < len(self.keys) and self.keys[position] == key:
+            del self.keys[position]
+
+    def scan(self, after=None, prefix=None, count=LIST_CHUNK_SIZE):
+        """До count ключей после after, начинающихся с prefix."""
+        start = bisect_right(self.keys, after) if after is not None else 0
+        if prefix:
+            start = max(start, bisect_left(self.keys, prefix))
+        keys = self.keys[start:start + count]
+        if prefix and keys and not keys[-1].startswith(prefix):
+            keys = [key for key in keys if key.startswith(prefix)]
+        return keys
+
+
+class Journal:
+    """Журнал изменений (append-only) в файлах appendonly.<поколение>.log.
+
+    Каждая запись — JSON-массив в отдельной строке. Запись буферизуется и
+    сбрасывается на диск по политике STORAGE_FSYNC: always — fsync после каждой
+    записи, everysec — раз в секунду в фоновом потоке, no — fsync выполняет ОС.
+    """
+
+    def __init__(self, directory, fsync=STORAGE_FSYNC):
+        self.directory = directory
+        self.fsync = fsync
+        self.generation = 0
+        self.file = None
+        self.size = 0
+        self.dirty = False
+
+    def path(self, generation):
+        return os.path.join(self.directory, f"appendonly.{generation}.log")
+
+    def generations(self):
+        found = [int(m.group(1)) for m in map(JOURNAL_FILE.match, os.listdir(self.directory)) if m]
+        return sorted(found)
+
+    def replay(self, since):
+        """Записи журналов начиная с поколения since, по порядку.
+
+        Оборванная последняя строка (сбой во время записи) пропускается.
+        """
+        for generation in self.generations():
+            if generation < since:
+                continue
+            with open(self.path(generation), encoding="utf-8") as f:
+                for number, line in enumerate(f, 1):
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        log.warning(f"Журнал {self.path(generation)}: строка {number} "
+                                    f"повреждена, остаток файла пропущен")
+                        break
+
+    def open(self, generation):
+        """Начинает новый файл журнала; возвращает предыдущий файл (или None)."""
+        previous = self.file
+        if previous is not None:
+            previous.flush()
+        self.generation = generation
+        self.file = open(self.path(generation), "a", encoding="utf-8")
+        self.size = 0
+        self.dirty = False
+        return previous
+
+    def append(self, record):
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+        self.file.write(line)
+        self.size += len(line)
+        self.dirty = True
+        if self.fsync == "always":
+            self.sync()
+
+    def sync(self):
+        """Сброс буфера журнала и, если требует политика, fsync (блокирующий)."""
+        self.file.flush()
+        if self.fsync != "no":
+            os.fsync(self.file.fileno())
+        self.dirty = False
+
+    async def sync_loop(self):
+        """Фоновый сброс журнала раз в секунду для политик everysec и no."""
+        while True:
+            await asyncio.sleep(1)
+            if not self.dirty:
+                continue
+            self.dirty = False
+            self.file.flush()
+            if self.fsync == "everysec":
+                await asyncio.to_thread(os.fsync, self.file.fileno())
+
+    def close(self):
+        if self.file is not None:
+            self.sync()
+            self.file.close()
+            self.file = None
+
+
+class MemoryStorage(Storage):
+    """Встроенное хранилище: таблицы ВМ и дисков в памяти процесса.
+
+    Для выборок поддерживаются упорядоченные индексы ID всех, активных и
+    авторизованных ВМ и ID дисков. Каждое изменение записывается в журнал;
+    периодически состояние сохраняется снимком, после чего старые журналы
+    удаляются. При запуске загружается снимок и проигрываются журналы после него.
+    Без каталога (directory пустой) хранилище работает только в памяти.
+
+    Аренды аутентификации не сохраняются: после запуска каждая
+    аутентифицированная ВМ получает полный срок AUTH_LEASE_TTL. Сроки хранятся
+    в словаре leases, а для очистки — в куче, где у каждой ВМ не больше одной
+    записи: продление меняет только словарь, а устаревшая запись кучи при
+    извлечении переставляется на новый срок.
+
+    Хранилище рассчитано на один процесс: с WORKERS > 1 его использовать нельзя.
+    """
+
+    def __init__(self, directory=STORAGE_DIR):
+        self.directory = directory
+        self.vms = {}
+        self.disks = {}
+        self.disks_by_vm = {}
+        self.all_vms = SortedIndex()
+        self.active_vms = SortedIndex()
+        self.auth_vms = SortedIndex()
+        self.disk_ids = SortedIndex()
+        self.capacity = Capacity()
+        self.events = EventBus(WATCH_BUFFER_SIZE)
+        self.leases = {}
+        self.lease_heap = []
+        self.scheduled = set()
+        self.journal = None
+        self.tasks = []
+        self.snapshot_task = None
+        self.snapshot_at = 0.0
+        self.replayed = 0
+
+    async def initialize(self, create_schema=True):
+        """Восстановление состояния из снимка и журналов, запуск фоновых задач."""
+        if AUTH_LEASE_TTL > 0:
+            self.tasks.append(asyncio.create_task(self.sweep_leases()))
+        if not self.directory:
+            log.info("✅ Хранилище в памяти запущено без сохранения на диск")
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        started = time.perf_counter()
+        self.journal = Journal(self.directory)
+        snapshot_generation = await asyncio.to_thread(self.load_snapshot)
+        for record in self.journal.replay(snapshot_generation):
+            self.apply(record)
+            self.replayed += 1
+        self.build_indexes()
+        for vm_id in self.auth_vms.keys:
+            self.grant_lease(vm_id)
+        generations = self.journal.generations()
+        self.journal.open(max(generations + [snapshot_generation]) + 1)
+        self.snapshot_at = time.monotonic()
+        log.info(f"✅ Хранилище восстановлено за {time.perf_counter() - started:.2f} с: "
+                 f"ВМ {len(self.vms)}, дисков {len(self.disks)}, записей журнала {self.replayed}")
+        if self.journal.fsync != "always":
+            self.tasks.append(asyncio.create_task(self.journal.sync_loop()))
+        self.tasks.append(asyncio.create_task(self.snapshot_loop()))
+
+    async def close(self):
+        """Остановка фоновых задач и итоговый снимок для быстрого следующего запуска."""
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        if self.journal is None:
+            return
+        if self.snapshot_task is not None:
+            await self.snapshot_task
+        if self.journal.size or self.replayed:
+            await self.snapshot()
+        self.journal.close()
+        self.journal = None
+
+    def load_snapshot(self):
+        """Загрузка снимка. Возвращает его поколение (0 — снимка нет)."""
+        path = os.path.join(self.directory, SNAPSHOT_FILE)
+        if not os.path.exists(path):
+            return 0
+        with open(path, encoding="utf-8") as f:
+            snapshot = json.load(f)
+        self.vms = {vm_id: (ram, cpu, is_active, is_auth)
+                    for vm_id, ram, cpu, is_active, is_auth in snapshot["vms"]}
+        self.disks = {disk_id: (vm_id, size) for disk_id, vm_id, size in snapshot["disks"]}
+        return snapshot["generation"]
+
+    def build_indexes(self):
+        self.all_vms = SortedIndex(self.vms)
+        self.active_vms = SortedIndex(vm_id for vm_id, vm in self.vms.items() if vm[2])
+        self.auth_vms = SortedIndex(vm_id for vm_id, vm in self.vms.items() if vm[2] and vm[3])
+        self.disk_ids = SortedIndex(self.disks)
+        self.disks_by_vm = {}
+        self.capacity.reset()
+        for vm in self.vms.values():
+            self.capacity.vm_changed(None, vm)
+        for vm_id, size in self.disks.values():
+            self.disks_by_vm[vm_id] = self.disks_by_vm.get(vm_id, 0) + 1
+            self.capacity.disk_added(vm_id, size)
+
+    def apply(self, record):
+        """Применение записи журнала к таблицам (индексы перестраиваются отдельно)."""
+        kind = record[0]
+        if kind == "vm":
+            self.vms[record[1]] = tuple(record[2:])
+        elif kind == "disk":
+            self.disks[record[1]] = tuple(record[2:])
+        elif kind == "disk_removed":
+            self.disks.pop(record[1], None)
+
+    async def snapshot_loop(self):
+        """Снимок раз в SNAPSHOT_INTERVAL с или при росте журнала до SNAPSHOT_LOG_SIZE."""
+        while True:
+            await asyncio.sleep(1)
+            if not self.journal.size or self.snapshot_task is not None:
+                continue
+            if (self.journal.size >= SNAPSHOT_LOG_SIZE
+                    or time.monotonic() - self.snapshot_at >= SNAPSHOT_INTERVAL):
+                self.snapshot_task = asyncio.create_task(self.snapshot())
+                try:
+                    await asyncio.shield(self.snapshot_task)
+                except Exception as e:
+                    log.error(f"Ошибка сохранения снимка хранилища: {e}")
+
+    async def snapshot(self):
+        """Сохранение снимка состояния.
+
+        Журнал переключается на новое поколение, копия таблиц записывается
+        в фоновом потоке во временный файл и атомарно заменяет прежний снимок;
+        журналы предыдущих поколений после этого не нужны.
+        """
+        try:
+            generation = self.journal.generation + 1
+            previous = self.journal.open(generation)
+            vms, disks = dict(self.vms), dict(self.disks)
+            self.snapshot_at = time.monotonic()
+            self.replayed = 0
+            started = time.perf_counter()
+            await asyncio.to_thread(self.write_snapshot, generation, vms, disks, previous)
+            success_log.info("SNAPSHOT", "Снимок хранилища сохранен за {:.2f} с: ВМ {}, дисков {}",
+                             time.perf_counter() - started, len(vms), len(disks))
+        finally:
+            self.snapshot_task = None
+
+    def write_snapshot(self, generation, vms, disks, previous):
+        if previous is not None:
+            os.fsync(previous.fileno())
+            previous.close()
+        path = os.path.join(self.directory, SNAPSHOT_FILE)
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({
+                "generation": generation,
+                "vms": [[vm_id, *vm] for vm_id, vm in vms.items()],
+                "disks": [[disk_id, *disk] for disk_id, disk in disks.items()],
+            }, f, ensure_ascii=False, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+        directory = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+        for old in self.journal.generations():
+            if old < generation:
+                os.remove(self.journal.path(old))
+
+    def put_vm(self, vm_id, ram, cpu, is_active, is_auth):
+        """Запись строки ВМ с обновлением индексов, итогов CAPACITY и журнала."""
+        old = self.vms.get(vm_id)
+        if old is None:
+            self.all_vms.add(vm_id)
+        self.vms[vm_id] = row = (ram, cpu, is_active, is_auth)
+        self.vm_changed(vm_id, old, row)
+        if is_active:
+            self.active_vms.add(vm_id)
+        else:
+            self.active_vms.discard(vm_id)
+        if is_active and is_auth:
+            self.auth_vms.add(vm_id)
+        else:
+            self.auth_vms.discard(vm_id)
+            self.leases.pop(vm_id, None)
+        if self.journal is not None:
+            self.journal.append(["vm", vm_id, ram, cpu, is_active, is_auth])
+
+    def put_disk(self, disk_id, vm_id, size):
+        self.disks[disk_id] = (vm_id, size)
+        self.disk_ids.add(disk_id)
+        self.disks_by_vm[vm_id] = self.disks_by_vm.get(vm_id, 0) + 1
+        self.disk_added(disk_id, vm_id, size)
+        if self.journal is not None:
+            self.journal.append(["disk", disk_id, vm_id, size])
+
+    def delete_disk(self, disk_id):
+        vm_id, size = self.disks.pop(disk_id)
+        self.disk_ids.discard(disk_id)
+        self.disk_removed(disk_id, vm_id, size)
+        self.disks_by_vm[vm_id] -= 1
+        if not self.disks_by_vm[vm_id]:
+            del self.disks_by_vm[vm_id]
+        if self.journal is not None:
+            self.journal.append(["disk_removed", disk_id])
+
+    def grant_lease(self, vm_id):
+        """Выдача или продление аренды на AUTH_LEASE_TTL с."""
+        if AUTH_LEASE_TTL <= 0:
+            return
+        expires_at = time.time() + AUTH_LEASE_TTL
+        self.leases[vm_id] = expires_at
+        if vm_id not in self.scheduled:
+            self.scheduled.add(vm_id)
+            heapq.heappush(self.lease_heap, (expires_at, vm_id))
+
+    async def sweep_leases(self):
+        """Фоновое снятие истекших аренд раз в LEASE_SWEEP_INTERVAL с."""
+        while True:
+            await asyncio.sleep(LEASE_SWEEP_INTERVAL)
+            try:
+                await self.expire_leases()
+            except Exception as e:
+                log.error(f"Ошибка снятия истекших аренд: {e}")
+
+    @timed
+    async def expire_leases(self):
+        """Деавторизация ВМ с истекшей арендой; между пачками цикл событий не блокируется.
+
+        Возвращает число деавторизованных ВМ.
+        """
+        now = time.time()
+        expired = batch = 0
+        while self.lease_heap and self.lease_heap[0][0] <= now:
+            _, vm_id = heapq.heappop(self.lease_heap)
+            self.scheduled.discard(vm_id)
+            expires_at = self.leases.get(vm_id)
+            if expires_at is None:
+                continue
+            if expires_at > now:
+                self.scheduled.add(vm_id)
+                heapq.heappush(self.lease_heap, (expires_at, vm_id))
+                continue
+            ram, cpu, is_active, _ = self.vms[vm_id]
+            self.put_vm(vm_id, ram, cpu, is_active, False)
+            expired += 1
+            batch += 1
+            if batch >= LEASE_SWEEP_BATCH:
+                batch = 0
+                await asyncio.sleep(0)
+        if expired:
+            success_log.info("LEASE_SWEEP", "Истекла аренда ВМ: {}", expired)
+        return expired
+
+    def authenticate(self, vm_id, ram, cpu):
+        """Аутентификация одной ВМ с выдачей аренды. Возвращает ответ и признак успеха."""
+        vm = self.vms.get(vm_id)
+        if vm is None:
+            self.put_vm(vm_id, ram, cpu, True, True)
+            self.grant_lease(vm_id)
+            return f"ВМ {vm_id} зарегистрирована и аутентифицирована", True
+        if vm[0] != ram or vm[1] != cpu:
+            return Reply("Ошибка аутентификации: неверные характеристики", AUTH_FAILED), False
+        if not (vm[2] and vm[3]):
+            self.put_vm(vm_id, ram, cpu, True, True)
+        self.grant_lease(vm_id)
+        return f"ВМ {vm_id} аутентифицирована", True
+
+    @timed
+    async def authenticate_vm(self, vm_id, ram, cpu):
+        """Аутентификация виртуальной машины по ID, RAM и CPU."""
+        reply, ok = self.authenticate(vm_id, ram, cpu)
+        if ok:
+            success_log.info("AUTH", "{}", reply, vm_id=vm_id)
+        return reply
+
+    @timed
+    async def bulk_authenticate_vms(self, vms):
+        """Пакетная аутентификация виртуальных машин."""
+        results, authenticated = [], 0
+        for vm_id, ram, cpu in vms:
+            reply, ok = self.authenticate(vm_id, ram, cpu)
+            results.append(reply)
+            authenticated += ok
+        success_log.info("BULK_AUTH", "Пакетно аутентифицировано ВМ: {} из {}",
+                         authenticated, len(vms))
+        return bulk_reply(results)
+
+    @timed
+    async def add_vm(self, vm_id, ram, cpu):
+        """Добавление новой виртуальной машины."""
+        if vm_id in self.vms:
+            log.warning(f"ВМ {vm_id} уже существует")
+            return Reply(f"ВМ {vm_id} уже существует", ALREADY_EXISTS)
+        self.put_vm(vm_id, ram, cpu, True, False)
+        success_log.info("ADD_VM", "ВМ {} добавлена", vm_id, vm_id=vm_id)
+        return f"ВМ {vm_id} добавлена"
+
+    @timed
+    async def bulk_add_vms(self, vms):
+        """Пакетное добавление виртуальных машин."""
+        results, added = [], 0
+        for vm_id, ram, cpu in vms:
+            if vm_id in self.vms:
+                results.append(Reply(f"ВМ {vm_id} уже существует", ALREADY_EXISTS))
+                continue
+            self.put_vm(vm_id, ram, cpu, True, False)
+            results.append(f"ВМ {vm_id} добавлена")
+            added += 1
+        success_log.info("BULK_ADD_VM", "Пакетно добавлено ВМ: {} из {}", added, len(vms))
+        return bulk_reply(results)
+
+    @timed
+    async def update_vm(self, vm_id, ram, cpu):
+        """Обновление характеристик виртуальной машины."""
+        vm = self.vms.get(vm_id)
+        if vm is None:
+            log.warning(f"ВМ {vm_id} не найдена для обновления")
+            return Reply("ВМ не найдена", NOT_FOUND)
+        self.put_vm(vm_id, ram, cpu, vm[2], vm[3])
+        success_log.info("UPDATE_VM", "ВМ {} обновлена", vm_id, vm_id=vm_id)
+        return f"ВМ {vm_id} обновлена"
+
+    @timed
+    async def heartbeat_vm(self, vm_id):
+        """Продление аренды аутентифицированной виртуальной машины."""
+        vm = self.vms.get(vm_id)
+        if vm is None or not (vm[2] and vm[3]):
+            log.warning(f"ВМ {vm_id} не аутентифицирована для продления аренды")
+            return Reply(f"ВМ {vm_id} не аутентифицирована", NOT_AUTHENTICATED)
+        self.grant_lease(vm_id)
+        success_log.info("HEARTBEAT", "Аренда ВМ {} продлена", vm_id, vm_id=vm_id)
+        return f"Аренда ВМ {vm_id} продлена"
+
+    @timed
+    async def logout_vm(self, vm_id):
+        """Деавторизация виртуальной машины."""
+        vm = self.vms.get(vm_id)
+        if vm is None:
+            log.warning(f"ВМ {vm_id} не найдена для деавторизации")
+            return Reply("ВМ не найдена", NOT_FOUND)
+        self.put_vm(vm_id, vm[0], vm[1], vm[2], False)
+        success_log.info("LOGOUT_VM", "ВМ {} деавторизована", vm_id, vm_id=vm_id)
+        return f"ВМ {vm_id} деавторизована"
+
+    @timed
+    async def remove_vm(self, vm_id):
+        """Удаление виртуальной машины (ВМ помечается неактивной)."""
+        vm = self.vms.get(vm_id)
+        if vm is None:
+            log.warning(f"ВМ {vm_id} не найдена для удаления")
+            return Reply(f"ВМ {vm_id} не найдена", NOT_FOUND)
+        self.put_vm(vm_id, vm[0], vm[1], False, False)
+        success_log.info("REMOVE_VM", "ВМ {} удалена", vm_id, vm_id=vm_id)
+        return f"ВМ {vm_id} удалена"
+
+    @timed
+    async def add_disk(self, disk_id, vm_id, size):
+        """Добавление диска к виртуальной машине."""
+        if vm_id not in self.vms:
+            log.warning(f"ВМ {vm_id} не найдена для добавления диска")
+            return Reply(f"ВМ {vm_id} не найдена", NOT_FOUND)
+        if disk_id in self.disks:
+            raise UniqueViolation('duplicate key value violates unique constraint "disks_pkey"\n'
+                                  f"DETAIL:  Key (id)=({disk_id}) already exists.")
+        self.put_disk(disk_id, vm_id, size)
+        success_log.info("ADD_DISK", "Диск {} добавлен к ВМ {}", disk_id, vm_id, vm_id=vm_id)
+        return f"Диск {disk_id} добавлен к ВМ {vm_id}"
+
+    @timed
+    async def bulk_add_disks(self, disks):
+        """Пакетное добавление дисков."""
+        results, added = [], 0
+        for disk_id, vm_id, size in disks:
+            if vm_id not in self.vms:
+                results.append(Reply(f"ВМ {vm_id} не найдена", NOT_FOUND))
+            elif disk_id in self.disks:
+                results.append(Reply(f"Диск {disk_id} уже существует", ALREADY_EXISTS))
+            else:
+                self.put_disk(disk_id, vm_id, size)
+                results.append(f"Диск {disk_id} добавлен к ВМ {vm_id}")
+                added += 1
+        success_log.info("BULK_ADD_DISK", "Пакетно добавлено дисков: {} из {}", added, len(disks))
+        return bulk_reply(results)
+
+    @timed
+    async def remove_disk(self, disk_id):
+        """Удаление диска."""
+        if disk_id not in self.disks:
+            log.warning(f"Диск {disk_id} не найден")
+            return Reply(f"Диск {disk_id} не найден", NOT_FOUND)
+        self.delete_disk(disk_id)
+        success_log.info("REMOVE_DISK", "Диск {} удален", disk_id)
+        return f"Диск {disk_id} удален"
+
+    async def vm_batches(self, index, list_filter):
+        """Пачки строк ВМ из индекса по параметрам list_filter (не больше limit + 1 строк).
+
+        Каждая пачка ищется в индексе заново от последнего выданного ID, так что
+        изменения между пачками не нарушают порядок выборки.
+        """
+        remaining = list_filter.limit + 1 if list_filter.limit is not None else None
+        after = list_filter.after
+        while remaining is None or remaining > 0:
+            count = LIST_CHUNK_SIZE if remaining is None else min(remaining, LIST_CHUNK_SIZE)
+            keys = index.scan(after, list_filter.prefix, count)
+            if not keys:
+                return
+            after = keys[-1]
+            batch = []
+            for vm_id in keys:
+                vm = self.vms[vm_id]
+                if list_filter.with_disks and vm_id not in self.disks_by_vm:
+                    continue
+                batch.append({"id": vm_id, "ram": vm[0], "cpu": vm[1]})
+            if remaining is not None:
+                remaining -= len(batch)
+            if batch:
+                yield batch
+            if len(keys) < count:
+                return
+
+    async def disk_batches(self, list_filter):
+        """Пачки строк дисков по ID диска; префикс фильтрует по ID ВМ."""
+        remaining = list_filter.limit + 1 if list_filter.limit is not None else None
+        after, prefix = list_filter.after, list_filter.prefix
+        while remaining is None or remaining > 0:
+            keys = self.disk_ids.scan(after, None, LIST_CHUNK_SIZE)
+            if not keys:
+                return
+            after = keys[-1]
+            batch = []
+            for disk_id in keys:
+                vm_id, size = self.disks[disk_id]
+                if prefix and not vm_id.startswith(prefix):
+                    continue
+                batch.append({"id": disk_id, "vm_id": vm_id, "size": size})
+                if remaining is not None and len(batch) == remaining:
+                    break
+            if remaining is not None:
+                remaining -= len(batch)
+            if batch:
+                yield batch
+            if len(keys) < LIST_CHUNK_SIZE:
+                return
+
+    def list_vms(self, list_filter=None):
+        """Список активных виртуальных машин (потоковый ответ)."""
+        list_filter = list_filter or ListFilter()
+        return self.stream_list(self.vm_batches(self.active_vms, list_filter), list_filter,
+                                format_vm, "Виртуальные машины не найдены")
+
+    def list_authenticated_vms(self, list_filter=None):
+        """Список авторизованных виртуальных машин (потоковый ответ)."""
+        list_filter = list_filter or ListFilter()
+        return self.stream_list(self.vm_batches(self.auth_vms, list_filter), list_filter,
+                                format_vm, "Авторизованные ВМ не найдены")
+
+    def list_disks(self, list_filter=None):
+        """Список дисков (потоковый ответ). Префикс фильтрует по ID ВМ."""
+        list_filter = list_filter or ListFilter()
+        return self.stream_list(self.disk_batches(list_filter), list_filter, format_disk,
+                                "Диски не найдены")
+
+    def check_all_vms(self, list_filter=None):
+        """Проверка всех виртуальных машин (потоковый ответ)."""
+        list_filter = list_filter or ListFilter()
+        return self.stream_list(self.vm_batches(self.all_vms, list_filter), list_filter,
+                                format_vm, "Виртуальные машины не найдены")
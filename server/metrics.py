@@ -0,0 +1,187 @@
+import asyncio
+import time
+from bisect import bisect_left
+from functools import wraps
+
+from loguru import logger as log
+
+# Границы корзин гистограмм задержек, с
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Histogram:
+    """Гистограмма задержек с фиксированными границами корзин."""
+
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+
+    def quantile(self, q):
+        """Оценка квантиля сверху: граница корзины, в которую он попадает."""
+        if not self.count:
+            return 0.0
+        rank, seen = q * self.count, 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return LATENCY_BUCKETS[index] if index < len(LATENCY_BUCKETS) else float("inf")
+        return float("inf")
+
+    def summary(self):
+        return (f"count={self.count} p50={self.quantile(0.5) * 1000:g}ms "
+                f"p95={self.quantile(0.95) * 1000:g}ms p99={self.quantile(0.99) * 1000:g}ms")
+
+    def prometheus(self, name, labels=""):
+        lines, cumulative = [], 0
+        separator = "," if labels else ""
+        for bound, count in zip(LATENCY_BUCKETS, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels}{separator}le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels}{separator}le="+Inf"}} {self.count}')
+        lines.append(f"{name}_sum{{{labels}}} {self.total}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+        return lines
+
+
+class CommandStats:
+    """Счетчики одной команды: число выполнений, ошибок, отказов и задержки."""
+
+    __slots__ = ("latency", "errors", "rejected")
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.errors = 0
+        self.rejected = 0
+
+
+class Metrics:
+    """Метрики процесса сервера: команды, запросы к БД, соединения и трафик."""
+
+    def __init__(self):
+        self.commands = {}
+        self.queries = {}
+        self.pool_wait = Histogram()
+        self.pool_hold = Histogram()
+        self.connections = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.gauges = {}
+        # Готовность принимать команды: выставляется после открытия порта, снимается при остановке
+        self.ready = False
+
+    def command(self, name) -> CommandStats:
+        stats = self.commands.get(name)
+        if stats is None:
+            stats = self.commands[name] = CommandStats()
+        return stats
+
+    def observe_query(self, method, seconds):
+        histogram = self.queries.get(method)
+        if histogram is None:
+            histogram = self.queries[method] = Histogram()
+        histogram.observe(seconds)
+
+    def render_text(self) -> str:
+        """Сводка для команды STATS."""
+        lines = [
+            f"connections {self.connections}",
+            f"bytes_in {self.bytes_in}",
+            f"bytes_out {self.bytes_out}",
+        ]
+        lines += [f"{name} {gauge()}" for name, gauge in sorted(self.gauges.items())]
+        lines.append(f"db_pool_wait {self.pool_wait.summary()}")
+        lines.append(f"db_query {self.pool_hold.summary()}")
+        for method, histogram in sorted(self.queries.items()):
+            lines.append(f"db.{method} {histogram.summary()}")
+        for name, stats in sorted(self.commands.items()):
+            lines.append(f"{name} {stats.latency.summary()} "
+                         f"errors={stats.errors} rejected={stats.rejected}")
+        return "\n".join(lines)
+
+    def render_prometheus(self) -> str:
+        """Метрики в текстовом формате Prometheus."""
+        lines = [
+            "# TYPE vm_connections gauge", f"vm_connections {self.connections}",
+            "# TYPE vm_bytes_received_total counter", f"vm_bytes_received_total {self.bytes_in}",
+            "# TYPE vm_bytes_sent_total counter", f"vm_bytes_sent_total {self.bytes_out}",
+            "# TYPE vm_ready gauge", f"vm_ready {int(self.ready)}",
+        ]
+        for name, gauge in sorted(self.gauges.items()):
+            lines += [f"# TYPE vm_{name} gauge", f"vm_{name} {gauge()}"]
+        lines.append("# TYPE vm_db_pool_wait_seconds histogram")
+        lines += self.pool_wait.prometheus("vm_db_pool_wait_seconds")
+        lines.append("# TYPE vm_db_connection_hold_seconds histogram")
+        lines += self.pool_hold.prometheus("vm_db_connection_hold_seconds")
+        lines.append("# TYPE vm_db_method_seconds histogram")
+        for method, histogram in sorted(self.queries.items()):
+            lines += histogram.prometheus("vm_db_method_seconds", f'method="{method}"')
+        lines.append("# TYPE vm_command_duration_seconds histogram")
+        for name, stats in sorted(self.commands.items()):
+            lines += stats.latency.prometheus("vm_command_duration_seconds", f'command="{name}"')
+        lines.append("# TYPE vm_command_errors_total counter")
+        lines += [f'vm_command_errors_total{{command="{name}"}} {stats.errors}'
+                  for name, stats in sorted(self.commands.items())]
+        lines.append("# TYPE vm_command_rejected_total counter")
+        lines += [f'vm_command_rejected_total{{command="{name}"}} {stats.rejected}'
+                  for name, stats in sorted(self.commands.items())]
+        return "\n".join(lines) + "\n"
+
+    async def serve(self, host, port):
+        """HTTP-эндпоинт с метриками Prometheus на отдельном порту.
+
+        Кроме /metrics отвечает на /healthz (процесс жив) и /ready (200, когда
+        сервер принимает команды, иначе 503 — при запуске и во время остановки).
+        """
+        server = await asyncio.start_server(self.handle_http, host, port)
+        log.info(f"📈 Метрики доступны на http://{host}:{port}/metrics")
+        return server
+
+    async def handle_http(self, reader, writer):
+        try:
+            request = await reader.readline()
+            while (await reader.readline()).strip():
+                pass
+            parts = request.split()
+            path = parts[1] if len(parts) >= 2 else None
+            if path == b"/metrics":
+                status, body = "200 OK", self.render_prometheus().encode()
+            elif path == b"/healthz":
+                status, body = "200 OK", b"ok\n"
+            elif path == b"/ready":
+                status, body = ("200 OK", b"ready\n") if self.ready else \
+                    ("503 Service Unavailable", b"not ready\n")
+            else:
+                status, body = "404 Not Found", b"not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+metrics = Metrics()
+
+
+def timed(method):
+    """Декоратор метода DatabaseManager: записывает полное время выполнения метода."""
+    @wraps(method)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await method(*args, **kwargs)
+        finally:
+            metrics.observe_query(method.__name__, time.perf_counter() - started)
+    return wrapper
@@ -0,0 +1,79 @@
+"""Версионированные миграции схемы БД.
+
+Каждая миграция — номер версии, описание и список SQL-команд. Примененные
+версии записываются в таблицу schema_migrations, поэтому при обычном запуске
+выполняется один SELECT без DDL и блокировок. Первые миграции написаны с
+IF NOT EXISTS: базы, созданные до появления миграций, принимают их без ошибок.
+Новая миграция добавляется в конец списка со следующим номером; примененные
+миграции не меняются.
+"""
+from loguru import logger as log
+
+# Ключ рекомендательной блокировки: параллельно запущенные процессы применяют миграции по очереди
+MIGRATION_LOCK = 0x564D4D47
+
+MIGRATIONS = [
+    (1, "Таблицы ВМ и дисков", [
+        '''CREATE TABLE IF NOT EXISTS vms (
+            id TEXT PRIMARY KEY,
+            ram INT NOT NULL,
+            cpu INT NOT NULL,
+            is_active BOOLEAN DEFAULT FALSE,
+            is_auth BOOLEAN DEFAULT FALSE
+        )''',
+        '''CREATE TABLE IF NOT EXISTS disks (
+            id TEXT PRIMARY KEY,
+            vm_id TEXT REFERENCES vms(id) ON DELETE CASCADE,
+            size INT NOT NULL
+        )''',
+    ]),
+    # Частичные индексы: выборки и итоги CAPACITY по флагам ВМ, диски по ВМ.
+    # Включенные колонки позволяют считать суммы без чтения таблиц.
+    (2, "Частичные индексы для выборок и итогов CAPACITY", [
+        "CREATE INDEX IF NOT EXISTS vms_active_idx ON vms (id) INCLUDE (ram, cpu) WHERE is_active",
+        "CREATE INDEX IF NOT EXISTS vms_auth_idx ON vms (id) INCLUDE (ram, cpu) "
+        "WHERE is_active AND is_auth",
+        "CREATE INDEX IF NOT EXISTS disks_vm_id_idx ON disks (vm_id) INCLUDE (size)",
+    ]),
+    (3, "Аренда аутентификации: срок и индекс для очистки истекших аренд", [
+        "ALTER TABLE vms ADD COLUMN IF NOT EXISTS lease_expires_at TIMESTAMPTZ",
+        "CREATE INDEX IF NOT EXISTS vms_lease_idx ON vms (lease_expires_at) WHERE is_auth",
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+async def schema_version(conn) -> int:
+    """Последняя примененная версия схемы (0 — миграции не применялись)."""
+    if await conn.fetchval("SELECT to_regclass('schema_migrations')") is None:
+        return 0
+    return await conn.fetchval("SELECT coalesce(max(version), 0) FROM schema_migrations")
+
+
+async def migrate(conn) -> int:
+    """Применяет недостающие миграции одной транзакцией. Возвращает их число."""
+    if await schema_version(conn) >= LATEST_VERSION:
+        return 0
+    applied = 0
+    async with conn.transaction():
+        await conn.execute("SELECT pg_advisory_xact_lock($1)", MIGRATION_LOCK)
+        await conn.execute('''CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INT PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            )
+        ''')
+        done = {r['version'] for r in await conn.fetch("SELECT version FROM schema_migrations")}
+        for version, description, statements in MIGRATIONS:
+            if version in done:
+                continue
+            for statement in statements:
+                await conn.execute(statement)
+            await conn.execute(
+                "INSERT INTO schema_migrations (version, description) VALUES ($1, $2)",
+                version, description
+            )
+            log.info(f"✅ Применена миграция {version}: {description}")
+            applied += 1
+    return applied
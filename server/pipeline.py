@@ -0,0 +1,62 @@
+import asyncio
+
+
+class Pipeline:
+    """Конвейер команд одного соединения.
+
+    Команды выполняются параллельно, но не более ``concurrency`` одновременно.
+    Команды с общими ключами (ID ВМ или диска) выполняются в порядке
+    поступления, а команда без ключей ждет завершения всех предыдущих
+    и сама задерживает последующие. Порядок ответов сохраняет вызывающая
+    сторона, дожидаясь задач в порядке их создания.
+    """
+
+    def __init__(self, handler, keys_of, concurrency: int):
+        self.handler = handler
+        self.keys_of = keys_of
+        self.limiter = asyncio.Semaphore(concurrency)
+        self.tails = {}
+        self.barrier = None
+        self.active = set()
+
+    async def submit(self, message: str) -> asyncio.Task:
+        """Ставит команду в конвейер и возвращает задачу с ее ответом."""
+        await self.limiter.acquire()
+        keys = self.keys_of(message)
+        if keys:
+            deps = {self.tails[key] for key in keys if key in self.tails}
+            if self.barrier is not None:
+                deps.add(self.barrier)
+        else:
+            deps = set(self.active)
+
+        task = asyncio.create_task(self._run(message, deps))
+        self.active.add(task)
+        if keys:
+            for key in keys:
+                self.tails[key] = task
+        else:
+            self.barrier = task
+        task.add_done_callback(lambda t: self._forget(t, keys))
+        return task
+
+    async def _run(self, message, deps):
+        try:
+            if deps:
+                await asyncio.wait(deps)
+            return await self.handler(message)
+        finally:
+            self.limiter.release()
+
+    def _forget(self, task, keys):
+        self.active.discard(task)
+        for key in keys:
+            if self.tails.get(key) is task:
+                del self.tails[key]
+        if self.barrier is task:
+            self.barrier = None
+
+    def cancel(self):
+        """Отменяет все незавершенные команды соединения."""
+        for task in self.active:
+            task.cancel()
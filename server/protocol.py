@@ -0,0 +1,133 @@
+"""Кадрирование текстового протокола.
+
+Команда — одна строка, завершенная ``\\n``. Ответ — ноль или более непустых
+строк, каждая завершена ``\\n``, и пустая строка в конце. Благодаря этому
+клиент может отправлять команды пачкой, не дожидаясь ответов, и однозначно
+разделять ответы в потоке.
+
+Протокол соединения — объект с методами read_request, encode_reply,
+encode_chunk, stream_end и encode_error. Текстовый протокол описан здесь
+(TextProtocol), двоичный для машинных клиентов — в модуле binary.
+"""
+import asyncio
+
+COMMAND_SEPARATOR = b"\n"
+REPLY_TERMINATOR = b"\n"
+
+
+class CommandTooLong(Exception):
+    """Команда превысила допустимую длину строки."""
+
+
+class MalformedRequest(Exception):
+    """Команда не соответствует формату протокола."""
+
+
+def encode_lines(text: str) -> bytes:
+    """Кодирует фрагмент ответа: каждая непустая строка завершается ``\\n``."""
+    return "".join(f"{line}\n" for line in text.splitlines() if line.strip()).encode()
+
+
+def encode_reply(text: str) -> bytes:
+    """Кодирует ответ целиком, вместе с завершающей пустой строкой."""
+    return encode_lines(text) + REPLY_TERMINATOR
+
+
+class ReplyStream:
+    """Потоковый ответ: уже полученная первая часть и остальные части источника."""
+
+    def __init__(self, first, chunks):
+        self.first = first
+        self.chunks = chunks
+        self.close_callbacks = []
+
+    def on_close(self, callback):
+        """Регистрирует корутинную функцию, вызываемую при закрытии потока."""
+        self.close_callbacks.append(callback)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.first is not None:
+            first, self.first = self.first, None
+            return first
+        return await self.chunks.__anext__()
+
+    async def aclose(self):
+        try:
+            await self.chunks.aclose()
+        finally:
+            callbacks, self.close_callbacks = self.close_callbacks, []
+            for callback in callbacks:
+                await callback()
+
+
+async def start_stream(chunks) -> ReplyStream:
+    """Запускает потоковый ответ до получения первой части.
+
+    Запрос к БД начинается сразу, поэтому снимок данных соответствует моменту
+    выполнения команды, а не моменту отправки ответа.
+    """
+    return ReplyStream(await anext(chunks, None), chunks)
+
+
+async def read_command(reader: asyncio.StreamReader, prefix: bytes = b""):
+    """Читает одну команду. Возвращает None, если клиент закрыл соединение.
+
+    prefix — уже прочитанное начало команды. Слишком длинная строка
+    вычитывается до конца и отбрасывается, после чего выбрасывается CommandTooLong.
+    """
+    if prefix.endswith(COMMAND_SEPARATOR):
+        return prefix.decode(errors="replace").strip()
+    try:
+        line = prefix + await reader.readuntil(COMMAND_SEPARATOR)
+    except asyncio.IncompleteReadError as e:
+        if not e.partial and not prefix:
+            return None
+        line = prefix + e.partial
+    except asyncio.LimitOverrunError as e:
+        while True:
+            await reader.readexactly(e.consumed)
+            try:
+                await reader.readuntil(COMMAND_SEPARATOR)
+                break
+            except asyncio.LimitOverrunError as again:
+                e = again
+            except asyncio.IncompleteReadError:
+                break
+        raise CommandTooLong()
+    return line.decode(errors="replace").strip()
+
+
+class TextProtocol:
+    """Текстовый протокол соединения.
+
+    pending — байты, прочитанные при выборе протокола; с них начинается первая команда.
+    """
+
+    def __init__(self, pending: bytes = b""):
+        self.pending = pending
+
+    async def read_request(self, reader: asyncio.StreamReader):
+        """Читает команду. Возвращает ее строку и размер в байтах либо (None, 0) при закрытии."""
+        pending, self.pending = self.pending, b""
+        message = await read_command(reader, pending)
+        if message is None:
+            return None, 0
+        return message, len(message.encode()) + 1
+
+    def encode_reply(self, text: str) -> bytes:
+        return encode_reply(text)
+
+    def encode_chunk(self, chunk) -> bytes:
+        """Часть потокового ответа; байты (ответ из кэша LIST_*) уже закодированы."""
+        if isinstance(chunk, bytes):
+            return chunk
+        return encode_lines(chunk)
+
+    def stream_end(self) -> bytes:
+        return REPLY_TERMINATOR
+
+    def encode_error(self, text: str) -> bytes:
+        return encode_reply(text)
@@ -0,0 +1,87 @@
+from collections import OrderedDict
+
+
+class VMState:
+    """Характеристики и флаги одной виртуальной машины.
+
+    lease_expires — срок аренды аутентификации по time.monotonic() (None — неизвестен).
+    """
+
+    __slots__ = ("ram", "cpu", "is_active", "is_auth", "lease_expires")
+
+    def __init__(self, ram, cpu, is_active, is_auth, lease_expires=None):
+        self.ram = ram
+        self.cpu = cpu
+        self.is_active = is_active
+        self.is_auth = is_auth
+        self.lease_expires = lease_expires
+
+
+class VMRegistry:
+    """Write-through реестр ВМ в памяти процесса с вытеснением LRU.
+
+    Хранит не более max_entries записей (0 отключает реестр). Перед записью
+    в БД запись ВМ сбрасывается вызовом invalidate(), а после успешной записи
+    сохраняется вызовом store() с полученным токеном. Если за это время
+    началась другая запись той же ВМ, устаревшее состояние не сохраняется.
+
+    Токены начатых записей тоже ограничены max_entries: запись, завершившаяся
+    ошибкой, не вызывает store(), и ее токен вытесняется более новыми. Запись
+    с вытесненным токеном просто не попадает в реестр.
+    """
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.pending = OrderedDict()
+        self.sequence = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, vm_id):
+        """Возвращает состояние ВМ или None, если его нет в реестре."""
+        state = self.entries.get(vm_id)
+        if state is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(vm_id)
+        self.hits += 1
+        return state
+
+    def put(self, vm_id, ram, cpu, is_active, is_auth, lease_expires=None):
+        """Сохраняет состояние ВМ, вытесняя давно не используемые записи."""
+        if not self.max_entries:
+            return
+        self.entries[vm_id] = VMState(ram, cpu, is_active, is_auth, lease_expires)
+        self.entries.move_to_end(vm_id)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, vm_id) -> int:
+        """Сбрасывает запись ВМ перед изменением и возвращает токен записи (0 — реестр отключен)."""
+        if not self.max_entries:
+            return 0
+        self.entries.pop(vm_id, None)
+        self.sequence += 1
+        self.pending[vm_id] = self.sequence
+        self.pending.move_to_end(vm_id)
+        while len(self.pending) > self.max_entries:
+            self.pending.popitem(last=False)
+        return self.sequence
+
+    def evict(self, vm_id):
+        """Сбрасывает запись ВМ, измененной другим процессом; начатые записи ее не вернут."""
+        self.entries.pop(vm_id, None)
+        if vm_id in self.pending:
+            self.sequence += 1
+            self.pending[vm_id] = self.sequence
+
+    def store(self, vm_id, token, ram, cpu, is_active, is_auth, lease_expires=None):
+        """Сохраняет состояние после записи, если она была последней для этой ВМ."""
+        if self.pending.get(vm_id) != token:
+            return
+        del self.pending[vm_id]
+        self.put(vm_id, ram, cpu, is_active, is_auth, lease_expires)
@@ -0,0 +1,151 @@
+import asyncio
+import itertools
+from contextlib import asynccontextmanager
+
+from loguru import logger as log
+
+# Позиция WAL: на основном сервере — конец вставленных записей, на реплике — примененных
+PRIMARY_LSN = "SELECT pg_current_wal_insert_lsn()::text"
+REPLAY_LSN = "SELECT pg_last_wal_replay_lsn()::text"
+
+
+def parse_lsn(text):
+    """Позиция WAL вида «16/B374D848» в виде числа (None — не реплика)."""
+    if text is None:
+        return None
+    high, _, low = text.partition("/")
+    return (int(high, 16) << 32) + int(low, 16)
+
+
+class Replica:
+    """Реплика с собственным пулом соединений и последней известной позицией WAL."""
+
+    def __init__(self, dsn: str):
+        self.dsn = dsn
+        # Для журнала: DSN без имени пользователя и пароля
+        scheme, _, rest = dsn.rpartition("://")
+        self.name = f"{scheme}://{rest.rpartition('@')[2]}" if scheme else dsn.rpartition("@")[2]
+        self.pool = None
+        self.healthy = False
+        self.replayed = 0
+
+
+class ReplicaSet:
+    """Реплики для чтения с выбором по кругу и возвратом на основной сервер.
+
+    Фоновая проверка раз в interval с обновляет позицию WAL каждой реплики и
+    исключает недоступные реплики и отставшие от основного сервера больше чем
+    на max_lag байт WAL; исключенные возвращаются после восстановления.
+    create_pool(dsn) создает пул соединений реплики.
+    """
+
+    def __init__(self, dsns, create_pool, max_lag: int, interval: float, acquire_timeout: float):
+        self.replicas = [Replica(dsn) for dsn in dsns]
+        self.create_pool = create_pool
+        self.max_lag = max_lag
+        self.interval = interval
+        self.acquire_timeout = acquire_timeout
+        self.turn = itertools.count()
+        self.monitor = None
+
+    async def start(self, primary_lsn):
+        """Открывает пулы реплик и запускает фоновую проверку.
+
+        primary_lsn — корутина-функция, возвращающая текущую позицию WAL основного сервера.
+        """
+        await self.check_all(primary_lsn)
+        self.monitor = asyncio.create_task(self.monitor_loop(primary_lsn))
+
+    async def close(self):
+        if self.monitor is not None:
+            self.monitor.cancel()
+            await asyncio.gather(self.monitor, return_exceptions=True)
+            self.monitor = None
+        for replica in self.replicas:
+            if replica.pool is not None:
+                await replica.pool.close()
+                replica.pool = None
+
+    async def monitor_loop(self, primary_lsn):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.check_all(primary_lsn)
+
+    async def check_all(self, primary_lsn):
+        try:
+            primary = await primary_lsn()
+        except Exception as e:
+            log.error(f"Не удалось получить позицию WAL основного сервера: {e}")
+            primary = None
+        await asyncio.gather(*(self.check(replica, primary) for replica in self.replicas))
+
+    async def check(self, replica, primary):
+        """Обновляет позицию WAL реплики и ее пригодность для чтения."""
+        try:
+            if replica.pool is None:
+                replica.pool = await self.create_pool(replica.dsn)
+            replayed = await self.refresh(replica)
+        except Exception as e:
+            self.mark(replica, False, f"недоступна: {e}")
+            return
+        if replayed is None:
+            self.mark(replica, False, "не находится в режиме восстановления (не реплика)")
+        elif primary is not None and primary - replayed > self.max_lag:
+            self.mark(replica, False, f"отстает на {primary - replayed} байт WAL")
+        else:
+            self.mark(replica, True, "доступна для чтения")
+
+    async def refresh(self, replica):
+        async with replica.pool.acquire(timeout=self.acquire_timeout) as conn:
+            replayed = parse_lsn(await conn.fetchval(REPLAY_LSN))
+        if replayed is not None:
+            replica.replayed = max(replica.replayed, replayed)
+        return replayed
+
+    def available(self) -> bool:
+        """Есть ли реплика, пригодная для чтения."""
+        return any(replica.healthy for replica in self.replicas)
+
+    @staticmethod
+    def mark(replica, healthy, reason):
+        if replica.healthy != healthy:
+            (log.info if healthy else log.warning)(f"Реплика {replica.name} {reason}")
+        replica.healthy = healthy
+
+    async def choose(self, lsn: int):
+        """Реплика по кругу, уже применившая WAL до позиции lsn, или None — читать
+        с основного сервера. Отставшая по последним сведениям реплика перепроверяется."""
+        count = len(self.replicas)
+        start = next(self.turn)
+        for offset in range(count):
+            replica = self.replicas[(start + offset) % count]
+            if not replica.healthy:
+                continue
+            if replica.replayed < lsn:
+                try:
+                    await self.refresh(replica)
+                except Exception as e:
+                    self.mark(replica, False, f"недоступна: {e}")
+                    continue
+                if replica.replayed < lsn:
+                    continue
+            return replica
+        return None
+
+    @asynccontextmanager
+    async def acquire(self, lsn: int):
+        """Соединение с репликой, видящей записи до позиции lsn, или None."""
+        replica = await self.choose(lsn)
+        if replica is None:
+            yield None
+            return
+        try:
+            conn = await replica.pool.acquire(timeout=self.acquire_timeout)
+        except Exception as e:
+            self.mark(replica, False, f"недоступна: {e}")
+            yield None
+            return
+        try:
+            yield conn
+        finally:
+            await replica.pool.release(conn)
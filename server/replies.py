@@ -0,0 +1,42 @@
+"""Статусы ответов команд.
+
+Команды и хранилища возвращают текст ответа; ответ, отличный от успешного,
+возвращается как Reply с машинным статусом. Текстовый протокол передает только
+текст, двоичный — статус как есть, не разбирая текст (в нем бывают ID клиента).
+"""
+
+OK = 0x00
+NOT_FOUND = 0x01
+ALREADY_EXISTS = 0x02
+INVALID = 0x03
+AUTH_FAILED = 0x04
+NOT_AUTHENTICATED = 0x05
+OVERLOADED = 0x06
+UNKNOWN_COMMAND = 0x07
+ERROR = 0x08
+
+
+class Reply(str):
+    """Текст ответа со статусом.
+
+    statuses и texts — статусы и тексты ответов пакетной команды, по одному на
+    запись. Тексты хранятся отдельно: разбить общий текст по строкам нельзя,
+    ID записи может содержать разделитель строк.
+    """
+
+    def __new__(cls, text: str, status: int = OK, statuses=None, texts=None):
+        reply = super().__new__(cls, text)
+        reply.status = status
+        reply.statuses = statuses
+        reply.texts = texts
+        return reply
+
+
+def status_of(reply: str) -> int:
+    """Статус ответа: у обычной строки — OK."""
+    return getattr(reply, "status", OK)
+
+
+def bulk_reply(results) -> Reply:
+    """Ответ пакетной команды из ответов по каждой записи."""
+    return Reply("\n".join(results), OK, [status_of(result) for result in results], list(results))
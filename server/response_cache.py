@@ -0,0 +1,105 @@
+import asyncio
+from collections import OrderedDict
+from contextlib import aclosing
+
+
+class ResponseCache:
+    """Кэш готовых ответов LIST_* (байты протокола) с вытеснением LRU и лимитом памяти.
+
+    Хранилище увеличивает поколение (bump) при каждом видимом изменении данных.
+    Запись действительна только в поколении, в котором получена; записи прежних
+    поколений при обращении считаются промахом и удаляются. Одинаковые запросы
+    одного поколения, пришедшие во время выполнения первого, ждут его результата
+    и не обращаются к БД. Первый запрос отдает ответ в темпе своего клиента,
+    поэтому ждут его не дольше wait_timeout секунд, после чего выполняются сами.
+    Ответы больше четверти лимита не кэшируются.
+    """
+
+    def __init__(self, max_bytes: int, wait_timeout: float = 0.5):
+        self.max_bytes = max_bytes
+        self.wait_timeout = wait_timeout
+        self.max_entry = max_bytes // 4
+        self.entries = OrderedDict()
+        self.size = 0
+        self.generation = 0
+        self.pending = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def bump(self):
+        self.generation += 1
+
+    def get(self, key):
+        """Ответ текущего поколения или None."""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        generation, data = entry
+        if generation != self.generation:
+            self.discard(key)
+            return None
+        self.entries.move_to_end(key)
+        return data
+
+    def put(self, key, generation, data):
+        if generation != self.generation or len(data) > self.max_entry:
+            return
+        self.discard(key)
+        self.entries[key] = (generation, data)
+        self.size += len(data)
+        while self.size > self.max_bytes:
+            _, (_, evicted) = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+            self.evictions += 1
+
+    def discard(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[1])
+
+    async def stream(self, key, produce, encode):
+        """Потоковый ответ из кэша либо из produce() с сохранением результата.
+
+        produce — функция, создающая потоковый ответ; encode переводит его часть
+        в байты протокола. Из кэша ответ отдается одной частью. Если ответ не
+        дочитан до конца (клиент отключился), он не сохраняется, а ожидавшие его
+        запросы выполняются сами. Ответ, переросший max_entry, дальше не
+        копится в памяти: его части только передаются клиенту.
+        """
+        generation = self.generation
+        flight = (key, generation)
+        data = self.get(key)
+        if data is None and flight in self.pending:
+            try:
+                data = await asyncio.wait_for(asyncio.shield(self.pending[flight]), self.wait_timeout)
+            except asyncio.TimeoutError:
+                data = None
+        if data is not None:
+            self.hits += 1
+            if data:
+                yield data
+            return
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self.pending[flight] = future
+        parts, size, complete = [], 0, False
+        try:
+            async with aclosing(produce()) as chunks:
+                async for chunk in chunks:
+                    chunk = encode(chunk)
+                    if parts is not None:
+                        size += len(chunk)
+                        parts.append(chunk)
+                        if size > self.max_entry:
+                            parts = None
+                    yield chunk
+            complete = True
+        finally:
+            if self.pending.get(flight) is future:
+                del self.pending[flight]
+            data = b"".join(parts) if complete and parts is not None else None
+            future.set_result(data)
+            if data is not None:
+                self.put(key, generation, data)
@@ -1,16 +1,43 @@
 import asyncio
+import signal
+import time
+from contextlib import AsyncExitStack, aclosing
+from functools import partial
 from loguru import logger as log
-from .db_manager import DatabaseManager
+from .admission import AdmissionController, Overloaded
+from .config import (MAX_LINE_LENGTH, PIPELINE_CONCURRENCY, PIPELINE_DEPTH, SERVER_HOST,
+                     SERVER_PORT, WORKERS, MAX_CONCURRENT_COMMANDS, MAX_CLIENT_COMMANDS,
+                     ADMISSION_QUEUE_SIZE, ADMISSION_QUEUE_TIMEOUT, METRICS_PORT, STORAGE_ENGINE,
+                     DRAIN_DELAY, DRAIN_TIMEOUT, STREAM_SEND_TIMEOUT)
+from .logs import success_log
+from .metrics import metrics
+from .pipeline import Pipeline
+from .storage import Session, create_storage, current_session
+from .binary import MAGIC, BinaryProtocol
+from .protocol import CommandTooLong, MalformedRequest, TextProtocol, start_stream
+from .replies import ERROR, INVALID, OVERLOADED, UNKNOWN_COMMAND, Reply
 from .commands import (AuthenticateVMCommand, AddVMCommand, ListVMsCommand,
                        ListAuthenticatedVMsCommand, UpdateVMCommand, LogoutVMCommand,
                        RemoveVMCommand, ListDisksCommand, AddDiskCommand,
-                       RemoveDiskCommand, CheckAllVMsCommand)
+                       RemoveDiskCommand, CheckAllVMsCommand, BulkAuthenticateVMCommand,
+                       BulkAddVMCommand, BulkAddDiskCommand, CapacityCommand, HeartbeatCommand,
+                       StatsCommand, WatchCommand)
 
 class VMServer:
     """Сервер для управления виртуальными машинами с хранением состояния в БД."""
 
-    def __init__(self):
-        self.db_manager = DatabaseManager()
+    def __init__(self, db_manager=None):
+        self.db_manager = db_manager or create_storage()
+        self.connections = {}
+        self.stopping = asyncio.Event()
+        self.forced = asyncio.Event()
+        # Остановка: новые команды не читаются, принятые выполняются до конца
+        self.draining = False
+        # Задачи, ждущие ввода клиента: при остановке их можно отменить, не потеряв команду
+        self.idle = set()
+        self.admission = AdmissionController(
+            MAX_CONCURRENT_COMMANDS, MAX_CLIENT_COMMANDS, ADMISSION_QUEUE_SIZE, ADMISSION_QUEUE_TIMEOUT
+        )
         self.commands = {
             "AUTH": AuthenticateVMCommand(self.db_manager),
             "ADD_VM": AddVMCommand(self.db_manager),
@@ -18,70 +45,334 @@ class VMServer:
             "LIST_AUTH_VMS": ListAuthenticatedVMsCommand(self.db_manager),
             "UPDATE_VM": UpdateVMCommand(self.db_manager),
             "LOGOUT_VM": LogoutVMCommand(self.db_manager),
+            "HEARTBEAT": HeartbeatCommand(self.db_manager),
             "REMOVE_VM": RemoveVMCommand(self.db_manager),
             "LIST_DISKS": ListDisksCommand(self.db_manager),
             "ADD_DISK": AddDiskCommand(self.db_manager),
             "REMOVE_DISK": RemoveDiskCommand(self.db_manager),
             "CHECK_ALL_VMS": CheckAllVMsCommand(self.db_manager),
+            "BULK_AUTH": BulkAuthenticateVMCommand(self.db_manager),
+            "BULK_ADD_VM": BulkAddVMCommand(self.db_manager),
+            "BULK_ADD_DISK": BulkAddDiskCommand(self.db_manager),
+            "CAPACITY": CapacityCommand(self.db_manager),
+            "STATS": StatsCommand(metrics),
+            "WATCH": WatchCommand(self.db_manager),
         }
+        metrics.gauges["commands_running"] = lambda: self.admission.running
+        metrics.gauges["commands_queued"] = lambda: self.admission.queued
 
-    async def start(self, host='0.0.0.0', port=8888):
+    async def start(self, host=SERVER_HOST, port=SERVER_PORT, reuse_port=False, create_schema=True,
+                    metrics_port=METRICS_PORT, signals=(signal.SIGTERM, signal.SIGINT)):
+        """Запуск сервера. Работает до одного из сигналов signals или вызова stop().
+
+        reuse_port=True позволяет нескольким процессам принимать соединения на одном порту.
+        metrics_port — порт HTTP-эндпоинта метрик Prometheus (0 — не запускать). Эндпоинт
+        запускается первым, и /ready отвечает 200 только после открытия порта сервера.
+        """
+        metrics_server = None
         try:
-            await self.db_manager.initialize()
+            if metrics_port:
+                metrics_server = await metrics.serve(host, metrics_port)
+            started = time.perf_counter()
+            await self.db_manager.initialize(create_schema)
 
             server = await asyncio.start_server(
                 self.handle_client,
                 host,
-                port
+                port,
+                limit=MAX_LINE_LENGTH,
+                reuse_port=reuse_port
             )
-            log.info(f"🚀 Сервер запущен на {host}:{port}")
+            loop = asyncio.get_running_loop()
+            for sig in signals:
+                loop.add_signal_handler(sig, self.stop)
+            metrics.ready = True
+            log.info(f"🚀 Сервер запущен на {host}:{port} "
+                     f"за {(time.perf_counter() - started) * 1000:.0f} мс")
 
             async with server:
-                await server.serve_forever()
+                await self.stopping.wait()
+                log.info("🛑 Остановка сервера...")
+                metrics.ready = False
+                if DRAIN_DELAY > 0:
+                    # Балансировщик успевает увидеть 503 на /ready и перестать направлять клиентов
+                    try:
+                        await asyncio.wait_for(self.forced.wait(), DRAIN_DELAY)
+                    except asyncio.TimeoutError:
+                        pass
+                server.close()
+                await self.drain()
+            await self.db_manager.close()
 
         except Exception as e:
             log.critical(f"🔥 Критическая ошибка: {e}")
             raise
+        finally:
+            if metrics_server is not None:
+                metrics_server.close()
+
+    def stop(self):
+        """Начинает остановку с завершением открытых соединений; повторный вызов
+        закрывает их, не дожидаясь ответов."""
+        if self.stopping.is_set():
+            self.forced.set()
+        self.stopping.set()
+
+    async def drain(self):
+        """Завершение открытых соединений при остановке.
+
+        Новые команды не читаются, подписки WATCH завершаются, а принятые команды
+        выполняются и получают ответы. Соединения, не завершившиеся за DRAIN_TIMEOUT с
+        или до повторного сигнала, закрываются принудительно. Обработчики соединений
+        завершаются до закрытия хранилища.
+        """
+        self.draining = True
+        for task in list(self.idle):
+            task.cancel()
+        self.db_manager.events.close()
+        handlers = list(self.connections.values())
+        if handlers and not self.forced.is_set():
+            log.info(f"Завершение открытых соединений: {len(handlers)}")
+            finished = asyncio.ensure_future(asyncio.wait(handlers))
+            forced = asyncio.ensure_future(self.forced.wait())
+            await asyncio.wait((finished, forced), timeout=DRAIN_TIMEOUT,
+                               return_when=asyncio.FIRST_COMPLETED)
+            finished.cancel()
+            forced.cancel()
+        handlers = [handler for handler in handlers if not handler.done()]
+        if handlers:
+            log.warning(f"Принудительно закрыто соединений: {len(handlers)}")
+            for handler in handlers:
+                handler.cancel()
+            await asyncio.gather(*handlers, return_exceptions=True)
 
     async def handle_client(self, reader, writer):
         addr = writer.get_extra_info('peername')
         log.info(f"Новое подключение от {addr}")
+        self.connections[writer] = asyncio.current_task()
+        metrics.connections += 1
+        current_session.set(Session())
+        # Лимит допуска на клиента считается по адресу: несколько соединений одного
+        # клиента не умножают его долю мест
+        client = addr[0] if addr else writer
+        pipeline = Pipeline(partial(self.process_command, client=client, streams=asyncio.Lock()),
+                            self.command_keys, PIPELINE_CONCURRENCY)
+        replies = asyncio.Queue(PIPELINE_DEPTH)
+        receiver = sender = None
         try:
-            while True:
-                data = await reader.read(100)
-                if not data:
-                    break
-                message = data.decode().strip()
-                log.info(f"Получено от {addr}: {message}")
-                response = await self.process_command(message)
-                writer.write(response.encode())
-                await writer.drain()
+            if self.draining:
+                return
+            self.idle.add(asyncio.current_task())
+            try:
+                codec = await self.negotiate(reader, writer)
+            finally:
+                self.idle.discard(asyncio.current_task())
+            if codec is None:
+                log.warning(f"Не удалось согласовать протокол с {addr}")
+                return
+            receiver = asyncio.create_task(self.receive_commands(reader, pipeline, replies, addr,
+                                                                 codec))
+            sender = asyncio.create_task(self.send_replies(writer, replies, codec))
+            done, _ = await asyncio.wait(
+                (receiver, sender), return_when=asyncio.FIRST_EXCEPTION
+            )
+            for task in done:
+                task.result()
+        except asyncio.CancelledError:
+            # Остановка сервера: соединение закрывается ниже, задача завершается штатно
+            pass
         except Exception as e:
             log.error(f"Ошибка с {addr}: {e}")
         finally:
+            for task in (receiver, sender):
+                if task is not None:
+                    task.cancel()
+            pipeline.cancel()
+            self.discard_replies(replies)
+            self.connections.pop(writer, None)
+            metrics.connections -= 1
             log.info(f"Соединение с {addr} закрыто")
             writer.close()
 
-    async def process_command(self, message):
-        parts = message.split()
-        if len(parts) < 1:
-            return "Неверная команда"
+    @staticmethod
+    async def negotiate(reader, writer):
+        """Выбор протокола по первому байту: MAGIC — двоичный, иначе текстовый.
+
+        Возвращает протокол соединения или None, если согласовать его не удалось.
+        """
+        first = await reader.read(1)
+        if first != MAGIC[:1]:
+            return TextProtocol(first)
+        try:
+            return await BinaryProtocol.accept(reader, writer, MAX_LINE_LENGTH)
+        except asyncio.IncompleteReadError:
+            return None
+
+    async def receive_commands(self, reader, pipeline, replies, addr, codec):
+        """Читает команды из соединения и ставит их ответы в очередь по порядку.
+
+        При остановке сервера чтение прерывается только в ожидании новой команды,
+        после чего отправитель досылает ответы на уже принятые.
+        """
+        task = asyncio.current_task()
+        while not self.draining:
+            try:
+                self.idle.add(task)
+                try:
+                    request, size = await codec.read_request(reader)
+                finally:
+                    self.idle.discard(task)
+            except CommandTooLong:
+                await replies.put(self.immediate(Reply("Слишком длинная команда", INVALID)))
+                continue
+            except MalformedRequest:
+                await replies.put(self.immediate(Reply("Неверный формат команды", INVALID)))
+                continue
+            except asyncio.CancelledError:
+                if not self.draining:
+                    raise
+                break
+            if request is None:
+                break
+            metrics.bytes_in += size
+            log.debug("Получено от {}: {}", addr, request)
+            await replies.put(await pipeline.submit(request))
+        await replies.put(None)
+
+    async def send_replies(self, writer, replies, codec):
+        """Отправляет ответы в том порядке, в котором поступили команды."""
+        while True:
+            reply = await replies.get()
+            if reply is None:
+                break
+            response = await reply
+            if isinstance(response, str):
+                data = codec.encode_reply(response)
+                metrics.bytes_out += len(data)
+                writer.write(data)
+            else:
+                await self.send_stream(writer, response, codec)
+            await writer.drain()
+
+    async def send_stream(self, writer, chunks, codec):
+        """Отправляет потоковый ответ по частям, не собирая его целиком в памяти.
+
+        Пока ответ отправляется, он держит курсор БД и место допуска, поэтому
+        клиент, не принимающий часть ответа дольше STREAM_SEND_TIMEOUT, отключается.
+        """
+        async with aclosing(chunks):
+            try:
+                async for chunk in chunks:
+                    data = codec.encode_chunk(chunk)
+                    metrics.bytes_out += len(data)
+                    writer.write(data)
+                    try:
+                        await asyncio.wait_for(writer.drain(), STREAM_SEND_TIMEOUT or None)
+                    except asyncio.TimeoutError:
+                        writer.transport.abort()
+                        raise ConnectionError("клиент не принимает потоковый ответ") from None
+                end = codec.stream_end()
+            except (ConnectionError, asyncio.CancelledError):
+                raise
+            except Exception as e:
+                end = codec.encode_error(f"Ошибка обработки команды: {str(e)}")
+        writer.write(end)
+        metrics.bytes_out += len(end)
+
+    @staticmethod
+    def discard_replies(replies):
+        """Закрывает неотправленные потоковые ответы, освобождая соединения с БД."""
+        while not replies.empty():
+            reply = replies.get_nowait()
+            if reply is None or not reply.done() or reply.cancelled():
+                continue
+            response = reply.result()
+            if not isinstance(response, str):
+                asyncio.ensure_future(response.aclose())
+
+    @staticmethod
+    def immediate(response):
+        """Готовый ответ, который можно поставить в очередь наравне с задачами."""
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(response)
+        return future
+
+    @staticmethod
+    def split_request(request):
+        """Имя команды и аргументы. Текстовая команда разбирается по пробелам,
+        команда двоичного протокола приходит уже разобранной."""
+        if isinstance(request, str):
+            parts = request.split()
+            return (parts[0].upper(), parts[1:]) if parts else (None, [])
+        return request
+
+    def command_keys(self, request):
+        """Ключи упорядочивания команды внутри конвейера соединения."""
+        command_name, args = self.split_request(request)
+        command = self.commands.get(command_name) if command_name else None
+        if not command:
+            return ("",)
+        return command.keys(*args)
+
+    async def process_command(self, request, client=None, streams=None):
+        """Выполняет команду и возвращает ответ: строку или поток.
+
+        client — адрес клиента, по которому считается лимит допуска MAX_CLIENT_COMMANDS.
+        streams — блокировка потоковых ответов соединения: следующий поток
+        (и его курсор в БД) открывается только после полной отправки предыдущего,
+        поэтому медленно читающий клиент не занимает несколько соединений пула.
+        """
+        command_name, args = self.split_request(request)
+        if not command_name:
+            return Reply("Неверная команда", INVALID)
 
-        command_name = parts[0].upper()
         command = self.commands.get(command_name)
 
         if not command:
-            return "Неизвестная команда"
+            return Reply("Неизвестная команда", UNKNOWN_COMMAND)
 
+        stats = metrics.command(command_name)
+        started = time.perf_counter()
         try:
-            return await command.execute(*parts[1:])
+            async with AsyncExitStack() as stack:
+                if command.streaming and streams is not None:
+                    await stack.enter_async_context(streams)
+                if command.admitted:
+                    await stack.enter_async_context(
+                        self.admission.admit(client, command.priority)
+                    )
+                session = current_session.get()
+                if session is not None and not command.readonly:
+                    session.wrote = True
+                response = await command.execute(*args)
+                if not isinstance(response, str):
+                    # Потоковый ответ занимает место и блокировку потоков до конца отправки
+                    response = await start_stream(response)
+                    response.on_close(stack.pop_all().aclose)
+            duration = time.perf_counter() - started
+            stats.latency.observe(duration)
+            duration_ms = duration * 1000
+            vm_id = args[0] if args and isinstance(args[0], str) else None
+            success_log.log("DEBUG", command_name, "{} выполнена за {:.2f} мс", command_name,
+                            duration_ms, vm_id=vm_id, duration_ms=duration_ms)
+            return response
+        except (Overloaded, asyncio.TimeoutError):
+            stats.rejected += 1
+            return Reply("Сервер перегружен, повторите позже", OVERLOADED)
         except Exception as e:
-            return f"Ошибка обработки команды: {str(e)}"
+            stats.errors += 1
+            return Reply(f"Ошибка обработки команды: {str(e)}", ERROR)
 
 if __name__ == '__main__':
     try:
         log.info("⏳ Запуск сервера...")
-        server = VMServer()
-        asyncio.run(server.start())
+        if WORKERS > 1 and STORAGE_ENGINE == "memory":
+            log.warning("Хранилище memory работает в одном процессе, WORKERS игнорируется")
+        if WORKERS > 1 and STORAGE_ENGINE != "memory":
+            from .launcher import Supervisor
+            Supervisor(WORKERS).run()
+        else:
+            server = VMServer()
+            asyncio.run(server.start())
     except KeyboardInterrupt:
         log.info("\n🛑 Сервер остановлен")
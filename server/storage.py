@@ -0,0 +1,220 @@
+from abc import ABC, abstractmethod
+from contextlib import aclosing
+from contextvars import ContextVar
+
+from loguru import logger as log
+
+from .capacity import Capacity
+from .events import EventBus, vm_event
+
+
+class ListFilter:
+    """Параметры выборки для команд LIST_*.
+
+    limit — максимум записей на странице (None — без ограничения),
+    after — курсор: ID, после которого продолжается выборка,
+    prefix — префикс ID ВМ, with_disks — только ВМ, у которых есть диски.
+    codec — протокол, который сам кодирует строки и курсор (encode_rows,
+    encode_cursor); None — текстовый ответ.
+    """
+
+    __slots__ = ("limit", "after", "prefix", "with_disks", "codec")
+
+    def __init__(self, limit=None, after=None, prefix=None, with_disks=False, codec=None):
+        self.limit = limit
+        self.after = after
+        self.prefix = prefix
+        self.with_disks = with_disks
+        self.codec = codec
+
+
+class Session:
+    """Сессия — одно соединение клиента. Хранилище с репликами по ней решает,
+    откуда читать, чтобы клиент видел свои записи.
+
+    wrote — после последнего чтения выполнялись изменяющие команды,
+    lsn — позиция WAL, которую должна применить реплика, чтобы читать с нее.
+    """
+
+    __slots__ = ("wrote", "lsn")
+
+    def __init__(self):
+        self.wrote = False
+        self.lsn = 0
+
+
+# Сессия текущего соединения: задается обработчиком соединения и наследуется задачами его команд
+current_session: ContextVar = ContextVar("current_session", default=None)
+
+
+def format_vm(r):
+    return f"{r['id']}: {r['ram']}MB RAM, {r['cpu']}CPU"
+
+
+def format_disk(r):
+    return f"Disk {r['id']} (VM {r['vm_id']}): {r['size']}GB"
+
+
+class Storage(ABC):
+    """Хранилище ВМ и дисков, с которым работают команды.
+
+    Все реализации возвращают одинаковые ответы на одинаковые команды.
+    Методы LIST_* синхронно возвращают асинхронный итератор частей ответа.
+    Реализация сообщает о каждом изменении через vm_changed / disk_added /
+    disk_removed: так поддерживаются итоги CAPACITY (capacity) и рассылаются
+    события подписчикам WATCH (events). Вместе с событием другим процессам
+    передается изменение итогов, чтобы их CAPACITY не ждал пересчета по БД.
+    """
+
+    capacity: Capacity
+    events: EventBus
+    # Кэш ответов LIST_*; изменения данных делают его записи недействительными
+    list_cache = None
+
+    @abstractmethod
+    async def initialize(self, create_schema=True):
+        """Подготовка хранилища к работе."""
+        pass
+
+    @abstractmethod
+    async def close(self):
+        """Освобождение ресурсов хранилища."""
+        pass
+
+    @abstractmethod
+    async def authenticate_vm(self, vm_id, ram, cpu):
+        pass
+
+    @abstractmethod
+    async def bulk_authenticate_vms(self, vms):
+        pass
+
+    @abstractmethod
+    async def add_vm(self, vm_id, ram, cpu):
+        pass
+
+    @abstractmethod
+    async def bulk_add_vms(self, vms):
+        pass
+
+    @abstractmethod
+    async def update_vm(self, vm_id, ram, cpu):
+        pass
+
+    @abstractmethod
+    async def heartbeat_vm(self, vm_id):
+        pass
+
+    @abstractmethod
+    async def logout_vm(self, vm_id):
+        pass
+
+    @abstractmethod
+    async def remove_vm(self, vm_id):
+        pass
+
+    @abstractmethod
+    async def add_disk(self, disk_id, vm_id, size):
+        pass
+
+    @abstractmethod
+    async def bulk_add_disks(self, disks):
+        pass
+
+    @abstractmethod
+    async def remove_disk(self, disk_id):
+        pass
+
+    @abstractmethod
+    def list_vms(self, list_filter=None):
+        pass
+
+    @abstractmethod
+    def list_authenticated_vms(self, list_filter=None):
+        pass
+
+    @abstractmethod
+    def list_disks(self, list_filter=None):
+        pass
+
+    @abstractmethod
+    def check_all_vms(self, list_filter=None):
+        pass
+
+    def vm_changed(self, vm_id, old, new):
+        """Учет изменения строки ВМ (кортежи (ram, cpu, is_active, is_auth), old — None для новой)."""
+        before = self.capacity.totals()
+        self.capacity.vm_changed(old, new)
+        if self.list_cache is not None and old != new:
+            self.list_cache.bump()
+        delta = self.capacity_delta(before)
+        event = vm_event(vm_id, old, new)
+        if event is not None or any(delta):
+            self.events.publish(vm_id, event, delta)
+
+    def disk_added(self, disk_id, vm_id, size):
+        before = self.capacity.totals()
+        self.capacity.disk_added(vm_id, size)
+        if self.list_cache is not None:
+            self.list_cache.bump()
+        self.events.publish(vm_id, f"DISK_ADDED {disk_id} {vm_id} {size}",
+                            self.capacity_delta(before))
+
+    def disk_removed(self, disk_id, vm_id, size):
+        before = self.capacity.totals()
+        self.capacity.disk_removed(vm_id, size)
+        if self.list_cache is not None:
+            self.list_cache.bump()
+        self.events.publish(vm_id, f"DISK_REMOVED {disk_id} {vm_id}", self.capacity_delta(before))
+
+    def capacity_delta(self, before):
+        """Изменение итогов CAPACITY с момента, когда они были равны before."""
+        return [now - was for now, was in zip(self.capacity.totals(), before)]
+
+    def watch(self, prefix=None):
+        """Потоковый ответ WATCH: события изменений ВМ с ID, начинающимся с prefix."""
+        return self.events.stream(prefix)
+
+    async def get_capacity(self, vm_id=None):
+        """Суммарные ресурсы ВМ и дисков (или объем дисков одной ВМ) без обхода таблиц."""
+        return self.capacity.render(vm_id)
+
+    async def stream_list(self, batches, list_filter, render, empty_message):
+        """Потоковый ответ на команду LIST_*: по одной части на пачку записей из batches.
+
+        Если записей больше, чем limit, ответ завершается строкой NEXT <курсор>.
+        Если задан list_filter.codec, части кодирует он, а пустой ответ не содержит частей.
+        """
+        limit = list_filter.limit
+        codec = list_filter.codec
+        shown = 0
+        cursor = list_filter.after
+        async with aclosing(batches):
+            async for batch in batches:
+                more = limit is not None and shown + len(batch) > limit
+                if more:
+                    batch = batch[:limit - shown]
+                if batch:
+                    shown += len(batch)
+                    cursor = batch[-1]['id']
+                    if codec is not None:
+                        yield codec.encode_rows(render, batch)
+                    else:
+                        yield "\n".join([render(r) for r in batch])
+                if more:
+                    yield codec.encode_cursor(cursor) if codec is not None else f"NEXT {cursor}"
+                    return
+        if not shown:
+            log.info(empty_message)
+            if codec is None:
+                yield empty_message
+
+
+def create_storage() -> Storage:
+    """Хранилище, выбранное настройкой STORAGE_ENGINE."""
+    from .config import STORAGE_ENGINE
+    if STORAGE_ENGINE == "memory":
+        from .memory_storage import MemoryStorage
+        return MemoryStorage()
+    from .db_manager import DatabaseManager
+    return DatabaseManager()
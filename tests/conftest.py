@@ -0,0 +1,78 @@
+"""Общие помощники тестов: сервер на свободном порту и текстовый клиент.
+
+Тесты не требуют PostgreSQL: сервер запускается со встроенным хранилищем
+memory. Тесты, которым нужна БД, пропускаются, если не задан DB_HOST.
+"""
+import asyncio
+import os
+from contextlib import asynccontextmanager
+
+import pytest
+
+# Тесты пишут лог только в stderr, не оставляя server.log в рабочем каталоге
+os.environ["LOG_FILE"] = ""
+
+from server.config import MAX_LINE_LENGTH
+from server.memory_storage import MemoryStorage
+from server.server import VMServer
+
+requires_postgres = pytest.mark.skipif(not os.getenv("DB_HOST"), reason="нужен PostgreSQL (DB_HOST)")
+
+
+@asynccontextmanager
+async def running_server(storage=None):
+    """VMServer на 127.0.0.1 и свободном порту. Возвращает (сервер, порт)."""
+    vm_server = VMServer(storage or MemoryStorage(directory=""))
+    await vm_server.db_manager.initialize()
+    listener = await asyncio.start_server(vm_server.handle_client, "127.0.0.1", 0,
+                                          limit=MAX_LINE_LENGTH)
+    try:
+        yield vm_server, listener.sockets[0].getsockname()[1]
+    finally:
+        listener.close()
+        handlers = list(vm_server.connections.values())
+        for handler in handlers:
+            handler.cancel()
+        await asyncio.gather(*handlers, return_exceptions=True)
+        await vm_server.db_manager.close()
+
+
+async def read_reply(reader):
+    """Один ответ текстового протокола: строки до пустой строки (None — соединение закрыто)."""
+    lines = []
+    while True:
+        line = await reader.readline()
+        if not line:
+            return None
+        line = line.decode().rstrip("\n")
+        if not line:
+            return "\n".join(lines)
+        lines.append(line)
+
+
+async def send_all(port, commands):
+    """Отправляет команды одной пачкой и возвращает ответы по порядку."""
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    try:
+        writer.write("".join(f"{command}\n" for command in commands).encode())
+        await writer.drain()
+        return [await read_reply(reader) for _ in commands]
+    finally:
+        writer.close()
+
+
+@asynccontextmanager
+async def postgres_storage(**options):
+    """DatabaseManager на пустых таблицах БД из настроек DB_*."""
+    from server.db_manager import DatabaseManager
+
+    manager = DatabaseManager(**options)
+    await manager.initialize()
+    async with manager.acquire() as conn:
+        await conn.execute("TRUNCATE disks, vms")
+    manager.registry.entries.clear()
+    manager.capacity.__init__()
+    try:
+        yield manager
+    finally:
+        await manager.close()
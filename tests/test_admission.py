@@ -0,0 +1,29 @@
+import asyncio
+
+from server.admission import AdmissionController
+from server.memory_storage import MemoryStorage
+from tests.conftest import running_server, send_all
+
+
+class SlowStorage(MemoryStorage):
+    def __init__(self):
+        super().__init__(directory="")
+
+    async def add_vm(self, vm_id, ram, cpu):
+        await asyncio.sleep(0.2)
+        return await super().add_vm(vm_id, ram, cpu)
+
+
+def test_connections_from_one_address_share_client_limit():
+    async def main():
+        async with running_server(SlowStorage()) as (vm_server, port):
+            vm_server.admission = AdmissionController(64, 2, 1024, 1)
+            first = asyncio.ensure_future(send_all(port, ["ADD_VM a1 1 1", "ADD_VM a2 1 1"]))
+            await asyncio.sleep(0.05)
+            # Второе соединение с того же адреса упирается в общий лимит адреса
+            assert await send_all(port, ["ADD_VM b1 1 1"]) == ["Сервер перегружен, повторите позже"]
+            assert await first == ["ВМ a1 добавлена", "ВМ a2 добавлена"]
+            assert await send_all(port, ["ADD_VM b1 1 1"]) == ["ВМ b1 добавлена"]
+            assert not vm_server.admission.clients
+
+    asyncio.run(main())
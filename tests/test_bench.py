@@ -0,0 +1,26 @@
+from bench.run import VMState, compare, remove_disk, summarize
+
+
+def test_remove_disk_targets_added_disks():
+    vm = VMState("vm1")
+    assert remove_disk(vm) is None
+    first, second = vm.add_disk(), vm.add_disk()
+    assert (first, second) == ("vm1-d1", "vm1-d2")
+    assert remove_disk(vm) == "REMOVE_DISK vm1-d2"
+    assert remove_disk(vm) == "REMOVE_DISK vm1-d1"
+    assert remove_disk(vm) is None
+
+
+def test_summarize_and_compare():
+    samples = {"AUTH": [0.002, 0.001, 0.003], "REMOVE_DISK": [0.004]}
+    results = summarize(samples, {"AUTH": 1, "REMOVE_DISK": 0}, {"AUTH": 0, "REMOVE_DISK": 1}, 2.0)
+    assert results["AUTH"]["count"] == 3 and results["AUTH"]["p50_ms"] == 2.0
+    assert results["TOTAL"] == {"count": 4, "errors": 1, "rejected": 1, "throughput": 2.0,
+                                "p50_ms": 3.0, "p95_ms": 4.0, "p99_ms": 4.0}
+    assert compare(results, {"results": results}, 0.1) == []
+
+    slower = summarize({"AUTH": [0.01], "REMOVE_DISK": [0.004]}, {"AUTH": 0, "REMOVE_DISK": 0},
+                       {"AUTH": 0, "REMOVE_DISK": 0}, 2.0)
+    regressions = compare(slower, {"results": results}, 0.1)
+    assert any(r.startswith("AUTH: пропускная способность") for r in regressions)
+    assert any(r.startswith("AUTH: p99") for r in regressions)
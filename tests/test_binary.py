@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+
+from client.vm_client import AlreadyExists, AuthFailed, NotFound, VMClient
+from server import binary
+from server.protocol import MalformedRequest
+from server.replies import Reply, bulk_reply
+from server.storage import ListFilter
+from tests.conftest import running_server
+
+
+def test_request_round_trip():
+    body = binary.encode_request("BULK_ADD_DISK", "d1", "vm1", 10, "d2", "vm2", 20)[4:]
+    assert binary.decode_request(body) == ("BULK_ADD_DISK", ["d1", "vm1", 10, "d2", "vm2", 20])
+    name, (list_filter,) = binary.decode_request(
+        binary.encode_request("LIST_VMS", ListFilter(5, "a", "b", True))[4:]
+    )
+    assert name == "LIST_VMS"
+    assert (list_filter.limit, list_filter.after, list_filter.prefix, list_filter.with_disks) == \
+        (5, "a", "b", True)
+
+
+def test_malformed_request_is_rejected():
+    body = binary.encode_request("ADD_VM", "vm1", 1, 1)[4:]
+    with pytest.raises(MalformedRequest):
+        binary.decode_request(body[:-1])
+    with pytest.raises(MalformedRequest):
+        binary.decode_request(body + b"\x00")
+
+
+def test_text_frames_carry_more_than_64k():
+    protocol = binary.BinaryProtocol(binary.VERSION, 1 << 20)
+    text = "VM_ADDED " + "x" * 100_000
+    data = protocol.encode_chunk(text)
+    assert data[binary.FRAME_HEADER.size] == binary.TEXT
+    assert binary.decode_text(data[binary.FRAME_HEADER.size + 1:]) == text
+
+
+def test_status_comes_from_reply_not_text():
+    protocol = binary.BinaryProtocol(binary.VERSION, 1 << 20)
+    protocol.expected.extend([None, None])
+    assert protocol.encode_reply("ВМ Ошибка-vm добавлена")[4] == binary.OK
+    assert protocol.encode_reply(Reply("ВМ vm1 не найдена", binary.NOT_FOUND))[4] == binary.NOT_FOUND
+
+
+def test_client_statuses_end_to_end():
+    async def main():
+        async with running_server() as (_, port):
+            async with VMClient("127.0.0.1", port, pool_size=1) as client:
+                assert await client.add_vm("Ошибка-vm", 1, 1) == "ВМ Ошибка-vm добавлена"
+                assert await client.add_vm("не-найдена", 1, 1) == "ВМ не-найдена добавлена"
+                with pytest.raises(AlreadyExists):
+                    await client.add_vm("Ошибка-vm", 1, 1)
+                with pytest.raises(AuthFailed):
+                    await client.auth("Ошибка-vm", 2, 2)
+                with pytest.raises(NotFound):
+                    await client.remove_disk("d1")
+                replies = await client.bulk_add_vms([("уже-существует", 1, 1), ("Ошибка-vm", 1, 1)])
+                assert [reply.status for reply in replies] == [binary.OK, binary.ALREADY_EXISTS]
+
+    asyncio.run(main())
+
+
+def test_large_watch_batch():
+    async def main():
+        async with running_server() as (_, port):
+            async with VMClient("127.0.0.1", port, pool_size=1) as client:
+                events = client.watch()
+                first = asyncio.ensure_future(anext(events))
+                await asyncio.sleep(0.1)
+                # Одна пачка событий больше 64 КБ, но в пределах буфера подписки
+                vms = [(f"vm-{'x' * 80}-{i}", 1, 1) for i in range(900)]
+                await client.bulk_add_vms(vms)
+                received = [await first]
+                while len(received) < len(vms):
+                    received.append(await anext(events))
+                assert [event.split()[1] for event in received] == [vm_id for vm_id, _, _ in vms]
+                await events.aclose()
+
+    asyncio.run(main())
+
+
+def test_bulk_reply_keeps_records_with_line_separators():
+    protocol = binary.BinaryProtocol(binary.VERSION, 1 << 20)
+    protocol.expected.append(2)
+    reply = bulk_reply([Reply("ВМ a\u2028b уже существует", binary.ALREADY_EXISTS), "ВМ c добавлена"])
+    data = protocol.encode_reply(reply)
+    decoder = binary.Decoder(data, binary.FRAME_HEADER.size + 1)
+    assert decoder.unpack(binary.FRAME_HEADER) == (2,)
+    records = [(decoder.byte(), decoder.text()) for _ in range(2)]
+    assert records == [(binary.ALREADY_EXISTS, "ВМ a\u2028b уже существует"), (binary.OK, "ВМ c добавлена")]
+
+
+@pytest.mark.parametrize("vm_id", ["", "a b", "a\u2028b", "a\x00b", "a\tb"])
+def test_invalid_identifiers_are_rejected(vm_id):
+    with pytest.raises(MalformedRequest):
+        binary.decode_request(binary.encode_request("ADD_VM", vm_id, 1, 1)[4:])
+    with pytest.raises(MalformedRequest):
+        binary.decode_request(binary.encode_request("BULK_ADD_VM", "ok", 1, 1, vm_id, 1, 1)[4:])
@@ -0,0 +1,22 @@
+from server.capacity import Capacity
+
+
+def test_rebase_adds_changes_made_after_snapshot():
+    capacity = Capacity()
+    capacity.vm_changed(None, (100, 1, True, True))
+    capacity.disk_added("vm1", 10)
+    base = capacity.snapshot()
+    capacity.vm_changed(None, (50, 2, True, False))
+    capacity.disk_added("vm2", 5)
+    capacity.disk_removed("vm1", 10)
+
+    fresh = Capacity()
+    for _ in range(3):
+        fresh.vm_changed(None, (100, 1, True, True))
+    fresh.disk_added("vm1", 10)
+    fresh.disk_added("vm1", 20)
+    capacity.rebase(fresh, base)
+
+    assert (capacity.active_vms, capacity.active_ram, capacity.auth_vms) == (4, 350, 3)
+    assert (capacity.disks, capacity.disk_gb) == (2, 25)
+    assert capacity.vm_disks == {"vm1": (1, 20), "vm2": (1, 5)}
@@ -0,0 +1,71 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+from server.events import EventBus, Notifier
+from server.memory_storage import MemoryStorage
+
+
+class FakeConnection:
+    def __init__(self, sent):
+        self.sent = sent
+
+    async def execute(self, query, channel, payload):
+        self.sent.append(payload)
+
+
+def make_notifier(sent):
+    @asynccontextmanager
+    async def acquire():
+        yield FakeConnection(sent)
+
+    async def connect():
+        await asyncio.Event().wait()
+
+    return Notifier(EventBus(16), "vm_events", connect, acquire)
+
+
+def test_notify_reaches_other_processes_but_not_sender():
+    async def main():
+        sent = []
+        # Два процесса после fork: у каждого свой Notifier
+        first, second = make_notifier(sent), make_notifier(sent)
+        first.start()
+        second.start()
+        assert first.instance_id != second.instance_id
+        remote = []
+        second.bus.on_remote = lambda vm_id, delta: remote.append((vm_id, delta))
+        subscription = second.bus.subscribe()
+
+        first.bus.publish("vm1", "ADDED vm1", [1, 2, 3, 0, 0, 0, 0, 0])
+        first.bus.publish("vm1", None, [0, 0, 0, 1, 2, 3, 0, 0])
+        await asyncio.sleep(0.01)
+        assert len(sent) == 1
+        first.on_notification(None, 0, "vm_events", sent[0])
+        second.on_notification(None, 0, "vm_events", sent[0])
+        assert remote == [("vm1", [1, 2, 3, 0, 0, 0, 0, 0]), ("vm1", [0, 0, 0, 1, 2, 3, 0, 0])]
+        assert await subscription.next_batch() == ["ADDED vm1"]
+
+        await first.stop()
+        await second.stop()
+
+    asyncio.run(main())
+
+
+def test_remote_changes_update_capacity():
+    async def main():
+        first, second = MemoryStorage(directory=""), MemoryStorage(directory="")
+        await first.initialize()
+        await second.initialize()
+        # Процессы связаны напрямую, как через NOTIFY
+        first.events.notify = lambda vm_id, event, delta: second.capacity.apply(vm_id, delta)
+        await first.add_vm("vm1", 1024, 2)
+        await first.authenticate_vm("vm1", 1024, 2)
+        await first.add_disk("d1", "vm1", 10)
+        await first.update_vm("vm1", 2048, 4)
+        assert second.capacity.totals() == first.capacity.totals() == [1, 2048, 4, 1, 2048, 4, 1, 10]
+        assert await second.get_capacity("vm1") == "ВМ vm1: дисков 1, 10GB"
+        await first.remove_disk("d1")
+        await first.remove_vm("vm1")
+        assert second.capacity.totals() == [0] * 8 and not second.capacity.vm_disks
+
+    asyncio.run(main())
@@ -0,0 +1,41 @@
+import asyncio
+
+import pytest
+
+from server.group_commit import GroupCommit
+
+
+def test_changes_within_window_share_one_apply():
+    async def main():
+        groups = []
+
+        async def apply(items):
+            groups.append(list(items))
+            await asyncio.sleep(0.01)
+            return [item * 10 for item in items]
+
+        group_commit = GroupCommit(apply, 0.01, 4)
+        results = await asyncio.gather(*(group_commit.submit(i) for i in range(10)))
+        assert results == [i * 10 for i in range(10)]
+        assert groups == [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]]
+
+    asyncio.run(main())
+
+
+def test_failed_apply_fails_only_its_group():
+    async def main():
+        async def apply(items):
+            if 0 in items:
+                raise RuntimeError("deadlock detected")
+            return items
+
+        group_commit = GroupCommit(apply, 0.01, 2)
+        first = [asyncio.ensure_future(group_commit.submit(i)) for i in range(2)]
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(group_commit.submit(5))
+        for future in first:
+            with pytest.raises(RuntimeError):
+                await future
+        assert await second == 5
+
+    asyncio.run(main())
@@ -0,0 +1,32 @@
+import signal
+
+from server import launcher
+
+
+class FakeServer:
+    def __init__(self, db_manager):
+        self.db_manager = db_manager
+
+    async def start(self, host, port, **options):
+        FakeServer.seen = {
+            "SIGINT": signal.getsignal(signal.SIGINT),
+            "SIGTERM": signal.getsignal(signal.SIGTERM),
+            "signals": options["signals"],
+        }
+
+
+def test_worker_drops_supervisor_signal_handlers(monkeypatch):
+    monkeypatch.setattr(launcher, "VMServer", FakeServer)
+    supervisor = launcher.Supervisor(2)
+    saved = {sig: signal.getsignal(sig) for sig in (signal.SIGINT, signal.SIGTERM)}
+    try:
+        # Обработчики, унаследованные от супервизора при fork
+        signal.signal(signal.SIGINT, supervisor.stop)
+        signal.signal(signal.SIGTERM, supervisor.stop)
+        launcher.run_worker(0, "127.0.0.1", 0)
+    finally:
+        for sig, handler in saved.items():
+            signal.signal(sig, handler)
+    assert FakeServer.seen == {
+        "SIGINT": signal.SIG_IGN, "SIGTERM": signal.SIG_DFL, "signals": (signal.SIGTERM,),
+    }
@@ -0,0 +1,50 @@
+import asyncio
+
+import server.db_manager as db_manager
+import server.memory_storage as memory_storage
+from server.db_manager import DatabaseManager
+from server.memory_storage import MemoryStorage
+from tests.conftest import running_server, send_all
+
+
+def test_expired_lease_is_swept(monkeypatch):
+    monkeypatch.setattr(memory_storage, "AUTH_LEASE_TTL", 0.3)
+    monkeypatch.setattr(memory_storage, "LEASE_SWEEP_INTERVAL", 0.05)
+
+    async def main():
+        async with running_server(MemoryStorage(directory="")) as (_, port):
+            await send_all(port, ["AUTH idle 1 1", "AUTH busy 1 1"])
+            for _ in range(4):
+                await asyncio.sleep(0.1)
+                assert await send_all(port, ["HEARTBEAT busy"]) == ["Аренда ВМ busy продлена"]
+            replies = await send_all(port, ["LIST_AUTH_VMS", "HEARTBEAT idle"])
+            assert replies == ["busy: 1MB RAM, 1CPU", "ВМ idle не аутентифицирована"]
+
+    asyncio.run(main())
+
+
+def test_repeated_auth_renews_lease_after_half_ttl(monkeypatch):
+    monkeypatch.setattr(db_manager, "AUTH_LEASE_TTL", 10)
+
+    async def main():
+        manager = DatabaseManager(registry_size=10)
+        heartbeats = []
+
+        async def change_flags(kind, vm_id):
+            heartbeats.append(vm_id)
+            return {"id": vm_id}
+
+        manager.change_flags = change_flags
+        manager.registry.store("vm1", manager.registry.invalidate("vm1"), 1, 1, True, True,
+                               db_manager.lease_deadline())
+        for _ in range(100):
+            assert await manager.authenticate_vm("vm1", 1, 1) == "ВМ vm1 аутентифицирована"
+        assert heartbeats == []
+
+        # До конца аренды меньше половины срока
+        manager.registry.entries["vm1"].lease_expires -= 6
+        await manager.authenticate_vm("vm1", 1, 1)
+        await manager.authenticate_vm("vm1", 1, 1)
+        assert heartbeats == ["vm1"]
+
+    asyncio.run(main())
@@ -0,0 +1,35 @@
+from server.logs import SampledLogger
+
+
+def test_disabled_level_does_not_take_tokens():
+    sampled = SampledLogger(1.0, {}, 2, "INFO")
+    for _ in range(10):
+        assert not sampled.enabled("AUTH", "DEBUG")
+    assert sampled.enabled("AUTH") and sampled.enabled("AUTH")
+    assert not sampled.enabled("AUTH")
+
+
+def test_levels_have_separate_rate_limits():
+    sampled = SampledLogger(1.0, {}, 1, "DEBUG")
+    assert sampled.enabled("AUTH", "DEBUG")
+    assert not sampled.enabled("AUTH", "DEBUG")
+    assert sampled.enabled("AUTH", "INFO")
+    assert sampled.enabled("ADD_VM", "INFO")
+
+
+def test_sample_rates_per_command():
+    sampled = SampledLogger(1.0, {"HEARTBEAT": 0}, 0)
+    assert not sampled.enabled("HEARTBEAT")
+    assert all(sampled.enabled("AUTH") for _ in range(100))
+
+
+def test_fractional_rate_limit_logs_once_per_period(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("server.logs.time.monotonic", lambda: now[0])
+    sampled = SampledLogger(1.0, {}, 0.5)
+    assert sampled.enabled("AUTH")
+    assert not sampled.enabled("AUTH")
+    now[0] += 1
+    assert not sampled.enabled("AUTH")
+    now[0] += 1
+    assert sampled.enabled("AUTH")
@@ -0,0 +1,81 @@
+import asyncio
+
+from server.memory_storage import MemoryStorage
+from server.storage import ListFilter
+
+
+async def fill(storage):
+    await storage.bulk_add_vms([("vm1", 100, 1), ("vm2", 200, 2), ("vm3", 300, 3)])
+    await storage.authenticate_vm("vm2", 200, 2)
+    await storage.remove_vm("vm3")
+    await storage.add_disk("d1", "vm1", 10)
+    await storage.add_disk("d2", "vm2", 20)
+    await storage.remove_disk("d2")
+
+
+async def listing(stream):
+    return "\n".join([chunk async for chunk in stream])
+
+
+async def state(storage):
+    return (
+        await listing(storage.check_all_vms(ListFilter())),
+        await listing(storage.list_authenticated_vms(ListFilter())),
+        await listing(storage.list_disks(ListFilter())),
+        await storage.get_capacity(),
+    )
+
+
+async def crash(storage):
+    """Остановка без итогового снимка: записанное в журнал сброшено, фоновые задачи отменены."""
+    storage.journal.sync()
+    for task in storage.tasks:
+        task.cancel()
+    await asyncio.gather(*storage.tasks, return_exceptions=True)
+    storage.journal.file.close()
+
+
+def test_state_survives_restart(tmp_path):
+    async def main():
+        storage = MemoryStorage(directory=str(tmp_path))
+        await storage.initialize()
+        await fill(storage)
+        expected = await state(storage)
+        await storage.close()
+
+        restarted = MemoryStorage(directory=str(tmp_path))
+        await restarted.initialize()
+        assert restarted.replayed == 0
+        assert await state(restarted) == expected
+        await restarted.close()
+
+    asyncio.run(main())
+
+
+def test_journal_replayed_after_crash(tmp_path):
+    async def main():
+        storage = MemoryStorage(directory=str(tmp_path))
+        await storage.initialize()
+        await storage.add_vm("vm0", 1, 1)
+        await storage.snapshot()
+        await fill(storage)
+        expected = await state(storage)
+        await crash(storage)
+        # Запись, оборванная сбоем, пропускается
+        with open(storage.journal.path(storage.journal.generation), "a", encoding="utf-8") as f:
+            f.write('["vm","torn",1')
+
+        recovered = MemoryStorage(directory=str(tmp_path))
+        await recovered.initialize()
+        assert recovered.replayed > 0
+        assert await state(recovered) == expected
+        assert "torn" not in recovered.vms
+        await recovered.add_vm("vm4", 1, 1)
+        await recovered.close()
+
+        again = MemoryStorage(directory=str(tmp_path))
+        await again.initialize()
+        assert "vm4" in again.vms and "torn" not in again.vms
+        await again.close()
+
+    asyncio.run(main())
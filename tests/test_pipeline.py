@@ -0,0 +1,153 @@
+import asyncio
+import socket
+from unittest.mock import MagicMock
+
+from server.commands import (AddDiskCommand, AuthenticateVMCommand, BulkAddDiskCommand,
+                             BulkAuthenticateVMCommand, ListVMsCommand, StatsCommand)
+from server.memory_storage import MemoryStorage
+from server.pipeline import Pipeline
+from tests.conftest import running_server, send_all
+
+
+def test_keys_are_entity_ids_only():
+    storage = MagicMock()
+    assert AuthenticateVMCommand(storage).keys("vmA", "1", "1") == ("vmA",)
+    assert AddDiskCommand(storage).keys("d1", "vmA", "10") == ("d1", "vmA")
+    assert BulkAuthenticateVMCommand(storage).keys("a", "1", "1", "b", "1", "1") == ("a", "b")
+    assert BulkAddDiskCommand(storage).keys("d1", "a", "5", "d2", "b", "5") == ("d1", "a", "d2", "b")
+    assert ListVMsCommand(storage).keys("LIMIT", "10") == ()
+    assert StatsCommand(storage).keys() == ()
+
+
+def run_pipeline(commands, keys_of):
+    """Выполняет команды в конвейере; возвращает ответы и порядок начала выполнения."""
+    started = []
+
+    async def handler(command):
+        started.append(command)
+        await asyncio.sleep(0.05)
+        return command
+
+    async def main():
+        pipeline = Pipeline(handler, keys_of, 32)
+        tasks = [await pipeline.submit(command) for command in commands]
+        began = asyncio.get_running_loop().time()
+        replies = [await task for task in tasks]
+        return replies, started, asyncio.get_running_loop().time() - began
+
+    return asyncio.run(main())
+
+
+def test_same_key_runs_in_order_distinct_keys_overlap():
+    keys_of = lambda command: tuple(command.split()[1:2])
+    replies, started, elapsed = run_pipeline([f"AUTH vm{i}" for i in range(20)], keys_of)
+    assert replies == [f"AUTH vm{i}" for i in range(20)]
+    assert elapsed < 0.5
+
+    replies, started, elapsed = run_pipeline(["AUTH a", "UPDATE a", "LOGOUT a"], keys_of)
+    assert started == ["AUTH a", "UPDATE a", "LOGOUT a"]
+    assert elapsed >= 0.15
+
+
+def test_command_without_keys_is_a_barrier():
+    keys_of = lambda command: tuple(command.split()[1:2])
+    _, started, _ = run_pipeline(["AUTH a", "AUTH b", "LIST", "AUTH c"], keys_of)
+    assert started.index("LIST") == 2
+    assert started[-1] == "AUTH c"
+
+
+def test_same_spec_auths_do_not_serialize():
+    async def main():
+        async with running_server() as (_, port):
+            commands = [f"AUTH vm{i} 1 1" for i in range(50)]
+            replies = await send_all(port, commands)
+            assert replies == [f"ВМ vm{i} зарегистрирована и аутентифицирована" for i in range(50)]
+
+    asyncio.run(main())
+
+
+def test_replies_follow_command_order():
+    async def main():
+        async with running_server() as (_, port):
+            replies = await send_all(port, [
+                "ADD_VM a 1 1", "ADD_DISK d1 a 5", "REMOVE_DISK d1", "REMOVE_DISK d1",
+                "NOPE", "LIST_VMS", "", "UPDATE_VM a 2 2", "LIST_VMS",
+            ])
+            assert replies == [
+                "ВМ a добавлена", "Диск d1 добавлен к ВМ a", "Диск d1 удален",
+                "Диск d1 не найден", "Неизвестная команда", "a: 1MB RAM, 1CPU",
+                "Неверная команда", "ВМ a обновлена", "a: 2MB RAM, 2CPU",
+            ]
+
+    asyncio.run(main())
+
+
+class TrackedStorage(MemoryStorage):
+    """Хранилище, считающее одновременно открытые потоковые ответы."""
+
+    def __init__(self):
+        super().__init__(directory="")
+        self.open = self.peak = 0
+
+    async def list_vms(self, list_filter=None):
+        self.open += 1
+        self.peak = max(self.peak, self.open)
+        try:
+            async for chunk in super().list_vms(list_filter):
+                await asyncio.sleep(0.01)
+                yield chunk
+        finally:
+            self.open -= 1
+
+
+def test_one_open_stream_per_connection():
+    async def main():
+        storage = TrackedStorage()
+        async with running_server(storage) as (_, port):
+            await send_all(port, [f"ADD_VM vm{i} 1 1" for i in range(20)])
+            replies = await send_all(port, ["LIST_VMS LIMIT 5"] * 5 + ["STATS"])
+            assert all(reply.startswith("vm0:") for reply in replies[:5])
+        assert storage.peak == 1
+
+    asyncio.run(main())
+
+
+def test_long_bulk_line_is_accepted():
+    async def main():
+        async with running_server() as (_, port):
+            # Строка больше 64 КБ (лимит asyncio по умолчанию), но в пределах MAX_LINE_LENGTH
+            records = " ".join(f"vm-{'x' * 40}-{i} 1 1" for i in range(2000))
+            reply = await send_all(port, [f"BULK_ADD_VM {records}"])
+            assert len(reply[0].splitlines()) == 2000
+
+    asyncio.run(main())
+
+
+def test_stalled_stream_reader_is_disconnected(monkeypatch):
+    monkeypatch.setattr("server.server.STREAM_SEND_TIMEOUT", 0.2)
+
+    async def main():
+        storage = TrackedStorage()
+        async with running_server(storage) as (vm_server, port):
+            await send_all(port, [
+                "BULK_ADD_VM " + " ".join(f"vm-{'x' * 200}-{n}-{i} 1 1" for i in range(3000))
+                for n in range(10)
+            ])
+            sock = socket.socket()
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+            sock.connect(("127.0.0.1", port))
+            reader, writer = await asyncio.open_connection(sock=sock)
+            writer.write(b"LIST_VMS\n")
+            await writer.drain()
+            await asyncio.sleep(0.1)
+            assert storage.open == 1
+            # Клиент не читает ответ: поток прерывается, курсор и место допуска освобождаются
+            for _ in range(50):
+                if not storage.open:
+                    break
+                await asyncio.sleep(0.1)
+            assert storage.open == 0 and vm_server.admission.running == 0
+            assert await send_all(port, ["ADD_VM a 1 1"]) == ["ВМ a добавлена"]
+            writer.close()
+
+    asyncio.run(main())
@@ -0,0 +1,114 @@
+import asyncio
+
+from server.config import LIST_MAX_CURSORS
+from server.replies import ALREADY_EXISTS, AUTH_FAILED, OK
+from server.storage import ListFilter
+from tests.conftest import postgres_storage, requires_postgres
+
+pytestmark = requires_postgres
+
+
+def test_crossing_flag_groups_do_not_deadlock():
+    async def main():
+        async with postgres_storage() as first, postgres_storage(registry_size=0) as second:
+            await first.bulk_add_vms([("vm0", 1, 1), ("vm1", 1, 1)])
+            # Группы двух процессов меняют одни и те же ВМ разными видами изменений:
+            # без общей блокировки каждая захватывает сначала «свою» ВМ, затем чужую
+            first_group = [("auth", "vm0"), ("logout", "vm1")]
+            second_group = [("auth", "vm1"), ("logout", "vm0")]
+            for _ in range(5):
+                results = await asyncio.gather(first.apply_flag_changes(first_group),
+                                               second.apply_flag_changes(second_group))
+                assert all(row is not None for rows in results for row in rows)
+
+    asyncio.run(main())
+
+
+def test_group_commit_keeps_per_vm_order():
+    async def main():
+        async with postgres_storage() as storage:
+            await storage.add_vm("vm1", 1, 1)
+            rows = await storage.apply_flag_changes(
+                [("auth", "vm1"), ("logout", "vm1"), ("auth", "vm1"), ("remove", "missing")]
+            )
+            assert [row["is_auth"] if row else None for row in rows] == [True, False, True, None]
+
+    asyncio.run(main())
+
+
+
+def test_overlapping_bulk_auth_does_not_deadlock():
+    async def main():
+        async with postgres_storage() as first, postgres_storage(registry_size=0) as second:
+            vms = [(f"vm{i}", 1, 1) for i in range(50)]
+            await first.bulk_add_vms(vms)
+            for _ in range(10):
+                replies = await asyncio.gather(first.bulk_authenticate_vms(vms),
+                                               second.bulk_authenticate_vms(vms[::-1]))
+                assert all(status == OK for reply in replies for status in reply.statuses)
+            reply = await first.bulk_authenticate_vms([("vm1", 2, 2), ("new", 1, 1), ("new", 1, 1)])
+            assert reply.statuses == [AUTH_FAILED, OK, OK]
+            assert (await first.add_vm("new", 1, 1)).status == ALREADY_EXISTS
+
+    asyncio.run(main())
+
+
+def test_capacity_resync_keeps_changes_made_during_reload():
+    async def main():
+        async with postgres_storage() as storage:
+            await storage.bulk_add_vms([("vm1", 100, 1), ("vm2", 200, 2)])
+            await storage.add_disk("d1", "vm1", 10)
+            async with storage.acquire() as conn:
+                reload = asyncio.ensure_future(storage.load_capacity(conn))
+                await asyncio.sleep(0)
+                # Изменение, учтенное процессом, пока идет пересчет
+                await storage.add_vm("vm3", 300, 3)
+                await reload
+            capacity = storage.capacity
+            assert (capacity.active_vms, capacity.active_ram) == (3, 600)
+            assert (capacity.disks, capacity.vm_disks) == (1, {"vm1": (1, 10)})
+
+    asyncio.run(main())
+
+
+def test_list_cache_is_invalidated_by_writes():
+    async def main():
+        async with postgres_storage() as storage:
+            cache = storage.list_cache
+            await storage.add_vm("vm1", 1, 1)
+
+            async def list_vms():
+                return b"".join([chunk async for chunk in storage.list_vms(ListFilter())])
+
+            assert await list_vms() == b"vm1: 1MB RAM, 1CPU\n"
+            assert await list_vms() == b"vm1: 1MB RAM, 1CPU\n"
+            assert (cache.misses, cache.hits) == (1, 1)
+            await storage.add_vm("vm2", 2, 2)
+            assert await list_vms() == b"vm1: 1MB RAM, 1CPU\nvm2: 2MB RAM, 2CPU\n"
+            # Изменение другого процесса, пришедшее через NOTIFY
+            async with storage.acquire() as conn:
+                await conn.execute("UPDATE vms SET is_active = FALSE WHERE id = 'vm1'")
+            storage.remote_changed("vm1")
+            assert await list_vms() == b"vm2: 2MB RAM, 2CPU\n"
+            assert cache.misses == 3
+
+    asyncio.run(main())
+
+
+def test_stalled_list_readers_leave_connections_for_other_commands():
+    async def main():
+        async with postgres_storage() as storage:
+            await storage.bulk_add_vms([(f"vm{i}", 1, 1) for i in range(20)])
+            # Клиенты начали LIST_* и не читают ответ: каждый поток держит курсор
+            streams = [storage.list_vms(ListFilter(after=f"vm{i}")) for i in range(12)]
+            pending = [asyncio.ensure_future(anext(stream)) for stream in streams]
+            await asyncio.sleep(0.2)
+            assert sum(task.done() for task in pending) == LIST_MAX_CURSORS
+            assert await asyncio.wait_for(storage.add_vm("new", 1, 1), 1) == "ВМ new добавлена"
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            for stream in streams:
+                await stream.aclose()
+
+    asyncio.run(main())
@@ -0,0 +1,41 @@
+from server.registry import VMRegistry
+
+
+def test_store_after_write_fills_registry():
+    registry = VMRegistry(10)
+    token = registry.invalidate("vm1")
+    registry.store("vm1", token, 1, 2, True, False)
+    assert registry.get("vm1").cpu == 2
+    assert not registry.pending
+
+
+def test_overlapping_write_does_not_store_stale_state():
+    registry = VMRegistry(10)
+    first = registry.invalidate("vm1")
+    second = registry.invalidate("vm1")
+    registry.store("vm1", first, 1, 1, True, False)
+    assert registry.get("vm1") is None
+    registry.store("vm1", second, 2, 2, True, False)
+    assert registry.get("vm1").ram == 2
+
+
+def test_evict_during_write_keeps_state_out():
+    registry = VMRegistry(10)
+    token = registry.invalidate("vm1")
+    registry.evict("vm1")
+    registry.store("vm1", token, 1, 1, True, False)
+    assert registry.get("vm1") is None
+
+
+def test_disabled_registry_keeps_nothing():
+    registry = VMRegistry(0)
+    for i in range(100):
+        registry.store(f"vm{i}", registry.invalidate(f"vm{i}"), 1, 1, True, True)
+    assert not registry.pending and not registry.entries
+
+
+def test_failed_writes_do_not_grow_pending():
+    registry = VMRegistry(5)
+    for i in range(100):
+        registry.invalidate(f"vm{i}")
+    assert len(registry.pending) == 5
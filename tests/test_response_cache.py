@@ -0,0 +1,92 @@
+import asyncio
+
+from server.response_cache import ResponseCache
+
+
+def collect(cache, key, produce):
+    async def run():
+        return [chunk async for chunk in cache.stream(key, produce, str.encode)]
+    return run()
+
+
+def counting_producer(chunks, calls):
+    async def produce():
+        calls.append(1)
+        for chunk in chunks:
+            await asyncio.sleep(0)
+            yield chunk
+    return produce
+
+
+def test_identical_requests_share_one_query_until_data_changes():
+    async def main():
+        cache, calls = ResponseCache(1024), []
+        produce = counting_producer(["a\n", "b\n"], calls)
+        replies = await asyncio.gather(*(collect(cache, "LIST", produce) for _ in range(10)))
+        assert all(b"".join(reply) == b"a\nb\n" for reply in replies)
+        assert len(calls) == 1 and cache.misses == 1 and cache.hits == 9
+
+        cache.bump()
+        assert cache.get("LIST") is None
+        assert b"".join(await collect(cache, "LIST", produce)) == b"a\nb\n"
+        assert len(calls) == 2
+
+    asyncio.run(main())
+
+
+def test_reply_changed_during_query_is_not_stored():
+    async def main():
+        cache, calls = ResponseCache(1024), []
+
+        async def produce():
+            calls.append(1)
+            yield "old\n"
+            cache.bump()
+            yield "rows\n"
+
+        await collect(cache, "LIST", produce)
+        assert cache.get("LIST") is None
+
+    asyncio.run(main())
+
+
+def test_large_reply_is_streamed_without_buffering():
+    async def main():
+        cache, calls = ResponseCache(400), []
+        chunks = ["x" * 60 + "\n"] * 50
+        reply = await collect(cache, "LIST", counting_producer(chunks, calls))
+        assert b"".join(reply) == "".join(chunks).encode()
+        assert cache.size == 0 and not cache.entries
+        await collect(cache, "LIST", counting_producer(chunks, calls))
+        assert len(calls) == 2
+
+    asyncio.run(main())
+
+
+def test_lru_eviction_respects_memory_limit():
+    cache = ResponseCache(100)
+    for key in range(10):
+        cache.put(key, 0, b"x" * 20)
+    assert cache.size <= 100 and cache.evictions == 5
+    assert cache.get(0) is None and cache.get(9) == b"x" * 20
+
+
+def test_slow_first_consumer_does_not_block_identical_request():
+    async def main():
+        cache, calls = ResponseCache(1024, wait_timeout=0.05), []
+        stalled = asyncio.Event()
+
+        async def slow_client():
+            async for _ in cache.stream("LIST", counting_producer(["a\n", "b\n"], calls), str.encode):
+                stalled.set()
+                await asyncio.sleep(10)  # клиент не читает ответ
+
+        first = asyncio.create_task(slow_client())
+        await stalled.wait()
+        produce = counting_producer(["a\n", "b\n"], calls)
+        reply = await asyncio.wait_for(collect(cache, "LIST", produce), 1)
+        assert b"".join(reply) == b"a\nb\n" and len(calls) == 2
+        assert cache.get("LIST") == b"a\nb\n"
+        first.cancel()
+
+    asyncio.run(main())